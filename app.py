@@ -5,14 +5,25 @@ from contextlib import asynccontextmanager
 from connexion.options import SwaggerUIOptions
 import logging.config
 from sqlalchemy.ext.asyncio import (
-    create_async_engine,
     AsyncSession,
     async_sessionmaker,
 )
 from sqlalchemy.exc import OperationalError
 from connexion import AsyncApp, ConnexionMiddleware, request
+from connexion.middleware import MiddlewarePosition
 
 import settings
+from lib.admission import AdmissionMiddleware
+from lib.batching import WriteBatcher
+from lib.capture import TrafficCapture
+from lib.changefeed import ChangeFeed
+from lib.drivers import createEngine
+from lib.jobs import scheduleJobs
+from lib.profiling import ProfilingMiddleware
+from lib.scheduler import Scheduler
+from lib.sharding import Shards
+from lib.tracing import TracingMiddleware, span, traceBuffer
+from lib.warmup import warmUp
 
 
 base_config = {
@@ -29,16 +40,71 @@ async def lifespan_handler(app: ConnexionMiddleware) -> AsyncIterator:
     # Store SessionLocal in app state for access in views
     #   Store config in app state as well
     config = deepcopy(app.options.config)
-    yield {"SessionLocal": app.options.SessionLocal, "config": config}
+    # Orders partitioned over SHARD_URLS, see lib.sharding
+    shards = getattr(app.options, "Shards", None)
+    if shards:
+        await shards.start()
+    # Warm pools, statement caches and schemas up before the server reports ready,
+    #   which it does once this handler yields
+    warmupMs = None
+    if config.get("WARMUP"):
+        warmupMs = await warmUp(
+            app.options.SessionLocal, shards, config.get("WARMUP_PREREAD_TABLES", ())
+        )
+    # Optional single writer that commits order creations in groups, to the main
+    #   database only
+    writeBatcher = None
+    if config.get("WRITE_BATCHING") and not shards:
+        writeBatcher = WriteBatcher(
+            app.options.SessionLocal,
+            batchSize=config.get("WRITE_BATCH_SIZE", 50),
+            maxWait=config.get("WRITE_BATCH_MAX_WAIT", 0.005),
+        )
+        await writeBatcher.start()
+    # Background jobs, run off the request path
+    scheduler = Scheduler(
+        maxConcurrency=config.get("SCHEDULER_MAX_CONCURRENCY", 4),
+        maxWorkers=config.get("SCHEDULER_MAX_WORKERS", 2),
+    )
+    # Fans committed pet and order changes out to GET /changes subscribers
+    changeFeed = None
+    if config.get("CHANGE_FEED_ENABLED"):
+        changeFeed = ChangeFeed(
+            app.options.SessionLocal,
+            queueSize=config.get("CHANGE_FEED_QUEUE_SIZE", 100),
+            pollInterval=config.get("CHANGE_FEED_POLL_INTERVAL", 1.0),
+        )
+        await changeFeed.start()
+    if config.get("SCHEDULER_ENABLED"):
+        scheduleJobs(scheduler, app.options.SessionLocal, config, shards)
+        await scheduler.start()
+    try:
+        yield {
+            "SessionLocal": app.options.SessionLocal,
+            "config": config,
+            "writeBatcher": writeBatcher,
+            "scheduler": scheduler,
+            "changeFeed": changeFeed,
+            "shards": shards,
+            "warmupMs": warmupMs,
+        }
+    finally:
+        await scheduler.stop()
+        if changeFeed:
+            await changeFeed.stop()
+        if writeBatcher:
+            await writeBatcher.stop()
 
 
 @asynccontextmanager
 async def get_session():
     async with request.state.SessionLocal() as session:
         try:
-            await session.begin()
+            with span("session.begin"):
+                await session.begin()
             yield session
-            await session.commit()
+            with span("session.commit"):
+                await session.commit()
         except Exception:
             await session.rollback()
             raise
@@ -66,13 +132,78 @@ def create_app(override_settings: Optional[Dict] = None):
         )
 
         app.add_api(config["specification"], async_=True, swagger_ui_options=options)
+        # Outermost, to see every response including errors and shed requests
+        if config.get("TRAFFIC_CAPTURE"):
+            app.add_middleware(
+                TrafficCapture,
+                position=MiddlewarePosition.BEFORE_EXCEPTION,
+                path=config["TRAFFIC_CAPTURE_PATH"],
+                sampleRate=config.get("TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0),
+                maxBytes=config.get("TRAFFIC_CAPTURE_MAX_BYTES", 64 * 2**20),
+                backupCount=config.get("TRAFFIC_CAPTURE_BACKUPS", 5),
+                maxBody=config.get("TRAFFIC_CAPTURE_MAX_BODY", 64 * 2**10),
+                exemptPaths=config.get("TRAFFIC_CAPTURE_EXEMPT_PATHS", ()),
+            )
+        # Request ids for the logs, and traces of a TRACE_SAMPLE_RATE share of requests
+        #   with their final status, see lib.tracing
+        if config.get("TRACING"):
+            traceBuffer.configure(
+                config.get("TRACE_BUFFER_SIZE", 200), config.get("TRACE_FILE")
+            )
+            app.add_middleware(
+                TracingMiddleware,
+                position=MiddlewarePosition.BEFORE_EXCEPTION,
+                sampleRate=config.get("TRACE_SAMPLE_RATE", 0.0),
+            )
+        # Shed load before routing, so rejected requests cost next to nothing
+        if config.get("ADMISSION_CONTROL"):
+            app.add_middleware(
+                AdmissionMiddleware,
+                position=MiddlewarePosition.BEFORE_ROUTING,
+                limits=config["ADMISSION_LIMITS"],
+                deadline=config.get("ADMISSION_DEADLINE", 1.0),
+                exemptPaths=config.get("ADMISSION_EXEMPT_PATHS", ()),
+            )
+        # Innermost, so profiles cover the handler rather than the middleware stack
+        if config.get("PROFILING"):
+            app.add_middleware(
+                ProfilingMiddleware,
+                position=MiddlewarePosition.BEFORE_CONTEXT,
+                directory=config["PROFILE_DIR"],
+                token=config.get("PROFILE_TOKEN"),
+                sampleRate=config.get("PROFILE_SAMPLE_RATE", 0.0),
+                mode=config.get("PROFILE_MODE", "cprofile"),
+                maxFiles=config.get("PROFILE_MAX_FILES", 100),
+                interval=config.get("PROFILE_STACK_INTERVAL", 0.001),
+            )
         # Put config in connexion middleware options temporarily
         app.middleware.options.config = config
         try:
-            engine = create_async_engine(config.get("DATABASE_URL"), echo=False)
+            # DATABASE_DRIVER picks how statements reach SQLite, see lib.drivers
+            driver = config.get("DATABASE_DRIVER", "aiosqlite")
+            poolSize = config.get("DATABASE_POOL_SIZE", 8)
+            engine = createEngine(config.get("DATABASE_URL"), driver, poolSize)
             app.middleware.options.SessionLocal = async_sessionmaker(
-                bind=engine, class_=AsyncSession, expire_on_commit=False
+                bind=engine,
+                class_=AsyncSession,
+                expire_on_commit=False,
+                # lib.changefeed records writes of sessions flagged with changeLog
+                info={"changeLog": bool(config.get("CHANGE_FEED_ENABLED"))},
             )
+            # One engine per order shard; their writes do not go to the change log
+            app.middleware.options.Shards = None
+            if config.get("SHARD_URLS"):
+                app.middleware.options.Shards = Shards(
+                    [
+                        async_sessionmaker(
+                            bind=createEngine(url, driver, poolSize),
+                            class_=AsyncSession,
+                            expire_on_commit=False,
+                            info={"changeLog": False},
+                        )
+                        for url in config["SHARD_URLS"]
+                    ]
+                )
         except Exception as e:
             logger.error(f"Failed to connect to database: {str(e)}")
             raise RuntimeError(f"Database connection failed: {str(e)}")
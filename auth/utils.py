@@ -3,9 +3,20 @@
 
 from werkzeug.exceptions import Unauthorized
 
+from lib.tracing import traced
+
 testToken = {"sub": "1234567890", "name": "John Doe", "scopes": []}
+#  tokens of the admin endpoints, which check their scope themselves
+testTokens = {
+    "TestAdminJWTtoken": {
+        "sub": "admin",
+        "name": "Jane Admin",
+        "scopes": ["admin:diagnostics"],
+    }
+}
 
 
+@traced("auth.decode_token")
 def decode_token(token, *args, **kwargs) -> dict:
     #  implement method to decode pass auth token and return a decoded user token
     #   mocked sample provded here; only requirement is to pass something
@@ -15,15 +26,17 @@ def decode_token(token, *args, **kwargs) -> dict:
     # except jwt.InvalidTokenError:
     #     raise Unauthorized("Invalid token")
     if token:
-        return testToken
+        return testTokens.get(token, testToken)
 
     raise Unauthorized
 
 
+@traced("auth.token_info")
 def token_info(access_token) -> dict:
     return decode_token(access_token)
 
 
+@traced("auth.validate_scope")
 def validate_scope(required_scopes, token_scopes):
     return True
 
@@ -32,11 +45,13 @@ def validate_scope(required_scopes, token_scopes):
 
 
 #  Validate authorized scope of API token
+@traced("auth.validate_apiscope")
 def validate_apiscope(required_scopes, token_scopes):
     return True
 
 
 #  Validate that api token exists, and is current
 #    Consider storing record of this apitoken use for billing purposes
+@traced("auth.validate_apitoken")
 def validate_apitoken(token, required_scopes) -> dict:
     return testToken
@@ -0,0 +1,78 @@
+#  The aiosqlite driver against the threadpool driver (lib/drivers.py) on a SQLite
+#    file: point reads through PetRepo.fetchById and OrderRepo.fetchById with its
+#    pets, and small writes, a pet created and committed.  Each case runs 200
+#    operations, one at a time and from 16 concurrent tasks.
+#  python -m benchmarks.bench_drivers
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.common import report, timeit
+from lib.drivers import DRIVERS, createEngine
+from lib.seed import seed
+from models.entities import Base
+from models.repositories import OrderRepo, PetRepo
+
+OPERATIONS = 200
+PETS = 10_000
+ORDERS = 5_000
+
+
+async def run(fn, tasks: int) -> None:
+    semaphore = asyncio.Semaphore(tasks)
+
+    async def one(i):
+        async with semaphore:
+            await fn(i)
+
+    await asyncio.gather(*[one(i) for i in range(OPERATIONS)])
+
+
+async def main() -> None:
+    rows = {}
+    for driver in DRIVERS:
+        with tempfile.TemporaryDirectory() as folder:
+            url = f"sqlite+aiosqlite:///{os.path.join(folder, 'bench.db')}"
+            engine = createEngine(url, driver, poolSize=8)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            await seed(engine, pets=PETS, orders=ORDERS, seed=1)
+            SessionLocal = async_sessionmaker(
+                bind=engine, class_=AsyncSession, expire_on_commit=False
+            )
+
+            async def pet(i):
+                async with SessionLocal() as session:
+                    assert await PetRepo.fetchById(session, i % PETS + 1)
+
+            async def order(i):
+                async with SessionLocal() as session:
+                    assert await OrderRepo.fetchById(
+                        session, i % ORDERS + 1, includePets=True
+                    )
+
+            async def write(i):
+                async with SessionLocal() as session:
+                    await PetRepo.create(session, {"name": f"bench{i}"})
+                    await session.commit()
+
+            for tasks in (1, 16):
+                for name, fn in (
+                    ("pet by id", pet),
+                    ("order + pets", order),
+                    ("create pet", write),
+                ):
+                    rows[f"{name}, {tasks} task(s), {driver}"] = await timeit(
+                        lambda fn=fn: run(fn, tasks), repeat=5
+                    )
+            await engine.dispose()
+    report(
+        f"{OPERATIONS} operations",
+        dict(sorted(rows.items(), key=lambda row: row[0].rsplit(",", 1)[0])),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
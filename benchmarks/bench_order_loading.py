@@ -0,0 +1,67 @@
+#  Compares joinedload and selectinload for the order pet lines, on orders with
+#    1, 10 and 100 lines, for a page of orders and for a single order.  "previous"
+#    is the old query, which joined both the lines and the pets.
+#  python -m benchmarks.bench_order_loading
+import asyncio
+
+from sqlalchemy import sql
+from sqlalchemy.orm import joinedload, selectinload
+
+from benchmarks.common import makeSessionLocal, report, timeit
+from models.entities import Order, OrderPet, Pet
+from models.repositories import OrderRepo
+
+ORDERS = 50
+PAGE = 20
+
+
+async def seed(SessionLocal, lines: int) -> None:
+    async with SessionLocal() as session:
+        pets = [Pet(name=f"pet{i}", description="x" * 200) for i in range(lines)]
+        session.add_all(pets)
+        await session.flush()
+        for _ in range(ORDERS):
+            order = Order(status="placed")
+            order.pet_ids = [OrderPet(pet_id=pet.id, quantity=1) for pet in pets]
+            session.add(order)
+        await session.commit()
+
+
+async def main() -> None:
+    for lines in (1, 10, 100):
+        engine, SessionLocal = await makeSessionLocal()
+        await seed(SessionLocal, lines)
+        rows = {}
+
+        async def previous():
+            async with SessionLocal() as session:
+                stmt = sql.select(Order).order_by(Order.id).limit(PAGE)
+                stmt = stmt.options(joinedload(Order.pet_ids), joinedload(Order.pets))
+                result = await session.execute(stmt)
+                assert len(result.unique().scalars().all()) == PAGE
+
+        rows[f"fetchAll limit={PAGE}, previous"] = await timeit(previous)
+        for name, loader in (("joined", joinedload), ("selectin", selectinload)):
+
+            async def page():
+                async with SessionLocal() as session:
+                    orders = await OrderRepo.fetchAll(
+                        session, includePets=True, limit=PAGE, loader=loader
+                    )
+                    assert len(orders) == PAGE
+                    assert all(len(order.pet_ids) == lines for order in orders)
+
+            async def one():
+                async with SessionLocal() as session:
+                    await OrderRepo.fetchById(
+                        session, 1, includePets=True, loader=loader
+                    )
+
+            rows[f"fetchAll limit={PAGE}, {name}"] = await timeit(page)
+            rows[f"fetchById, {name}"] = await timeit(one)
+        report(f"Orders with {lines} line(s)", rows)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+#  Order creation throughput against a SQLite file: every order in its own
+#    transaction, as views.order.add does by default, against WRITE_BATCHING's
+#    single writer committing orders in groups.  "spread" orders each reserve a pet
+#    of their own, "contended" orders all go after the same 10 pets, so all but 10
+#    are rejected by the reservation UPDATE.  Orders that fail with "database is
+#    locked" are counted, not retried.
+#  python -m benchmarks.bench_order_writes
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.common import makeSessionLocal
+from lib.batching import WriteBatcher
+from models.entities import Pet
+from schemas.schemas import OrderSchema
+from views.order import OrderRejected, _create
+
+ORDERS = 1000
+CLIENTS = (1, 16, 64)
+SCENARIOS = {"spread": ORDERS, "contended": 10}
+
+
+async def seed(SessionLocal, pets: int) -> None:
+    async with SessionLocal() as session:
+        session.add_all([Pet(name=f"pet{i}") for i in range(pets)])
+        await session.commit()
+
+
+async def run(batching: bool, clients: int, pets: int):
+    with tempfile.TemporaryDirectory() as folder:
+        url = f"sqlite+aiosqlite:///{os.path.join(folder, 'bench.db')}"
+        engine, SessionLocal = await makeSessionLocal(url)
+        await seed(SessionLocal, pets)
+        batcher = WriteBatcher(SessionLocal)
+        await batcher.start()
+        semaphore = asyncio.Semaphore(clients)
+        counts = {"placed": 0, "rejected": 0, "locked": 0}
+
+        async def add(i):
+            data = OrderSchema().load(
+                {"petIds": [{"petId": i % pets + 1, "quantity": 1}]}
+            )
+            async with semaphore:
+                try:
+                    if batching:
+                        await batcher.submit(
+                            lambda session: _create(session, OrderSchema(), data)
+                        )
+                    else:
+                        async with SessionLocal() as session:
+                            async with session.begin():
+                                await _create(session, OrderSchema(), data)
+                    counts["placed"] += 1
+                except OrderRejected:
+                    counts["rejected"] += 1
+                except OperationalError:
+                    counts["locked"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[add(i) for i in range(ORDERS)])
+        elapsed = time.perf_counter() - start
+        await batcher.stop()
+        await engine.dispose()
+        assert counts["placed"] <= pets
+        return ORDERS / elapsed, counts
+
+
+async def main() -> None:
+    for scenario, pets in SCENARIOS.items():
+        print(f"\n{ORDERS} {scenario} orders for {pets} pets, requests per second")
+        for clients in CLIENTS:
+            for name, batching in (
+                ("transaction per order", False),
+                ("batching", True),
+            ):
+                rate, counts = await run(batching, clients, pets)
+                print(
+                    f"  {clients:>3} clients  {name:<22} {rate:8.1f}   "
+                    + "  ".join(f"{key} {value}" for key, value in counts.items())
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+#  List pages of 10k pets and 10k orders (2 lines each), loaded as ORM entities by
+#    fetchAll against Core rows by fetchAllRows, each dumped by the view's schema.
+#    Time is the median of repeated fetch + dump; memory is the tracemalloc peak of
+#    one fetch + dump.
+#  python -m benchmarks.bench_read_rows
+import asyncio
+import tracemalloc
+
+from benchmarks.common import makeSessionLocal, report, timeit
+from lib.seed import seed
+from models.entities import Order, OrderPet
+from models.repositories import OrderRepo, PetRepo
+from schemas.schemas import OrderPetSchema, OrderSchema, PetSchema
+
+PAGE = 10_000
+
+
+async def peak(fn) -> float:
+    tracemalloc.start()
+    await fn()
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size / 2**20
+
+
+async def main() -> None:
+    engine, SessionLocal = await makeSessionLocal()
+    await seed(engine, pets=PAGE, orders=PAGE // 2, seed=1)
+    # a second page of orders with exactly two lines each
+    async with SessionLocal() as session:
+        for i in range(PAGE):
+            order = Order(status="placed")
+            order.pet_ids = [
+                OrderPet(pet_id=(2 * i) % PAGE + 1, quantity=1),
+                OrderPet(pet_id=(2 * i + 1) % PAGE + 1, quantity=1),
+            ]
+            session.add(order)
+        await session.commit()
+
+    cases = {}
+    for name, fetch in (("orm", PetRepo.fetchAll), ("rows", PetRepo.fetchAllRows)):
+
+        async def pets(fetch=fetch):
+            async with SessionLocal() as session:
+                page = await fetch(session, limit=PAGE)
+                assert len(PetSchema(many=True).dump(page)) == PAGE
+
+        cases[f"pets, {name}"] = pets
+    for name, fetch in (("orm", OrderRepo.fetchAll), ("rows", OrderRepo.fetchAllRows)):
+        for includePets, schema in ((False, OrderSchema), (True, OrderPetSchema)):
+
+            async def orders(fetch=fetch, includePets=includePets, schema=schema):
+                async with SessionLocal() as session:
+                    page = await fetch(
+                        session, includePets=includePets, limit=PAGE, offset=PAGE // 2
+                    )
+                    assert len(schema(many=True).dump(page)) == PAGE
+
+            pets = " + pets" if includePets else ""
+            cases[f"orders{pets}, {name}"] = orders
+
+    rows = {name: await timeit(fn, repeat=5) for name, fn in cases.items()}
+    report(f"Pages of {PAGE} rows, fetch + dump", rows)
+    print("\nPeak traced memory, fetch + dump")
+    for name, fn in cases.items():
+        print(f"  {name:<40} {await peak(fn):8.1f} MiB")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+#  Order creation throughput with orders sharded over 1, 2 and 4 SQLite files, every
+#    order in its own transaction from 32 concurrent clients.  "orders only" stores
+#    orders without pet lines, so the shards take all the writes; "with reservation"
+#    also reserves a pet per order in the main database first, as views.order.add does,
+#    and that single file caps how far sharding can scale.  Orders that fail with
+#    "database is locked" are counted, not retried.
+#  python -m benchmarks.bench_sharded_writes
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from benchmarks.common import makeSessionLocal
+from lib.sharding import Shards
+from models.entities import Pet
+from schemas.schemas import OrderSchema
+from views.order import _reserve, _store
+
+ORDERS = 2000
+CLIENTS = 32
+SHARD_COUNTS = (1, 2, 4)
+
+
+async def run(shardCount: int, reserve: bool):
+    with tempfile.TemporaryDirectory() as folder:
+        url = f"sqlite+aiosqlite:///{os.path.join(folder, 'main.db')}"
+        engine, SessionLocal = await makeSessionLocal(url)
+        async with SessionLocal() as session:
+            session.add_all([Pet(name=f"pet{i}") for i in range(ORDERS)])
+            await session.commit()
+        engines = [
+            create_async_engine(f"sqlite+aiosqlite:///{folder}/orders-{index}.db")
+            for index in range(shardCount)
+        ]
+        shards = Shards(
+            [async_sessionmaker(bind=shard, class_=AsyncSession) for shard in engines]
+        )
+        await shards.start()
+        semaphore = asyncio.Semaphore(CLIENTS)
+        counts = {"placed": 0, "locked": 0}
+
+        async def add(i):
+            petIds = [{"petId": i + 1, "quantity": 1}] if reserve else []
+            data = OrderSchema().load({"petIds": petIds})
+            async with semaphore:
+                try:
+                    if reserve:
+                        async with SessionLocal() as session:
+                            async with session.begin():
+                                await _reserve(session, data["petIds"])
+                    index = shards.pick()
+                    async with shards.session(index) as session:
+                        await _store(
+                            session, OrderSchema(), data, shard=(index, shards.count)
+                        )
+                    counts["placed"] += 1
+                except OperationalError:
+                    counts["locked"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[add(i) for i in range(ORDERS)])
+        elapsed = time.perf_counter() - start
+        for shard in engines:
+            await shard.dispose()
+        await engine.dispose()
+        return ORDERS / elapsed, counts
+
+
+async def main() -> None:
+    for name, reserve in (("orders only", False), ("with reservation", True)):
+        print(f"\n{ORDERS} orders, {name}, {CLIENTS} clients, orders per second")
+        for shardCount in SHARD_COUNTS:
+            rate, counts = await run(shardCount, reserve)
+            print(
+                f"  {shardCount} shard(s)  {rate:8.1f}   "
+                + "  ".join(f"{key} {value}" for key, value in counts.items())
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+#  Shared setup for the benchmark scripts.  Run them from the repository root, e.g.
+#    python -m benchmarks.bench_order_loading
+import statistics
+import time
+from typing import Awaitable, Callable, Dict
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from models.entities import Base
+
+
+async def makeSessionLocal(url: str = "sqlite+aiosqlite:///:memory:"):
+    engine = create_async_engine(url, echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    return engine, SessionLocal
+
+
+async def timeit(fn: Callable[[], Awaitable], repeat: int = 20) -> Dict[str, float]:
+    #  Runs fn once to warm up, then repeat times; returns timings in milliseconds
+    await fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "max": max(timings),
+    }
+
+
+def report(title: str, rows: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n{title}")
+    for name, timing in rows.items():
+        print(
+            f"  {name:<40} median {timing['median']:8.2f} ms"
+            f"   min {timing['min']:8.2f} ms   max {timing['max']:8.2f} ms"
+        )
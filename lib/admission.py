@@ -0,0 +1,159 @@
+#  Admission control: caps the requests in flight per class (reads and writes), with a
+#    short bounded queue in front of each cap.  A request is turned away at once with
+#    503 and Retry-After when its queue is full or the wait it can expect, from the
+#    recent service time, is longer than the deadline; a queued request that is still
+#    waiting at the deadline is turned away too.  Shedding early keeps the latency of
+#    admitted requests flat instead of letting every request queue on the database.
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger("app.admission")
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Overloaded(Exception):
+    def __init__(self, retryAfter: float):
+        super().__init__(f"Overloaded, retry after {retryAfter:.1f}s")
+        self.retryAfter = retryAfter
+
+
+class AdmissionLimiter:
+    def __init__(
+        self,
+        name: str,
+        maxInFlight: int = 16,
+        maxQueue: int = 32,
+        deadline: float = 1.0,
+    ):
+        self.name = name
+        self.maxInFlight = maxInFlight
+        self.maxQueue = maxQueue
+        self.deadline = deadline
+        self.inFlight = 0
+        self.waiters = deque()
+        self.serviceTime = 0.05  # moving average of request seconds, primed low
+
+    def estimatedWait(self) -> float:
+        return (len(self.waiters) + 1) * self.serviceTime / self.maxInFlight
+
+    async def acquire(self) -> None:
+        """Take a slot, waiting in the queue if needed, or raise Overloaded"""
+        if self.inFlight < self.maxInFlight and not self.waiters:
+            self.inFlight += 1
+            self._report()
+            return
+        wait = self.estimatedWait()
+        if len(self.waiters) >= self.maxQueue or wait > self.deadline:
+            self._reject(wait)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self._report()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.deadline)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over as we gave up, pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+                self._report()
+            if isinstance(err, asyncio.CancelledError):
+                raise
+            self._reject(self.estimatedWait())
+        metrics.timing(
+            f"admission.{self.name}.wait", (time.perf_counter() - start) * 1000
+        )
+
+    def release(self, duration: Optional[float] = None) -> None:
+        if duration is not None:
+            self.serviceTime += 0.1 * (duration - self.serviceTime)
+        # hand the slot straight to the next waiter, so it cannot be taken by a
+        #   newcomer first
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                self._report()
+                return
+        self.inFlight -= 1
+        self._report()
+
+    def _reject(self, wait: float) -> None:
+        metrics.incr(f"admission.{self.name}.rejected")
+        raise Overloaded(max(wait, self.serviceTime))
+
+    def _report(self) -> None:
+        metrics.gauge(f"admission.{self.name}.inFlight", self.inFlight)
+        metrics.gauge(f"admission.{self.name}.queued", len(self.waiters))
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting requests through a read or a write limiter"""
+
+    def __init__(
+        self,
+        app,
+        limits: Dict[str, Dict],
+        deadline: float = 1.0,
+        exemptPaths: Tuple[str, ...] = (),
+    ):
+        self.app = app
+        self.limiters = {
+            name: AdmissionLimiter(name, deadline=deadline, **limit)
+            for name, limit in limits.items()
+        }
+        self.exemptPaths = tuple(exemptPaths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exemptPaths):
+            await self.app(scope, receive, send)
+            return
+        name = "read" if scope["method"] in READ_METHODS else "write"
+        limiter = self.limiters.get(name)
+        if not limiter:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Overloaded as err:
+            logger.warning(f"Shed {scope['method']} {scope['path']}: {str(err)}")
+            await self._shed(send, err.retryAfter)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
+
+    @staticmethod
+    async def _shed(send, retryAfter: float) -> None:
+        body = json.dumps(
+            {
+                "detail": "Server is busy, retry later",
+                "status": 503,
+                "title": "Service Unavailable",
+                "type": "Overload",
+            }
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/problem+json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(retryAfter))).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
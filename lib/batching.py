@@ -0,0 +1,119 @@
+#  Group commit for writes.  With SQLite there is only ever one writer, so rather
+#    than every request running its own transaction (and fsync) and queueing on the
+#    database lock, writes are queued to a single writer task that runs several of
+#    them in one transaction.  Each write runs inside its own SAVEPOINT, so a write
+#    that fails is rolled back on its own and only its caller sees the error.
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .metrics import metrics
+
+logger = logging.getLogger("app.batching")
+
+Work = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteBatcher:
+    def __init__(self, SessionLocal, batchSize: int = 50, maxWait: float = 0.005):
+        self.SessionLocal = SessionLocal
+        self.batchSize = batchSize
+        self.maxWait = maxWait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.lastSize = 0
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        #  writes already queued are still committed
+        if self.task:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def submit(self, work: Work) -> Any:
+        """Queue work(session) and wait for the batch it runs in to commit.  Returns
+        what work returned, or raises what it raised."""
+        if self.task is None:
+            raise RuntimeError("WriteBatcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((work, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            #  only hold a batch open for more writes when the last one had company,
+            #    so a lone writer is never delayed by maxWait
+            deadline = loop.time() + (self.maxWait if self.lastSize > 1 else 0)
+            while len(batch) < self.batchSize:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.lastSize = len(batch)
+            try:
+                await self._commit(batch)
+            except Exception as err:
+                #  never let the writer task die; fail this batch's callers instead
+                logger.error(f"Write batch failed: {str(err)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+    async def _commit(self, batch: List[Tuple[Work, asyncio.Future]]) -> None:
+        batch = [(work, future) for work, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        results = []
+        try:
+            async with self.SessionLocal() as session:
+                async with session.begin():
+                    for work, future in batch:
+                        try:
+                            async with session.begin_nested():
+                                results.append((future, await work(session), None))
+                        except Exception as err:
+                            results.append((future, None, err))
+        except Exception as err:
+            #  the commit itself failed; run each write in its own transaction so
+            #    one bad write cannot fail the others
+            logger.warning(f"Write batch commit failed, retrying singly: {str(err)}")
+            if len(batch) > 1:
+                for item in batch:
+                    await self._commit([item])
+                return
+            results = [(batch[0][1], None, err)]
+
+        for future, result, err in results:
+            if future.done():
+                continue
+            if err is not None:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+        metrics.incr("writebatch.batches")
+        metrics.incr("writebatch.writes", len(batch))
+        metrics.gauge("writebatch.lastSize", len(batch))
+        metrics.timing("writebatch.commit", (time.perf_counter() - start) * 1000)
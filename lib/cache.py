@@ -0,0 +1,136 @@
+#  Response cache for list reads, invalidated by per-table generation counters
+#
+#  Every flush, commit or rollback of a session that wrote a table bumps that table's
+#    generation (bulk statements are seen through do_orm_execute).  A cached response
+#    is stored with the generations of its tables read before the query ran, and is
+#    only served while they are unchanged, so writes never scan the cache.  Bodies are
+#    kept JSON encoded, a hit skips the query and the serialization.
+#
+#  Generations are per worker process; RESPONSE_CACHE_MAX_AGE bounds how stale an
+#    entry can get from writes made by other workers.
+import functools
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from connexion import request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+
+from .metrics import metrics
+
+generations: Dict[str, int] = defaultdict(int)
+
+
+def bump(tables: Iterable[str]) -> None:
+    for table in tables:
+        generations[table] += 1
+
+
+def _written(session) -> set:
+    return session.info.setdefault("writtenTables", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _bumpFlush(session, flush_context):
+    tables = {
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, "__table__")
+    }
+    _written(session).update(tables)
+    bump(tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bumpStatement(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        table = state.statement.table.name
+        _written(state.session).add(table)
+        bump([table])
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _bumpEnd(session, *args):
+    #  Readers that ran while the transaction was open saw the old rows or the
+    #    uncommitted ones, either way their entries must not outlive it
+    bump(session.info.pop("writtenTables", ()))
+
+
+class ResponseCache:
+    """LRU of encoded response bodies, bounded by their total bytes"""
+
+    def __init__(self, maxBytes: int = 16 * 2**20, maxAge: float = 60.0):
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.entries: "OrderedDict[str, Tuple]" = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str, versions: Tuple[int, ...]) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entryVersions, expires, body = entry
+        if entryVersions != versions or expires < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, versions: Tuple[int, ...], body: bytes) -> None:
+        if len(body) > self.maxBytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (versions, time.monotonic() + self.maxAge, body)
+        self.size += len(key) + len(body)
+        while self.size > self.maxBytes:
+            self._remove(next(iter(self.entries)))
+        metrics.gauge("responsecache.bytes", self.size)
+
+    def _remove(self, key: str) -> None:
+        versions, expires, body = self.entries.pop(key)
+        self.size -= len(key) + len(body)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+responseCache = ResponseCache()
+
+
+def cached(operationId: str, tables: Tuple[str, ...]):
+    """Decorate a read view to serve its 200 responses from the response cache until
+    one of tables is written.  Turned off when RESPONSE_CACHE_BYTES is 0."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            config = request.state.config
+            if not config.get("RESPONSE_CACHE_BYTES"):
+                return await view(*args, **kwargs)
+            responseCache.maxBytes = config["RESPONSE_CACHE_BYTES"]
+            responseCache.maxAge = config.get("RESPONSE_CACHE_MAX_AGE", 60.0)
+
+            key = operationId + json.dumps([args, sorted(kwargs.items())], default=str)
+            versions = tuple(generations[table] for table in tables)
+            body = responseCache.get(key, versions)
+            if body is not None:
+                metrics.incr(f"responsecache.{operationId}.hits")
+                return Response(body, media_type="application/json")
+            metrics.incr(f"responsecache.{operationId}.misses")
+
+            result = await view(*args, **kwargs)
+            if not (isinstance(result, tuple) and result[1:] == (200,)):
+                return result
+            body = json.dumps(result[0]).encode()
+            responseCache.put(key, versions, body)
+            return Response(body, media_type="application/json")
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,124 @@
+#  Traffic capture: writes a sample of the requests the app serves to a rotating JSONL
+#    file, for python -m lib.replay to play back against another build offline.
+#
+#  Each line holds the request's start time, method, path, query string, a few
+#    headers and its body (cut at maxBody bytes), with the response status and the
+#    milliseconds to the end of the response.  Credentials are never written: only
+#    the scheme of the Authorization header is kept, and whether an API key was sent.
+#
+#  Lines are handed to a logging QueueListener thread, which does the file writes and
+#    the rotation, so a sampled request only pays for encoding its line.  Requests
+#    that are not sampled go straight through.
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Tuple
+
+from .metrics import metrics
+
+CAPTURED_HEADERS = ("content-type", "accept", "idempotency-key", "last-event-id")
+
+
+class TrafficCapture:
+    """ASGI middleware writing a sampleRate share of the requests to path"""
+
+    def __init__(
+        self,
+        app,
+        path: str,
+        sampleRate: float = 1.0,
+        maxBytes: int = 64 * 2**20,
+        backupCount: int = 5,
+        maxBody: int = 64 * 2**10,
+        exemptPaths: Tuple[str, ...] = (),
+    ):
+        self.app = app
+        self.sampleRate = sampleRate
+        self.maxBody = maxBody
+        self.exemptPaths = tuple(exemptPaths)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(
+            self.queue,
+            RotatingFileHandler(
+                path, maxBytes=maxBytes, backupCount=backupCount, delay=True
+            ),
+        )
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        #  writes out the queued lines
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(self.exemptPaths)
+            or random.random() >= self.sampleRate
+        ):
+            await self.app(scope, receive, send)
+            return
+        started = time.time()
+        start = time.perf_counter()
+        body = bytearray()
+        size = 0
+        status = None
+
+        async def receiveBody():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                body.extend(chunk[: self.maxBody - len(body)])
+            return message
+
+        async def sendStatus(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receiveBody, sendStatus)
+        finally:
+            self.write(
+                {
+                    "t": started,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope["query_string"].decode("latin-1"),
+                    **_headers(scope),
+                    "body": body.decode("utf-8", "replace") if body else None,
+                    "truncated": size > len(body),
+                    "status": status,
+                    "ms": round((time.perf_counter() - start) * 1000, 3),
+                }
+            )
+
+    def write(self, record: Dict) -> None:
+        self.queue.put_nowait(logging.makeLogRecord({"msg": json.dumps(record)}))
+        metrics.incr("traffic.captured")
+
+
+def _headers(scope) -> Dict:
+    headers = {}
+    auth: Optional[str] = None
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").lower()
+        if name in CAPTURED_HEADERS:
+            headers[name] = value.decode("latin-1")
+        elif name == "authorization":
+            auth = value.decode("latin-1").split(" ", 1)[0]
+        elif name == "x-apikey" and not auth:
+            auth = "apiKey"
+    return {"headers": headers, "auth": auth}
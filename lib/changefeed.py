@@ -0,0 +1,246 @@
+#  Change feed of pet and order writes, streamed to clients as server-sent events
+#
+#  Every flush that creates, updates or deletes a Pet or Order adds a row to the
+#    change_log table in the same transaction, so an event exists only if its write was
+#    committed and its id gives the commit order.  After commit the ChangeFeed is woken,
+#    reads the new rows and fans them out to its subscribers.  A client that reconnects
+#    with Last-Event-ID is first replayed the rows it missed from change_log.
+#
+#  Each subscriber has a bounded queue, a consumer that falls behind by more than
+#    queueSize events is disconnected rather than buffered without limit; it can
+#    reconnect with its Last-Event-ID and catch up from the table.
+import asyncio
+import datetime
+import json
+import logging
+import weakref
+from typing import AsyncIterator, Dict, Optional, Set
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from models.entities import ChangeLog, Order, OrderPet, Pet
+from models.repositories import ChangeRepo
+from .metrics import metrics
+
+logger = logging.getLogger("app.changefeed")
+
+_feeds = weakref.WeakSet()
+_entities = {Pet: "pet", Order: "order"}
+_priority = {"create": 0, "delete": 1, "update": 2}
+
+
+@event.listens_for(Session, "after_flush")
+def _recordFlush(session, flush_context):
+    if not session.info.get("changeLog"):
+        return
+    changes = {}
+
+    def add(entity, id, action, status):
+        key = (entity, id)
+        if key not in changes or _priority[action] < _priority[changes[key]["action"]]:
+            changes[key] = {
+                "entity": entity,
+                "entity_id": id,
+                "action": action,
+                "status": status,
+            }
+
+    for objects, action in (
+        (session.new, "create"),
+        (session.dirty, "update"),
+        (session.deleted, "delete"),
+    ):
+        for obj in objects:
+            entity = _entities.get(type(obj))
+            if entity:
+                if action != "update" or session.is_modified(
+                    obj, include_collections=False
+                ):
+                    add(entity, obj.id, action, obj.status)
+            elif isinstance(obj, OrderPet):
+                # a changed line is an update of its order
+                order = session.identity_map.get((Order, (obj.order_id,), None))
+                add("order", obj.order_id, "update", order.status if order else None)
+    if changes:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        session.connection().execute(
+            insert(ChangeLog), [{**row, "created_at": now} for row in changes.values()]
+        )
+        session.info["changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _notifyCommit(session):
+    if session.info.pop("changed", False):
+        for feed in list(_feeds):
+            feed.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _clearRollback(session):
+    session.info.pop("changed", None)
+
+
+def formatEvent(row: ChangeLog) -> str:
+    data = {
+        "id": row.id,
+        "entity": row.entity,
+        "entityId": row.entity_id,
+        "action": row.action,
+        "status": row.status,
+        "at": row.created_at.isoformat(),
+    }
+    return (
+        f"id: {row.id}\nevent: {row.entity}.{row.action}\ndata: {json.dumps(data)}\n\n"
+    )
+
+
+class Subscriber:
+    def __init__(
+        self,
+        entity: Optional[str] = None,
+        status: Optional[str] = None,
+        queueSize: int = 100,
+    ):
+        self.entity = entity
+        self.status = status
+        self.queue = asyncio.Queue(maxsize=queueSize)
+        self.dropped = False
+
+    def matches(self, row: ChangeLog) -> bool:
+        return (not self.entity or row.entity == self.entity) and (
+            not self.status or row.status == self.status
+        )
+
+    def put(self, row: ChangeLog) -> bool:
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except asyncio.QueueFull:
+            # too slow, drop its backlog and end its stream
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class ChangeFeed:
+    def __init__(
+        self,
+        SessionLocal,
+        queueSize: int = 100,
+        pollInterval: float = 1.0,
+        keepAlive: float = 15.0,
+        pageSize: int = 500,
+    ):
+        self.SessionLocal = SessionLocal
+        self.queueSize = queueSize
+        self.pollInterval = pollInterval
+        self.keepAlive = keepAlive
+        self.pageSize = pageSize
+        self.subscribers: Set[Subscriber] = set()
+        self.lastId = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        async with self.SessionLocal() as session:
+            self.lastId = await ChangeRepo.lastId(session)
+        self._task = asyncio.create_task(self._run())
+        _feeds.add(self)
+
+    async def stop(self) -> None:
+        _feeds.discard(self)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscriber in list(self.subscribers):
+            subscriber.put(None)
+
+    def notify(self) -> None:
+        #  Called after a commit, which may be on a thread other than the loop's
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.pollInterval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._poll()
+            except Exception as err:
+                logger.error(f"Change feed poll failed: {str(err)}")
+
+    async def _poll(self) -> None:
+        while True:
+            async with self.SessionLocal() as session:
+                rows = await ChangeRepo.fetchSince(
+                    session, self.lastId, limit=self.pageSize
+                )
+            for row in rows:
+                self.publish(row)
+            if len(rows) < self.pageSize:
+                return
+
+    def publish(self, row: ChangeLog) -> None:
+        self.lastId = max(self.lastId, row.id)
+        metrics.incr("changefeed.events")
+        for subscriber in list(self.subscribers):
+            if subscriber.matches(row) and not subscriber.put(row):
+                self.subscribers.discard(subscriber)
+                metrics.incr("changefeed.dropped")
+                logger.info("Disconnected a slow change feed subscriber")
+        metrics.gauge("changefeed.subscribers", len(self.subscribers))
+
+    async def stream(
+        self,
+        entity: Optional[str] = None,
+        status: Optional[str] = None,
+        lastEventId: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """Yield server-sent events for matching changes, after replaying those since
+        lastEventId"""
+        subscriber = Subscriber(entity, status, self.queueSize)
+        # subscribe before replaying, so nothing committed in between is missed
+        self.subscribers.add(subscriber)
+        metrics.gauge("changefeed.subscribers", len(self.subscribers))
+        try:
+            sentId = self.lastId if lastEventId is None else lastEventId
+            upTo = self.lastId
+            while sentId < upTo:
+                async with self.SessionLocal() as session:
+                    rows = await ChangeRepo.fetchSince(
+                        session, sentId, entity, status, limit=self.pageSize
+                    )
+                for row in rows:
+                    yield formatEvent(row)
+                    sentId = row.id
+                if len(rows) < self.pageSize:
+                    break
+            yield "retry: 2000\n\n"
+            while True:
+                try:
+                    row = await asyncio.wait_for(subscriber.queue.get(), self.keepAlive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if row is None:
+                    return
+                if row.id > sentId:
+                    yield formatEvent(row)
+                    sentId = row.id
+        finally:
+            self.subscribers.discard(subscriber)
+            metrics.gauge("changefeed.subscribers", len(self.subscribers))
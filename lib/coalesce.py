@@ -0,0 +1,80 @@
+#  Single-flight coalescing of identical concurrent reads.  The first request for a
+#    key runs the view; requests for the same key that arrive while it is running
+#    wait for, and share, its result (or its error) instead of running their own
+#    query and serialization.
+import asyncio
+import functools
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from connexion import request
+
+from .metrics import metrics
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    #  cancelOnLeave=False keeps the shared task running after every waiter has gone,
+    #    for work such as writes that should not be abandoned half way
+    def __init__(self, name: str, cancelOnLeave: bool = True):
+        self.name = name
+        self.cancelOnLeave = cancelOnLeave
+        self.flights: Dict[Hashable, _Flight] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        flight = self.flights.get(key)
+        metrics.incr(f"coalesce.{self.name}.calls")
+        if flight is None:
+            flight = self.flights[key] = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda task: self._done(key, flight))
+        else:
+            metrics.incr(f"coalesce.{self.name}.shared")
+        counters = metrics.counters
+        metrics.gauge(
+            f"coalesce.{self.name}.ratio",
+            counters[f"coalesce.{self.name}.shared"]
+            / counters[f"coalesce.{self.name}.calls"],
+        )
+
+        flight.waiters += 1
+        try:
+            #  shield, so one waiter going away does not cancel the shared query
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if self.cancelOnLeave and flight.waiters == 1 and not flight.task.done():
+                #  the last waiter went away, nobody wants the result any more
+                self._done(key, flight)
+                flight.task.cancel()
+                metrics.incr(f"coalesce.{self.name}.cancelled")
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _done(self, key: Hashable, flight: _Flight) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+def coalesce(operationId: str):
+    """Decorate a read view so identical concurrent calls share one execution,
+    keyed by operationId and the view's normalized parameters.  Turned off with the
+    COALESCE_READS setting."""
+
+    flight = SingleFlight(operationId)
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if not request.state.config.get("COALESCE_READS"):
+                return await view(*args, **kwargs)
+            key = json.dumps([args, sorted(kwargs.items())], default=str)
+            return await flight.do(key, lambda: view(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
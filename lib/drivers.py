@@ -0,0 +1,252 @@
+#  Database driver backends for the app's async engines, chosen by DATABASE_DRIVER.
+#
+#  "aiosqlite" is SQLAlchemy's default: a thread per connection, and a queue hop to it
+#    for every cursor operation (open, execute, fetch, close).
+#  "threadpool" keeps SQLAlchemy's aiosqlite dialect and pool, so sessions and
+#    get_session are unchanged, but hands it connections of our own: stdlib sqlite3
+#    connections run on a ThreadPoolExecutor of DATABASE_POOL_SIZE threads, one per
+#    pooled connection.  A statement is executed and its rows fetched in a single hop;
+#    opening and closing cursors, and ending a transaction that wrote nothing, do not
+#    leave the event loop, so a point read is one hop where aiosqlite makes six.  A
+#    connection is only ever used by the session that checked it out, one call at a
+#    time, so it may move between the executor's threads.  engine.dispose() shuts the
+#    threads down; an engine used again after it starts new ones.
+import asyncio
+import functools
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+DRIVERS = ("aiosqlite", "threadpool")
+
+
+def createEngine(url: str, driver: str = "aiosqlite", poolSize: int = 8) -> AsyncEngine:
+    if driver == "aiosqlite":
+        return create_async_engine(url, echo=False)
+    if driver != "threadpool":
+        raise ValueError(f"Unknown DATABASE_DRIVER {driver}, expected one of {DRIVERS}")
+    sqlUrl = make_url(url)
+    if not sqlUrl.drivername.startswith("sqlite"):
+        raise ValueError(f"The threadpool driver only supports SQLite, not {url}")
+    database = sqlUrl.database or ":memory:"
+    threads = _Threads(poolSize)
+    # in-memory databases get the dialect's single shared connection
+    poolArgs = (
+        {} if database == ":memory:" else {"pool_size": poolSize, "max_overflow": 0}
+    )
+    engine = create_async_engine(
+        url,
+        echo=False,
+        async_creator=functools.partial(connect, database, threads),
+        **poolArgs,
+    )
+    return ThreadPoolEngine(engine.sync_engine, threads)
+
+
+class _Threads:
+    #  The executor of an engine's connections, started on first use
+    def __init__(self, size: int):
+        self.size = size
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.size, thread_name_prefix="sqlite")
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=False)
+
+
+class ThreadPoolEngine(AsyncEngine):
+    """AsyncEngine whose dispose() also shuts its connections' threads down"""
+
+    __slots__ = ("threads",)
+
+    def __init__(self, sync_engine, threads: _Threads):
+        super().__init__(sync_engine)
+        self.threads = threads
+
+    async def dispose(self, close: bool = True) -> None:
+        await super().dispose(close)
+        if close:
+            self.threads.shutdown()
+
+
+async def connect(database: str, threads: _Threads) -> "Connection":
+    loop = asyncio.get_running_loop()
+    conn = await loop.run_in_executor(
+        threads.executor,
+        functools.partial(sqlite3.connect, database, check_same_thread=False),
+    )
+    return Connection(conn, threads)
+
+
+class Connection:
+    """The parts of aiosqlite.Connection that SQLAlchemy's aiosqlite dialect uses"""
+
+    def __init__(self, conn: sqlite3.Connection, threads: _Threads):
+        self._conn = conn
+        self._threads = threads
+        self._tx = _Submitter(self)
+
+    @property
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        return self._conn
+
+    @property
+    def isolation_level(self) -> Optional[str]:
+        return self._conn.isolation_level
+
+    def _run(self, fn: Callable, *args) -> "asyncio.Future":
+        #  Like loop.run_in_executor, without chaining a concurrent future to the
+        #    asyncio one, which is most of the cost of a hop
+        if self._conn is None:
+            raise ValueError("Connection closed")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def call():
+            try:
+                result = fn(*args)
+            except BaseException as err:
+                loop.call_soon_threadsafe(_setException, future, err)
+            else:
+                loop.call_soon_threadsafe(_setResult, future, result)
+
+        self._threads.executor.submit(call)
+        return future
+
+    def cursor(self) -> "Cursor":
+        return Cursor(self, self._conn.cursor())
+
+    #  sqlite3 only opens a transaction before a write, so sessions that only read
+    #    end without another hop
+    async def commit(self) -> None:
+        if self._conn is not None and self._conn.in_transaction:
+            await self._run(self._conn.commit)
+
+    async def rollback(self) -> None:
+        if self._conn is not None and self._conn.in_transaction:
+            await self._run(self._conn.rollback)
+
+    async def create_function(self, *args, **kw) -> None:
+        await self._run(functools.partial(self._conn.create_function, *args, **kw))
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await asyncio.get_running_loop().run_in_executor(
+                self._threads.executor, conn.close
+            )
+
+    def stop(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+
+
+def _setResult(future: "asyncio.Future", result: Any) -> None:
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _setException(future: "asyncio.Future", err: BaseException) -> None:
+    if not future.cancelled():
+        future.set_exception(err)
+
+
+class _Submitter:
+    #  The dialect sets isolation_level by queueing (future, function) on aiosqlite's
+    #    request queue, this runs them on the executor instead
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+    def put_nowait(self, item) -> None:
+        future, function = item
+
+        async def run():
+            try:
+                future.set_result(await self.connection._run(function))
+            except Exception as err:
+                future.set_exception(err)
+
+        asyncio.ensure_future(run())
+
+
+class Cursor:
+    """The parts of aiosqlite.Cursor that SQLAlchemy's aiosqlite dialect uses.  Rows
+    are fetched with the statement, so fetches never leave the event loop."""
+
+    def __init__(self, connection: Connection, cursor: sqlite3.Cursor):
+        self._connection = connection
+        self._cursor = cursor
+        #  rows are read from _next on, rather than popped off the front
+        self._rows = []
+        self._next = 0
+        self.arraysize = cursor.arraysize
+
+    async def __aenter__(self) -> "Cursor":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        return self._cursor.lastrowid
+
+    def _execute(self, operation, parameters):
+        self._cursor.execute(operation, parameters)
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    async def execute(self, operation, parameters=()) -> "Cursor":
+        rows = await self._connection._run(self._execute, operation, parameters)
+        self._setRows(rows)
+        return self
+
+    async def executemany(self, operation, seq_of_parameters) -> "Cursor":
+        await self._connection._run(
+            self._cursor.executemany, operation, seq_of_parameters
+        )
+        self._setRows([])
+        return self
+
+    async def fetchone(self):
+        if self._next >= len(self._rows):
+            return None
+        self._next += 1
+        return self._rows[self._next - 1]
+
+    async def fetchmany(self, size: Optional[int] = None):
+        size = size or self.arraysize
+        rows = self._rows[self._next : self._next + size]
+        self._next += len(rows)
+        return rows
+
+    async def fetchall(self):
+        rows = self._rows[self._next :] if self._next else self._rows
+        self._setRows([])
+        return rows
+
+    async def close(self) -> None:
+        self._setRows([])
+        self._cursor.close()
+
+    def _setRows(self, rows) -> None:
+        self._rows = rows
+        self._next = 0
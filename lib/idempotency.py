@@ -0,0 +1,126 @@
+#  Idempotency-Key support for POST views.  The first request with a key claims it
+#    in the idempotency_key table, runs the view and stores its status and body;
+#    retries with the same key and body get the stored response back without the
+#    view running again.  Concurrent duplicates in this process wait for the
+#    original, duplicates arriving at another worker while it runs get a 409.  The
+#    claim of a request in flight is only a lease, so the key of a worker that died
+#    mid-request is free for a retry again soon, rather than after IDEMPOTENCY_TTL.
+import datetime
+import functools
+import hashlib
+import json
+
+from connexion import request
+from sqlalchemy.exc import IntegrityError
+
+from app import get_session
+from models.repositories import IdempotencyRepo
+from .coalesce import SingleFlight
+from .utils import format_errors_return
+
+HEADER = "Idempotency-Key"
+
+
+def fingerprint(operationId: str, body) -> str:
+    data = json.dumps([operationId, body], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _utc(value: datetime.datetime) -> datetime.datetime:
+    #  SQLite hands back naive datetimes, which are stored as UTC
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+
+def _stored(record, digest):
+    if record.fingerprint != digest:
+        return format_errors_return(
+            f"{HEADER} was already used with a different request body",
+            422,
+            title="Idempotency Error",
+        )
+    if record.status_code is None:
+        errors, status = format_errors_return(
+            f"A request with this {HEADER} is still in progress",
+            409,
+            title="Idempotency Error",
+        )
+        return errors, status, {"Retry-After": "1"}
+    return (
+        json.loads(record.response),
+        record.status_code,
+        {"Idempotent-Replayed": "true"},
+    )
+
+
+def idempotent(operationId: str):
+    """Decorate a POST view taking `body` so it honours the Idempotency-Key header.
+    Keys are per caller.  Stored responses are kept for the IDEMPOTENCY_TTL setting,
+    in seconds, and a claim whose view has not answered within IDEMPOTENCY_LEASE
+    seconds may be taken over by a retry."""
+
+    flight = SingleFlight(f"idempotency.{operationId}", cancelOnLeave=False)
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(body, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return await view(body, *args, **kwargs)
+            #  the same key sent by two callers is two keys
+            key = f"{request.context.get('user') or ''}:{key}"
+            digest = fingerprint(operationId, body)
+            ttl = request.state.config.get("IDEMPOTENCY_TTL", 86400)
+            leaseTime = request.state.config.get("IDEMPOTENCY_LEASE", 30)
+
+            async def run():
+                now = datetime.datetime.now(datetime.timezone.utc)
+                lease = now + datetime.timedelta(seconds=leaseTime)
+                try:
+                    async with get_session() as session:
+                        await IdempotencyRepo.deleteIfExpired(session, key, now)
+                        record = await IdempotencyRepo.fetchByKey(session, key)
+                        if record:
+                            return _stored(record, digest)
+                        await IdempotencyRepo.create(
+                            session,
+                            {"key": key, "fingerprint": digest, "expires_at": lease},
+                        )
+                        await session.commit()
+                except IntegrityError:
+                    #  another worker claimed the key first
+                    async with get_session() as session:
+                        record = await IdempotencyRepo.fetchByKey(session, key)
+                        if record:
+                            return _stored(record, digest)
+                    raise
+
+                try:
+                    response = await view(body, *args, **kwargs)
+                except BaseException:
+                    async with get_session() as session:
+                        await IdempotencyRepo.release(session, key, lease)
+                        await session.commit()
+                    raise
+
+                #  a claim taken over after its lease ran out is left to the new owner
+                async with get_session() as session:
+                    if response[1] >= 500:
+                        await IdempotencyRepo.release(session, key, lease)
+                    else:
+                        await IdempotencyRepo.complete(
+                            session,
+                            key,
+                            lease,
+                            response[1],
+                            json.dumps(response[0], default=str),
+                            datetime.datetime.now(datetime.timezone.utc)
+                            + datetime.timedelta(seconds=ttl),
+                        )
+                    await session.commit()
+                return response
+
+            return await flight.do((key, digest), run)
+
+        return wrapper
+
+    return decorator
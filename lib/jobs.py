@@ -0,0 +1,118 @@
+#  The app's background jobs, scheduled at startup by lifespan_handler
+import asyncio
+import datetime
+import functools
+import logging
+from typing import Optional
+
+from models.repositories import (
+    AnalyticsRepo,
+    ArchiveRepo,
+    ChangeRepo,
+    IdempotencyRepo,
+)
+from .scheduler import Scheduler
+from .sharding import Shards
+
+logger = logging.getLogger("app.jobs")
+
+
+async def purgeIdempotencyKeys(SessionLocal) -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with SessionLocal() as session:
+        async with session.begin():
+            removed = await IdempotencyRepo.deleteExpired(session, now)
+    if removed:
+        logger.info(f"Purged {removed} expired idempotency keys")
+    return removed
+
+
+async def purgeChangeLog(SessionLocal, retention: float) -> int:
+    before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=retention
+    )
+    async with SessionLocal() as session:
+        async with session.begin():
+            removed = await ChangeRepo.deleteBefore(session, before)
+    if removed:
+        logger.info(f"Purged {removed} change log entries")
+    return removed
+
+
+async def archiveOrders(SessionLocal, afterDays: float, batchSize: int = 500) -> int:
+    #  One short transaction per batch, so order writes are never blocked for long
+    before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        days=afterDays
+    )
+    archived = 0
+    while True:
+        async with SessionLocal() as session:
+            async with session.begin():
+                moved = await ArchiveRepo.archiveOrders(session, before, batchSize)
+        archived += moved
+        if moved < batchSize:
+            break
+        await asyncio.sleep(0)
+    if archived:
+        logger.info(f"Archived {archived} completed orders")
+    return archived
+
+
+async def refreshRollups(SessionLocal, windowDays: Optional[float] = None) -> None:
+    #  Recomputes the analytics rollups for ship dates in the last windowDays and
+    #    later, or for all of them.  Older orders are delivered and rarely change
+    start = None
+    if windowDays is not None:
+        start = datetime.date.today() - datetime.timedelta(days=windowDays)
+    async with SessionLocal() as session:
+        async with session.begin():
+            await AnalyticsRepo.rebuild(session, start)
+
+
+def scheduleJobs(
+    scheduler: Scheduler, SessionLocal, config: dict, shards: Optional[Shards] = None
+) -> None:
+    scheduler.every(
+        "purge_idempotency_keys",
+        config.get("IDEMPOTENCY_PURGE_INTERVAL", 600),
+        functools.partial(purgeIdempotencyKeys, SessionLocal),
+        jitter=30,
+    )
+    if config.get("CHANGE_FEED_ENABLED"):
+        scheduler.every(
+            "purge_change_log",
+            config.get("CHANGE_LOG_PURGE_INTERVAL", 600),
+            functools.partial(
+                purgeChangeLog, SessionLocal, config.get("CHANGE_LOG_RETENTION", 86400)
+            ),
+            jitter=30,
+        )
+    if config.get("ARCHIVE_AFTER_DAYS"):
+        # sharded orders are archived within their shard
+        SessionLocals = shards.SessionLocals if shards else [SessionLocal]
+        for index, OrderSessionLocal in enumerate(SessionLocals):
+            scheduler.every(
+                f"archive_orders_{index}" if shards else "archive_orders",
+                config.get("ARCHIVE_INTERVAL", 3600),
+                functools.partial(
+                    archiveOrders,
+                    OrderSessionLocal,
+                    config["ARCHIVE_AFTER_DAYS"],
+                    config.get("ARCHIVE_BATCH_SIZE", 500),
+                ),
+                jitter=60,
+            )
+    # rollups join orders to the main database, they are not built from shards
+    if config.get("ROLLUP_INTERVAL") and not shards:
+        # everything once at startup, then the recent window
+        scheduler.once(
+            "rebuild_rollups", functools.partial(refreshRollups, SessionLocal)
+        )
+        scheduler.every(
+            "refresh_rollups",
+            config["ROLLUP_INTERVAL"],
+            functools.partial(
+                refreshRollups, SessionLocal, config.get("ROLLUP_WINDOW_DAYS", 30)
+            ),
+            jitter=10,
+        )
@@ -0,0 +1,141 @@
+#  Memory diagnostics for workers that grow over time, served by the admin
+#    /diagnostics/memory endpoints when MEMORY_DIAGNOSTICS is on.
+#
+#  tracemalloc is only started on request, as it slows every allocation.  While it
+#    runs, snapshots can be taken (the MEMORY_SNAPSHOTS newest are kept) and their
+#    top allocation sites listed, or diffed against an older snapshot to find what
+#    keeps growing.  Garbage collector stats and live instance counts of the entity
+#    and schema classes need no tracing.  Everything here runs only when asked for,
+#    in a thread off the event loop.
+import gc
+import itertools
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from marshmallow import Schema
+
+from models.entities import Base
+
+GROUPS = ("lineno", "filename", "traceback")
+
+#  allocations of the diagnostics themselves
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+class MemoryDiagnostics:
+    def __init__(self, keep: int = 5):
+        self.keep = keep
+        self.snapshots: "OrderedDict[int, Dict]" = OrderedDict()
+        self.ids = itertools.count(1)
+
+    def status(self) -> Dict:
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "tracedBytes": traced,
+            "peakBytes": peak,
+            "snapshots": [self._info(id) for id in self.snapshots],
+        }
+
+    def start(self, frames: int = 10) -> Dict:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+        return self.status()
+
+    def stop(self) -> Dict:
+        #  snapshots are kept, they do not need tracing to be read
+        tracemalloc.stop()
+        return self.status()
+
+    def snapshot(self) -> Dict:
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running")
+        id = next(self.ids)
+        snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        self.snapshots[id] = {
+            "snapshot": snapshot,
+            "takenAt": time.time(),
+            "tracedBytes": tracemalloc.get_traced_memory()[0],
+        }
+        while len(self.snapshots) > self.keep:
+            self.snapshots.popitem(last=False)
+        return self._info(id)
+
+    def top(self, id: int, limit: int = 20, groupBy: str = "lineno") -> List[Dict]:
+        stats = self._get(id).statistics(groupBy)
+        return [
+            {
+                "site": _site(stat.traceback, groupBy),
+                "sizeBytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def diff(
+        self, id: int, base: int, limit: int = 20, groupBy: str = "lineno"
+    ) -> List[Dict]:
+        stats = self._get(id).compare_to(self._get(base), groupBy)
+        return [
+            {
+                "site": _site(stat.traceback, groupBy),
+                "sizeBytes": stat.size,
+                "sizeDiffBytes": stat.size_diff,
+                "count": stat.count,
+                "countDiff": stat.count_diff,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def gcStats(self) -> Dict:
+        return {
+            "counts": list(gc.get_count()),
+            "thresholds": list(gc.get_threshold()),
+            "generations": gc.get_stats(),
+            "uncollectable": len(gc.garbage),
+        }
+
+    def objectCounts(self) -> Dict[str, int]:
+        """Live instances of the entity and schema classes, walking every object the
+        collector tracks"""
+        counts = Counter(
+            type(obj).__name__
+            for obj in gc.get_objects()
+            if isinstance(obj, (Base, Schema))
+        )
+        return dict(counts.most_common())
+
+    def _get(self, id: int) -> tracemalloc.Snapshot:
+        if id not in self.snapshots:
+            raise KeyError(id)
+        return self.snapshots[id]["snapshot"]
+
+    def _info(self, id: int) -> Dict:
+        snapshot = self.snapshots[id]
+        return {
+            "id": id,
+            "takenAt": snapshot["takenAt"],
+            "tracedBytes": snapshot["tracedBytes"],
+        }
+
+
+def _site(traceback: tracemalloc.Traceback, groupBy: str) -> str:
+    if groupBy == "filename":
+        return traceback[0].filename
+    if groupBy == "traceback":
+        return " <- ".join(
+            f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback)
+        )
+    return f"{traceback[0].filename}:{traceback[0].lineno}"
+
+
+memoryDiagnostics = MemoryDiagnostics()
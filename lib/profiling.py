@@ -0,0 +1,160 @@
+#  Per-request profiling, for finding where the time of one slow request goes.
+#
+#  A request is profiled when it carries an X-Profile header equal to PROFILE_TOKEN,
+#    or is drawn by PROFILE_SAMPLE_RATE.  Its response gets an X-Profile-Id header
+#    naming the file the profile was written to in PROFILE_DIR, which keeps the
+#    PROFILE_MAX_FILES newest.  Two profilers:
+#      "cprofile"  deterministic, a <id>.pstats file for pstats or snakeviz
+#      "sampling"  a thread records the event loop thread's stack every interval,
+#                  a <id>.collapsed file of "frame;frame;frame count" lines for flame
+#                  graph tools.  Time spent waiting on the database shows as the loop
+#                  idling in select.
+#  Both see everything the event loop thread runs while the request is in flight,
+#    other requests included, so one request is profiled at a time.  With PROFILING
+#    off the middleware is not installed; requests that are not profiled only pay
+#    for the header check.
+import asyncio
+import contextlib
+import cProfile
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger("app.profiling")
+
+MODES = ("cprofile", "sampling")
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled every interval seconds"""
+
+    def __init__(self, threadId: int, interval: float = 0.001):
+        self.threadId = threadId
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            stack = []
+            while frame is not None:
+                stack.append(
+                    f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+                )
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests asked for or sampled"""
+
+    def __init__(
+        self,
+        app,
+        directory: str,
+        token: Optional[str] = None,
+        sampleRate: float = 0.0,
+        mode: str = "cprofile",
+        maxFiles: int = 100,
+        interval: float = 0.001,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown PROFILE_MODE {mode}, expected one of {MODES}")
+        self.app = app
+        self.directory = directory
+        self.token = token.encode() if token else None
+        self.sampleRate = sampleRate
+        self.mode = mode
+        self.maxFiles = maxFiles
+        self.interval = interval
+        self.active = False
+        os.makedirs(directory, exist_ok=True)
+
+    def triggered(self, scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == b"x-profile":
+                    return hmac.compare_digest(value, self.token)
+        return bool(self.sampleRate) and random.random() < self.sampleRate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.active or not self.triggered(scope):
+            await self.app(scope, receive, send)
+            return
+        profileId = uuid.uuid4().hex[:16]
+
+        async def sendWithId(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profileId.encode()),
+                ]
+            await send(message)
+
+        self.active = True
+        start = time.perf_counter()
+        if self.mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident(), self.interval)
+            profiler.start()
+        try:
+            await self.app(scope, receive, sendWithId)
+        finally:
+            if self.mode == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+            self.active = False
+            ms = (time.perf_counter() - start) * 1000
+            logger.info(
+                f"Profiled {scope['method']} {scope['path']} in {ms:.1f} ms as {profileId}"
+            )
+            metrics.incr("profiling.profiles")
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.save, profileId, profiler
+            )
+
+    def save(self, profileId: str, profiler) -> None:
+        if self.mode == "cprofile":
+            profiler.dump_stats(os.path.join(self.directory, f"{profileId}.pstats"))
+        else:
+            path = os.path.join(self.directory, f"{profileId}.collapsed")
+            with open(path, "w") as file:
+                file.write(profiler.collapsed())
+        self.prune()
+
+    def prune(self) -> None:
+        #  keep the maxFiles newest profiles
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith((".pstats", ".collapsed"))
+        ]
+        if len(paths) > self.maxFiles:
+            paths.sort(key=os.path.getmtime)
+            for path in paths[: len(paths) - self.maxFiles]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
@@ -0,0 +1,244 @@
+#  Replays a traffic capture (lib/capture.py) against the create_app() of this
+#    checkout, to reproduce production performance offline and compare two builds:
+#
+#  python -m lib.replay run logs/traffic.jsonl --database snapshot.db --out before.jsonl
+#  (check out or build the other version)
+#  python -m lib.replay run logs/traffic.jsonl --database snapshot.db --out after.jsonl
+#  python -m lib.replay compare before.jsonl after.jsonl
+#
+#  Every run starts from a fresh copy of the --database snapshot and sends the same
+#    requests in the same order, paced as captured (--speed 2 plays twice as fast,
+#    --speed 0 as fast as --concurrency allows).  The app is served by uvicorn on a
+#    local port, so lifespan, middleware and HTTP parsing are all part of the timings.
+#    Captured credentials were redacted: requests are sent with --token instead.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+import uvicorn
+
+
+def load(paths: Iterable[str]) -> List[Dict]:
+    """Captured requests of the files, oldest first"""
+    records = []
+    for path in paths:
+        with open(path) as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return sorted(records, key=lambda record: record["t"])
+
+
+def route(method: str, path: str) -> str:
+    return f"{method} {re.sub(r'/[0-9]+(?=/|$)', '/{id}', path)}"
+
+
+async def replay(
+    app,
+    records: List[Dict],
+    speed: float = 1.0,
+    concurrency: int = 16,
+    token: str = "replay",
+) -> List[Dict]:
+    """Send records to app, served on a local port, and return one result each"""
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=0, lifespan="on", log_level="warning"
+        )
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+            raise RuntimeError("Replay server did not start")
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Optional[Dict]] = [None] * len(records)
+    first = records[0]["t"] if records else 0
+
+    async def send(client, i, record):
+        if speed:
+            await asyncio.sleep((record["t"] - first) / speed - (loop.time() - start))
+        headers = dict(record.get("headers") or {})
+        if record.get("auth") == "apiKey":
+            headers["x-apiKey"] = token
+        elif record.get("auth"):
+            headers["Authorization"] = f"{record['auth']} {token}"
+        async with semaphore if not speed else contextlib.nullcontext():
+            begin = time.perf_counter()
+            response = await client.request(
+                record["method"],
+                record["path"] + (f"?{record['query']}" if record.get("query") else ""),
+                headers=headers,
+                content=(record.get("body") or "").encode(),
+            )
+            ms = (time.perf_counter() - begin) * 1000
+        results[i] = {
+            "i": i,
+            "route": route(record["method"], record["path"]),
+            "status": response.status_code,
+            "ms": round(ms, 3),
+            "capturedStatus": record.get("status"),
+            "capturedMs": record.get("ms"),
+        }
+
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}",
+            timeout=None,
+            limits=httpx.Limits(max_connections=None if speed else concurrency),
+        ) as client:
+            start = loop.time()
+            await asyncio.gather(
+                *[send(client, i, record) for i, record in enumerate(records)]
+            )
+    finally:
+        server.should_exit = True
+        await serving
+    return results
+
+
+def summarize(results: List[Dict]) -> Dict[str, Dict]:
+    """Request count, error count and latency percentiles in ms, per route"""
+    byRoute: Dict[str, List[Dict]] = {}
+    for result in results:
+        byRoute.setdefault(result["route"], []).append(result)
+    summary = {}
+    for name, rows in sorted(byRoute.items()):
+        timings = sorted(row["ms"] for row in rows)
+        summary[name] = {
+            "count": len(rows),
+            "errors": sum(row["status"] >= 500 for row in rows),
+            "p50": _percentile(timings, 0.50),
+            "p95": _percentile(timings, 0.95),
+            "max": timings[-1],
+        }
+    return summary
+
+
+def compare(before: List[Dict], after: List[Dict]) -> Dict[str, Dict]:
+    """Per route percentiles of two runs of the same capture, with changes in %"""
+    a, b = summarize(before), summarize(after)
+    changes = {}
+    for name in sorted(a.keys() | b.keys()):
+        row = {"before": a.get(name), "after": b.get(name)}
+        if row["before"] and row["after"]:
+            for key in ("p50", "p95"):
+                old, new = row["before"][key], row["after"][key]
+                row[f"{key}Change"] = (new - old) / old * 100 if old else None
+        changes[name] = row
+    statuses = {result["i"]: result["status"] for result in before}
+    changed = sum(statuses.get(result["i"]) != result["status"] for result in after)
+    return {"routes": changes, "statusChanges": changed}
+
+
+def _percentile(timings: List[float], q: float) -> float:
+    return timings[min(len(timings) - 1, int(q * len(timings)))]
+
+
+def _copyDatabase(path: str, folder: str) -> str:
+    #  through the backup API, so a snapshot taken while the app runs is consistent
+    copy = os.path.join(folder, "replay.db")
+    source, target = sqlite3.connect(path), sqlite3.connect(copy)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+    return copy
+
+
+def _printSummary(summary: Dict[str, Dict]) -> None:
+    for name, row in summary.items():
+        print(
+            f"  {name:<40} {row['count']:>6}  errors {row['errors']:>4}"
+            f"  p50 {row['p50']:8.2f} ms  p95 {row['p95']:8.2f} ms"
+        )
+
+
+def _printComparison(comparison: Dict) -> None:
+    def change(value):
+        return "     n/a" if value is None else f"{value:+7.1f}%"
+
+    for name, row in comparison["routes"].items():
+        if not (row["before"] and row["after"]):
+            print(f"  {name:<40} only in {'after' if row['after'] else 'before'}")
+            continue
+        print(
+            f"  {name:<40} p50 {row['before']['p50']:8.2f} -> {row['after']['p50']:8.2f}"
+            f" {change(row['p50Change'])}   p95 {row['before']['p95']:8.2f} ->"
+            f" {row['after']['p95']:8.2f} {change(row['p95Change'])}"
+        )
+    print(f"  responses with a different status: {comparison['statusChanges']}")
+
+
+def _readResults(path: str) -> List[Dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m lib.replay", description="Replay captured traffic"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="replay captures against this checkout")
+    run.add_argument("captures", nargs="+", help="capture files, rotated ones too")
+    run.add_argument("--database", required=True, help="SQLite snapshot to start from")
+    run.add_argument("--speed", type=float, default=1.0, help="0 for no pacing")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--token", default="replay")
+    run.add_argument("--out", help="file to write the results to, for compare")
+    run.add_argument(
+        "--setting",
+        action="append",
+        default=[],
+        metavar="NAME=JSON",
+        help="override a setting, e.g. DATABASE_DRIVER='\"threadpool\"'",
+    )
+    diff = commands.add_parser("compare", help="compare the results of two runs")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        before, after = _readResults(args.before), _readResults(args.after)
+        print(f"{args.before} -> {args.after}")
+        _printComparison(compare(before, after))
+        return
+
+    from app import create_app
+
+    records = [record for record in load(args.captures) if not record.get("truncated")]
+    with tempfile.TemporaryDirectory() as folder:
+        settings = {
+            "DATABASE_URL": f"sqlite+aiosqlite:///{_copyDatabase(args.database, folder)}",
+            "SHARD_URLS": None,
+            "SCHEDULER_ENABLED": False,
+            "TRAFFIC_CAPTURE": False,
+        }
+        for setting in args.setting:
+            name, value = setting.split("=", 1)
+            settings[name] = json.loads(value)
+        app = create_app(settings)
+        start = time.perf_counter()
+        results = await replay(
+            app, records, args.speed, args.concurrency, token=args.token
+        )
+    print(f"Replayed {len(results)} requests in {time.perf_counter() - start:.1f}s")
+    _printSummary(summarize(results))
+    if args.out:
+        with open(args.out, "w") as file:
+            file.writelines(json.dumps(result) + "\n" for result in results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+#  Background jobs run by the app lifespan, off the request path.  Jobs are either
+#    periodic (every `interval` seconds plus up to `jitter` seconds) or one-off (after
+#    `delay` seconds).  Coroutine functions run on the event loop; plain functions
+#    run in a thread, or in a process with runIn="process", so they never block it.
+#    At most maxConcurrency jobs run at once, and a periodic job never overlaps
+#    itself.  Timings, runs and failures per job go to /metrics.
+import asyncio
+import inspect
+import logging
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger("app.scheduler")
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        interval: Optional[float] = None,
+        delay: float = 0,
+        jitter: float = 0,
+        timeout: Optional[float] = None,
+        runIn: str = "thread",
+    ):
+        if runIn not in ("thread", "process"):
+            raise ValueError(f"runIn must be thread or process, not {runIn}")
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.delay = delay
+        self.jitter = jitter
+        self.timeout = timeout
+        self.runIn = runIn
+        self.task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    def __init__(self, maxConcurrency: int = 4, maxWorkers: int = 2):
+        self.jobs: Dict[str, Job] = {}
+        self.maxConcurrency = maxConcurrency
+        self.maxWorkers = maxWorkers
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.threads: Optional[ThreadPoolExecutor] = None
+        self.processes: Optional[ProcessPoolExecutor] = None
+        self.running = False
+
+    def every(self, name: str, interval: float, fn: Callable, **kwargs) -> Job:
+        """Run fn every interval seconds, the first run one interval after start"""
+        return self._add(Job(name, fn, interval=interval, **kwargs))
+
+    def once(self, name: str, fn: Callable, delay: float = 0, **kwargs) -> Job:
+        """Run fn once, delay seconds from now (or from start)"""
+        return self._add(Job(name, fn, delay=delay, **kwargs))
+
+    def _add(self, job: Job) -> Job:
+        if job.name in self.jobs:
+            raise ValueError(f"Job {job.name} is already scheduled")
+        self.jobs[job.name] = job
+        if self.running:
+            job.task = asyncio.create_task(self._loop(job))
+        return job
+
+    async def start(self) -> None:
+        self.semaphore = asyncio.Semaphore(self.maxConcurrency)
+        self.threads = ThreadPoolExecutor(
+            self.maxWorkers, thread_name_prefix="scheduler"
+        )
+        self.running = True
+        for job in self.jobs.values():
+            job.task = asyncio.create_task(self._loop(job))
+        logger.info(f"Scheduler started with jobs: {list(self.jobs)}")
+
+    async def stop(self) -> None:
+        self.running = False
+        tasks = [job.task for job in self.jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.threads:
+            self.threads.shutdown(wait=False, cancel_futures=True)
+        if self.processes:
+            self.processes.shutdown(wait=False, cancel_futures=True)
+        logger.info("Scheduler stopped")
+
+    async def _loop(self, job: Job) -> None:
+        try:
+            await asyncio.sleep(job.delay if job.interval is None else job.interval)
+            while True:
+                await self._run(job)
+                if job.interval is None:
+                    break
+                await asyncio.sleep(job.interval + random.uniform(0, job.jitter))
+        finally:
+            if job.interval is None and self.jobs.get(job.name) is job:
+                del self.jobs[job.name]
+
+    async def _run(self, job: Job) -> None:
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._call(job), job.timeout)
+                metrics.incr(f"scheduler.{job.name}.runs")
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                metrics.incr(f"scheduler.{job.name}.failures")
+                logger.error(f"Scheduled job {job.name} failed: {str(err)}")
+            finally:
+                metrics.timing(
+                    f"scheduler.{job.name}", (time.perf_counter() - start) * 1000
+                )
+
+    async def _call(self, job: Job):
+        if inspect.iscoroutinefunction(job.fn):
+            return await job.fn()
+        loop = asyncio.get_running_loop()
+        if job.runIn == "process":
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(self.maxWorkers)
+            return await loop.run_in_executor(self.processes, job.fn)
+        return await loop.run_in_executor(self.threads, job.fn)
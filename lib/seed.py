@@ -0,0 +1,203 @@
+#  Generates a large, reproducible petstore database for benchmarks and query plans
+#
+#    python -m lib.seed --pets 2000000 --orders 600000 --seed 42 --reset
+#
+#  The same seed and sizes always give the same rows and ids.  Rows are written with
+#    bulk Core inserts of batchSize rows, so neither the ORM unit of work nor the
+#    change_log hooks are involved.
+#
+#  Distributions:
+#    - pet names come from a vocabulary of nameCardinality names with a Zipf-like skew
+#    - order status is skewed to delivered, most orders have one or two lines
+#    - each line takes a different pet, walked in a pseudo-random permutation so
+#      ordered pets are spread over the table.  Pets in delivered orders are sold,
+#      pets in open orders pending and the rest available, as reservation leaves them
+import argparse
+import asyncio
+import bisect
+import datetime
+import itertools
+import math
+import random
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from models.entities import Base, Order, OrderPet, Pet
+
+ORDER_STATUSES = (("placed", 0.15), ("approved", 0.25), ("delivered", 0.60))
+LINE_COUNTS = ((1, 0.55), (2, 0.25), (3, 0.10), (4, 0.05), (5, 0.03), (10, 0.02))
+SYLLABLES = (
+    "ba ki mo lu re sa to ni fe go pa zu di lo ma ra ve no ti ka bo se ju wi".split()
+)
+EPOCH = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _names(rng: random.Random, cardinality: int) -> List[str]:
+    names = set()
+    while len(names) < cardinality:
+        syllables = rng.choices(SYLLABLES, k=rng.randint(2, 4))
+        names.add("".join(syllables).capitalize())
+    return sorted(names)
+
+
+def _permutation(n: int, rng: random.Random):
+    #  i -> (a * i + b) mod n is a bijection of range(n) when a is coprime to n, so the
+    #    lines can walk the pets in a shuffled order without holding a list of n ids
+    a = rng.randrange(1, n)
+    while math.gcd(a, n) != 1:
+        a += 1
+    b = rng.randrange(n)
+    inverse = pow(a, -1, n)
+    return (lambda i: (a * i + b) % n), (lambda p: (inverse * (p - b)) % n)
+
+
+async def seed(
+    engine: AsyncEngine,
+    pets: int = 100_000,
+    orders: int = 40_000,
+    seed: int = 0,
+    nameCardinality: int = 5_000,
+    batchSize: int = 10_000,
+) -> Dict[str, int]:
+    """Insert pets, orders and their lines into the empty tables of engine and return
+    the row counts"""
+    if pets < 10:
+        raise ValueError("pets must be at least 10")
+    async with engine.connect() as conn:
+        for table in (Pet, Order, OrderPet):
+            if (await conn.execute(select(func.count()).select_from(table))).scalar():
+                raise ValueError(f"Table {table.__tablename__} is not empty")
+
+    rng = random.Random(seed)
+    names = _names(rng, min(nameCardinality, pets))
+    nameWeights = list(
+        itertools.accumulate(1 / rank**1.1 for rank in range(1, len(names) + 1))
+    )
+    statuses, statusWeights = zip(*ORDER_STATUSES)
+    statusWeights = list(itertools.accumulate(statusWeights))
+    lineCounts, lineWeights = zip(*LINE_COUNTS)
+    lineWeights = list(itertools.accumulate(lineWeights))
+    toPet, toLine = _permutation(pets, rng)
+
+    #  Each order's status and first line are drawn up front, so pets (which the lines
+    #    reference) can be inserted first with the status their orders give them
+    orderStatus = bytearray(orders)
+    firstLine = array("q")
+    lines = 0
+    for order in range(orders):
+        orderStatus[order] = rng.choices(
+            range(len(statuses)), cum_weights=statusWeights
+        )[0]
+        firstLine.append(lines)
+        lines += min(rng.choices(lineCounts, cum_weights=lineWeights)[0], pets)
+
+    petRows = []
+    for id in range(1, pets + 1):
+        line = toLine(id - 1)
+        if line < lines:
+            order = bisect.bisect_right(firstLine, line) - 1
+            status = (
+                "sold" if statuses[orderStatus[order]] == "delivered" else "pending"
+            )
+        else:
+            status = "available"
+        name = names[rng.choices(range(len(names)), cum_weights=nameWeights)[0]]
+        kind = rng.choice(("cat", "dog", "bird", "fish"))
+        petRows.append(
+            {
+                "id": id,
+                "name": name,
+                "description": f"{name} the {kind}",
+                "status": status,
+            }
+        )
+        if len(petRows) >= batchSize:
+            await _insert(engine, Pet, petRows)
+            petRows = []
+    await _insert(engine, Pet, petRows)
+
+    orderRows, lineRows = [], []
+    for order in range(orders):
+        status = statuses[orderStatus[order]]
+        if status == "delivered":
+            shipDate = EPOCH - datetime.timedelta(seconds=rng.randrange(730 * 86400))
+        else:
+            shipDate = EPOCH + datetime.timedelta(seconds=rng.randrange(14 * 86400))
+        orderRows.append(
+            {
+                "id": order + 1,
+                "ship_date": shipDate,
+                "status": status,
+                "complete": status == "delivered",
+            }
+        )
+        end = firstLine[order + 1] if order + 1 < orders else lines
+        for line in range(firstLine[order], end):
+            lineRows.append(
+                {
+                    "order_id": order + 1,
+                    "pet_id": toPet(line % pets) + 1,
+                    "quantity": rng.choices((1, 2, 3), cum_weights=(0.85, 0.95, 1))[0],
+                }
+            )
+        if len(orderRows) >= batchSize:
+            await _insert(engine, Order, orderRows)
+            await _insert(engine, OrderPet, lineRows)
+            orderRows, lineRows = [], []
+    await _insert(engine, Order, orderRows)
+    await _insert(engine, OrderPet, lineRows)
+    return {"pets": pets, "orders": orders, "order_pet": lines}
+
+
+async def _insert(engine: AsyncEngine, entity, rows: List[Dict]) -> None:
+    if rows:
+        async with engine.begin() as conn:
+            await conn.execute(insert(entity), rows)
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    from app import base_config
+
+    parser = argparse.ArgumentParser(
+        prog="python -m lib.seed", description="Seed a large petstore database"
+    )
+    parser.add_argument("--database", default=base_config["DATABASE_URL"])
+    parser.add_argument("--pets", type=int, default=1_000_000)
+    parser.add_argument("--orders", type=int, default=300_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--names", type=int, default=5_000, help="name cardinality")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--reset", action="store_true", help="drop and recreate all tables first"
+    )
+    args = parser.parse_args(argv)
+
+    engine = create_async_engine(args.database)
+    async with engine.begin() as conn:
+        if args.reset:
+            await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    start = time.perf_counter()
+    try:
+        counts = await seed(
+            engine,
+            pets=args.pets,
+            orders=args.orders,
+            seed=args.seed,
+            nameCardinality=args.names,
+            batchSize=args.batch_size,
+        )
+    finally:
+        await engine.dispose()
+    print(
+        f"Seeded {counts['pets']} pets, {counts['orders']} orders and "
+        f"{counts['order_pet']} order lines in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
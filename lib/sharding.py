@@ -0,0 +1,99 @@
+#  Sharded order storage: orders and their order_pet lines are partitioned over
+#    several SQLite files by order id, so order writes are spread over one writer
+#    per file.  Pets, idempotency keys and the change log stay in the main database.
+#
+#  Order ids are global.  Shard k holds the ids with (id - 1) % count == k, each new
+#    id being the shard's highest id plus count, allocated inside the INSERT so the
+#    shard's write lock makes it race free (see OrderRepo.create).
+#
+#  Lists scatter the same query to every shard, each returning its first
+#    offset + limit orders in id order, and merge the pages by id, so limit and offset
+#    mean what they do on one database.
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.entities import (
+    ArchivedOrder,
+    ArchivedOrderPet,
+    Base,
+    Order,
+    OrderPet,
+)
+
+SHARD_TABLES = [
+    Order.__table__,
+    OrderPet.__table__,
+    ArchivedOrder.__table__,
+    ArchivedOrderPet.__table__,
+]
+
+
+class Shards:
+    def __init__(self, SessionLocals: List):
+        self.SessionLocals = SessionLocals
+        self.count = len(SessionLocals)
+        self._next = itertools.count()
+
+    def index(self, orderId: int) -> int:
+        return (orderId - 1) % self.count
+
+    def pick(self) -> int:
+        #  new orders go to the shards in turn
+        return next(self._next) % self.count
+
+    async def start(self) -> None:
+        for SessionLocal in self.SessionLocals:
+            async with SessionLocal() as session:
+                conn = await session.connection()
+                await conn.run_sync(Base.metadata.create_all, tables=SHARD_TABLES)
+                await session.commit()
+
+    @asynccontextmanager
+    async def session(self, index: int):
+        async with self.SessionLocals[index]() as session:
+            try:
+                await session.begin()
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def gather(self, fn: Callable[..., Awaitable]) -> list:
+        """Run fn(session) on every shard at once, results in shard order"""
+
+        async def run(index):
+            async with self.session(index) as session:
+                return await fn(session)
+
+        return await asyncio.gather(*[run(index) for index in range(self.count)])
+
+    async def scatter(
+        self,
+        fetch: Callable[..., Awaitable],
+        limit: int,
+        offset: int,
+        key: Optional[Callable] = None,
+    ):
+        """Page of orders over all shards.  fetch(session, limit) must return a
+        shard's first limit orders in key order, id by default"""
+        pages = await self.gather(lambda session: fetch(session, offset + limit))
+        merged = heapq.merge(*pages, key=key or (lambda order: order.id))
+        return list(itertools.islice(merged, offset, offset + limit))
+
+
+def attachPets(orders: Sequence, pets: Sequence) -> None:
+    #  pets of sharded orders come from the main database, set them on the orders
+    #    as if they had been loaded with them
+    byId = {pet.id: pet for pet in pets}
+    for order in orders:
+        orderPets = [byId[line.pet_id] for line in order.pet_ids if line.pet_id in byId]
+        if hasattr(order, "_sa_instance_state"):
+            set_committed_value(order, "pets", orderPets)
+        else:
+            order.pets = orderPets
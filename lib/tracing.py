@@ -0,0 +1,230 @@
+#  In-process request tracing.
+#
+#  TracingMiddleware gives every request an id, taken from its X-Request-ID header or
+#    made up, and returns it in the response's X-Request-ID header.  The id is set on
+#    every log record made while the request runs, as record.requestId.
+#
+#  A TRACE_SAMPLE_RATE share of the requests is also traced: span() and @traced
+#    record named, timed, nested spans in the request's trace, through context
+#    variables, so tasks the request starts add to it too.  Finished traces go to a
+#    ring buffer of the TRACE_BUFFER_SIZE latest, read by GET /traces, and optionally
+#    to the TRACE_FILE JSONL file.  In requests that are not traced, span() only
+#    reads a context variable.
+import contextlib
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
+
+from .metrics import metrics
+
+requestId: ContextVar[str] = ContextVar("requestId", default="-")
+
+
+class Span:
+    __slots__ = ("name", "id", "parent", "start", "duration", "attrs")
+
+    def __init__(self, name: str, id: int, parent: Optional[int], attrs: Dict):
+        self.name = name
+        self.id = id
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+
+
+class Trace:
+    def __init__(self, requestId: str, method: str, path: str):
+        self.requestId = requestId
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.ids = itertools.count(1)
+
+    def asDict(self, status: Optional[int]) -> Dict:
+        return {
+            "requestId": self.requestId,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started": self.started,
+            "durationMs": round((time.perf_counter() - self.start) * 1000, 3),
+            "spans": [
+                {
+                    "name": span.name,
+                    "id": span.id,
+                    "parent": span.parent,
+                    "startMs": round((span.start - self.start) * 1000, 3),
+                    "durationMs": round(span.duration * 1000, 3),
+                    **({"attrs": span.attrs} if span.attrs else {}),
+                }
+                for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+
+
+currentTrace: ContextVar[Optional[Trace]] = ContextVar("currentTrace", default=None)
+currentSpan: ContextVar[Optional[Span]] = ContextVar("currentSpan", default=None)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Time the block as a span of the current trace, if the request is traced"""
+    trace = currentTrace.get()
+    if trace is None:
+        yield None
+        return
+    parent = currentSpan.get()
+    current = Span(name, next(trace.ids), parent.id if parent else None, attrs)
+    token = currentSpan.set(current)
+    try:
+        yield current
+    except BaseException as err:
+        current.attrs["error"] = type(err).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        currentSpan.reset(token)
+        trace.spans.append(current)
+
+
+def traced(name: str):
+    """Decorate a function or coroutine function to run as a span"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if currentTrace.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if currentTrace.get() is None:
+                    return fn(*args, **kwargs)
+                with span(name):
+                    return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def tracedMethods(cls):
+    """Class decorator tracing every public static method as <class>.<method>"""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod) and not name.startswith("_"):
+            setattr(
+                cls, name, staticmethod(traced(f"{cls.__name__}.{name}")(attr.__func__))
+            )
+    return cls
+
+
+class TraceBuffer:
+    """The latest finished traces, optionally appended to a JSONL file as well"""
+
+    def __init__(self, size: int = 200):
+        self.traces: deque = deque(maxlen=size)
+        self.listener: Optional[QueueListener] = None
+        self.queue = queue.SimpleQueue()
+
+    def configure(self, size: int, path: Optional[str] = None) -> None:
+        if size != self.traces.maxlen:
+            self.traces = deque(self.traces, maxlen=size)
+        if path and not self.listener:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written by a thread, off the event loop
+            self.listener = QueueListener(
+                self.queue,
+                RotatingFileHandler(
+                    path, maxBytes=64 * 2**20, backupCount=5, delay=True
+                ),
+            )
+            self.listener.start()
+
+    def add(self, trace: Dict) -> None:
+        self.traces.append(trace)
+        if self.listener:
+            self.queue.put_nowait(logging.makeLogRecord({"msg": json.dumps(trace)}))
+
+    def latest(self, limit: int, minDurationMs: float = 0.0) -> List[Dict]:
+        traces = [
+            trace for trace in self.traces if trace["durationMs"] >= minDurationMs
+        ]
+        return traces[::-1][:limit]
+
+
+traceBuffer = TraceBuffer()
+
+
+class TracingMiddleware:
+    """ASGI middleware setting the request id and tracing a sample of requests"""
+
+    def __init__(self, app, sampleRate: float = 0.0):
+        self.app = app
+        self.sampleRate = sampleRate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                id = value.decode("latin-1")[:64]
+        id = id or uuid.uuid4().hex
+        idToken = requestId.set(id)
+        trace = None
+        if self.sampleRate and random.random() < self.sampleRate:
+            trace = Trace(id, scope["method"], scope["path"])
+        traceToken = currentTrace.set(trace)
+        status = None
+
+        async def sendWithId(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", id.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, sendWithId)
+        finally:
+            currentTrace.reset(traceToken)
+            requestId.reset(idToken)
+            if trace:
+                traceBuffer.add(trace.asDict(status))
+                metrics.incr("tracing.traces")
+
+
+_recordFactory = logging.getLogRecordFactory()
+
+
+def _recordWithRequestId(*args, **kwargs):
+    record = _recordFactory(*args, **kwargs)
+    record.requestId = requestId.get()
+    return record
+
+
+logging.setLogRecordFactory(_recordWithRequestId)
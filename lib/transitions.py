@@ -0,0 +1,55 @@
+#  Bulk status transitions, for POST /pets:transition and POST /orders:transition.
+#
+#  The rows, given as ids or found by a filter, are moved in chunks of chunkSize, each
+#    chunk one transaction of a conditional UPDATE (see repositories.transitionStatus),
+#    so a large transition neither holds the write lock for long nor is lost whole
+#    when one chunk fails.  Filtered rows are walked from the last row of the chunk
+#    before, in id order (or ship date order, see OrderRepo.fetchIds), so rows the
+#    UPDATEs take out of the filter do not shift the chunks.
+from typing import Callable, Dict, List, Optional
+
+SUMMARY_KEYS = ("updated", "unchanged", "invalid", "missing")
+
+
+def emptySummary() -> Dict[str, List]:
+    return {key: [] for key in SUMMARY_KEYS}
+
+
+def mergeSummary(summary: Dict[str, List], other: Dict[str, List]) -> Dict[str, List]:
+    for key in SUMMARY_KEYS:
+        summary[key].extend(other[key])
+    return summary
+
+
+async def transition(
+    repo,
+    openSession: Callable,
+    status: str,
+    ids: Optional[List[int]] = None,
+    conditions: Optional[Dict] = None,
+    chunkSize: int = 500,
+    **filters,
+) -> Dict[str, List]:
+    """Moves ids, or without them every row matching conditions and filters, to
+    status.  openSession() must return a session context that commits on exit"""
+    summary = emptySummary()
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), chunkSize):
+            async with openSession() as session:
+                chunk = await repo.transition(
+                    session, ids[start : start + chunkSize], status
+                )
+            mergeSummary(summary, chunk)
+        return summary
+    after = 0
+    while True:
+        async with openSession() as session:
+            chunkIds = await repo.fetchIds(
+                session, conditions, after=after, limit=chunkSize, **filters
+            )
+            if chunkIds:
+                mergeSummary(summary, await repo.transition(session, chunkIds, status))
+        if len(chunkIds) < chunkSize:
+            return summary
+        after = chunkIds[-1]
@@ -0,0 +1,161 @@
+#  Startup warm-up, run by the app lifespan before the server takes requests, so the
+#    first requests after a deploy do not pay for:
+#      - opening the pool's connections, each a thread and a sqlite3 handle
+#      - compiling the repositories' statements; SQLAlchemy caches them per engine,
+#        by statement shape, so the shapes the views use are run once here with ids
+#        that match no row, in a transaction that is rolled back
+#      - the first dumps and loads of the schemas
+#      - reading the pages of hot tables' indexes from disk, when WARMUP_PREREAD_TABLES
+#        names them.  This fills the OS file cache; SQLite's own page cache is per
+#        connection
+#  Warm-up is best effort: a failing step is logged and startup goes on.
+import asyncio
+import contextlib
+import datetime
+import functools
+import logging
+import time
+from typing import Iterable
+
+from sqlalchemy import sql
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models.entities import Order, Pet
+from models.repositories import OrderRepo, PetRepo
+from schemas.schemas import OrderPetSchema, OrderSchema, PetSchema
+from .metrics import metrics
+
+logger = logging.getLogger("app.warmup")
+
+NO_ID = 0  # ids start at 1
+
+
+async def warmUp(
+    SessionLocal: async_sessionmaker,
+    shards=None,
+    prereadTables: Iterable[str] = (),
+) -> float:
+    """Warm the main database and any order shards up, returns the ms it took"""
+    start = time.perf_counter()
+    shardSessions = shards.SessionLocals if shards else []
+    databases = [SessionLocal, *shardSessions]
+    steps = [
+        *[("pool", functools.partial(openPool, database)) for database in databases],
+        ("pet statements", functools.partial(petStatements, SessionLocal)),
+        *[
+            (
+                "order statements",
+                functools.partial(orderStatements, database, not shards),
+            )
+            for database in shardSessions or [SessionLocal]
+        ],
+        ("schemas", warmSchemas),
+    ]
+    if prereadTables:
+        steps.extend(
+            ("index pages", functools.partial(prereadIndexes, database, prereadTables))
+            for database in databases
+        )
+    for name, step in steps:
+        try:
+            await step()
+        except Exception as err:
+            logger.warning(f"Warm-up step {name} failed: {err}")
+    ms = (time.perf_counter() - start) * 1000
+    metrics.timing("startup.warmup", ms)
+    logger.info(f"Warmed up in {ms:.1f} ms")
+    return ms
+
+
+async def openPool(SessionLocal: async_sessionmaker) -> int:
+    """Opens as many connections as the pool keeps, all at once"""
+    engine = SessionLocal.kw["bind"]
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    async with contextlib.AsyncExitStack() as stack:
+        connections = await asyncio.gather(
+            *[stack.enter_async_context(engine.connect()) for _ in range(size)]
+        )
+        await asyncio.gather(
+            *[connection.execute(sql.text("SELECT 1")) for connection in connections]
+        )
+    return size
+
+
+async def petStatements(SessionLocal: async_sessionmaker) -> None:
+    async with _rolledBack(SessionLocal) as session:
+        await PetRepo.fetchById(session, NO_ID)
+        await PetRepo.fetchById(session, NO_ID, fields=("name", "status"))
+        await PetRepo.fetchByIds(session, [NO_ID])
+        await PetRepo.fetchAllRows(session)
+        await PetRepo.fetchAllRows(session, {"status": "available"})
+        await PetRepo.fetchAllRows(session, {"name": ""})
+        await PetRepo.reserve(session, [NO_ID])
+        await PetRepo.release(session, [NO_ID])
+
+
+async def orderStatements(
+    SessionLocal: async_sessionmaker, includePets: bool = True
+) -> None:
+    #  shards have no pet table, their orders' pets are read from the main database
+    async with _rolledBack(SessionLocal) as session:
+        await OrderRepo.fetchById(session, NO_ID)
+        await OrderRepo.fetchByIds(session, [NO_ID])
+        if includePets:
+            await OrderRepo.fetchById(session, NO_ID, includePets=True)
+            await OrderRepo.fetchByIds(session, [NO_ID], includePets=True)
+        for conditions in ({}, {"status": "placed"}):
+            await OrderRepo.fetchAllRows(session, conditions)
+            await OrderRepo.fetchAllRows(session, conditions, petId=NO_ID)
+            await OrderRepo.count(session, conditions)
+            await OrderRepo.count(session, conditions, petId=NO_ID)
+        today = datetime.date.today()
+        await OrderRepo.fetchAllRows(
+            session, {"status": "placed"}, shipDateFrom=today, shipDateTo=today
+        )
+
+
+async def prereadIndexes(
+    SessionLocal: async_sessionmaker, tables: Iterable[str]
+) -> None:
+    """Scans every index of tables, a sequential read of their pages"""
+    async with _rolledBack(SessionLocal) as session:
+        result = await session.execute(
+            sql.text("SELECT name FROM sqlite_master WHERE type = 'table'")
+        )
+        existing = set(result.scalars())
+        for table in tables:
+            if table not in existing:
+                continue
+            indexes = await session.execute(sql.text(f'PRAGMA index_list("{table}")'))
+            for index in [row[1] for row in indexes]:
+                await session.execute(
+                    sql.text(f'SELECT count(*) FROM "{table}" INDEXED BY "{index}"')
+                )
+
+
+async def warmSchemas() -> None:
+    pet = Pet(id=NO_ID, name="", description="", status="available")
+    order = Order(
+        id=NO_ID,
+        ship_date=datetime.datetime.now(datetime.timezone.utc),
+        status="placed",
+        complete=False,
+        pet_ids=[],
+        pets=[pet],
+    )
+    for many in (False, True):
+        PetSchema(many=many).dump([pet] if many else pet)
+        OrderSchema(many=many).dump([order] if many else order)
+        OrderPetSchema(many=many).dump([order] if many else order)
+    PetSchema().load({"name": "", "status": "available"})
+    OrderSchema().load({"status": "placed", "petIds": []})
+
+
+@contextlib.asynccontextmanager
+async def _rolledBack(SessionLocal: async_sessionmaker):
+    async with SessionLocal() as session:
+        await session.begin()
+        try:
+            yield session
+        finally:
+            await session.rollback()
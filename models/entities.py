@@ -7,8 +7,11 @@ from sqlalchemy import (
     String,
     ForeignKey,
     Boolean,
+    Date,
     DateTime,
+    Index,
     Table,
+    Text,
     UniqueConstraint,
 )
 from sqlalchemy.orm import relationship, synonym
@@ -44,6 +47,12 @@ class Pet(Base):
 
 class Order(Base):
     __tablename__ = "order"
+    __table_args__ = (
+        # status filters and ship date ranges within them, see shipDateClauses
+        Index("idx_order_status_ship_date", "status", "ship_date", "id"),
+        #  ids are never reused, archived orders keep theirs
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True)
     ship_date = Column(
         DateTime(timezone=True),
@@ -56,3 +65,87 @@ class Order(Base):
     pets = relationship("Pet", secondary=OrderPet.__table__, lazy="noload")
 
     shipDate = synonym("ship_date")
+
+
+class ArchivedOrderPet(Base):
+    __tablename__ = "order_pet_archive"
+    __table_args__ = ({"comment": "order_pet rows of archived orders"},)
+    id = Column(Integer, primary_key=True)
+    order_id = Column(
+        Integer, ForeignKey("order_archive.id", ondelete="CASCADE"), index=True
+    )
+    pet_id = Column(Integer, ForeignKey("pet.id", ondelete="CASCADE"), index=True)
+    quantity = Column(Integer)
+
+
+class ArchivedOrder(Base):
+    #  Completed orders moved out of the order table by lib.jobs.archiveOrders.  Ids
+    #    are kept, and the attributes match Order so the order schemas dump either
+    __tablename__ = "order_archive"
+    __table_args__ = (
+        Index("idx_order_archive_status_ship_date", "status", "ship_date", "id"),
+        {"comment": "Completed orders older than ARCHIVE_AFTER_DAYS"},
+    )
+    id = Column(Integer, primary_key=True)
+    ship_date = Column(DateTime(timezone=True))
+    status = Column(String)
+    complete = Column(Boolean)
+    archived_at = Column(DateTime(timezone=True), nullable=False)
+    pet_ids = relationship(
+        "ArchivedOrderPet", order_by="ArchivedOrderPet.pet_id", lazy="noload"
+    )
+    pets = relationship(
+        "Pet", secondary=ArchivedOrderPet.__table__, lazy="noload", viewonly=True
+    )
+
+    shipDate = synonym("ship_date")
+
+
+class PetSalesDaily(Base):
+    #  Rollups rebuilt from orders and archived orders by lib.jobs.refreshRollups, so
+    #    analytics never aggregate the live tables
+    __tablename__ = "pet_sales_daily"
+    __table_args__ = (
+        Index("idx_pet_sales_daily_pet", "pet_id", "day"),
+        {"comment": "Quantity of each pet ordered per ship date"},
+    )
+    day = Column(Date, primary_key=True)
+    pet_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+
+class OrderStatusDaily(Base):
+    __tablename__ = "order_status_daily"
+    __table_args__ = ({"comment": "Number of orders per status per ship date"},)
+    day = Column(Date, primary_key=True)
+    status = Column(String, primary_key=True)
+    orders = Column(Integer, nullable=False)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        {"comment": "Stored responses of POST requests sent with an Idempotency-Key"},
+    )
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer)  # None while the original request is in flight
+    response = Column(Text)
+    expires_at = Column(DateTime(timezone=True), index=True, nullable=False)
+
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        #  ids are never reused once purged, feeds and clients resume past them
+        {
+            "comment": "Committed pet and order writes, read by the change feed",
+            "sqlite_autoincrement": True,
+        },
+    )
+    id = Column(Integer, primary_key=True)  # the SSE event id
+    entity = Column(String, nullable=False)  # pet | order
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # create | update | delete
+    status = Column(String)  # entity status after the change, if known
+    created_at = Column(DateTime(timezone=True), index=True, nullable=False)
@@ -1,19 +1,131 @@
+import datetime
 from multiprocessing import Array
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
 
-from sqlalchemy import sql, Sequence, Select
+from sqlalchemy import sql, Row, Sequence, Select
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
 
 from starlette import status
 from starlette.exceptions import HTTPException
 
-from .entities import Base, Pet, Order, OrderPet
+from .entities import (
+    Base,
+    Pet,
+    Order,
+    OrderPet,
+    ArchivedOrder,
+    ArchivedOrderPet,
+    IdempotencyKey,
+    ChangeLog,
+    PetSalesDaily,
+    OrderStatusDaily,
+)
+from lib.tracing import tracedMethods
 from lib.utils import dictToModel
-from .types import PetInOrderDict
+from .types import OrderRow, PetInOrderDict
 
 
+def shipDateClauses(
+    shipDate, shipDateFrom: Optional[datetime.date], shipDateTo: Optional[datetime.date]
+) -> List:
+    #  Both days are included.  Ship dates are compared as UTC datetimes, so that with
+    #    status the (status, ship_date, id) index seeks straight to the range
+    clauses = []
+    if shipDateFrom:
+        clauses.append(shipDate >= _utcMidnight(shipDateFrom))
+    if shipDateTo:
+        clauses.append(shipDate < _utcMidnight(shipDateTo + datetime.timedelta(days=1)))
+    return clauses
+
+
+def shipDateOrder(
+    model, shipDateFrom: Optional[datetime.date], shipDateTo: Optional[datetime.date]
+) -> Tuple:
+    #  Pages of a ship date range go in (ship_date, id) order, the index's own, so
+    #    they are read from it without sorting the whole range first
+    if shipDateFrom or shipDateTo:
+        return (model.ship_date, model.id)
+    return (model.id,)
+
+
+def _utcMidnight(day: datetime.date) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+
+
+async def transitionStatus(
+    session: AsyncSession,
+    model,
+    ids: List[int],
+    status: str,
+    transitions: Dict[str, Tuple[str, ...]],
+    guard=None,
+) -> Dict[str, List]:
+    #  One conditional UPDATE moves every row whose status may go to `status`, and
+    #    that passes the guard clause if one is given, then the statuses of the
+    #    others are read, under the same write lock, to say why they were left alone
+    sources = [source for source, targets in transitions.items() if status in targets]
+    stmt = (
+        sql.update(model)
+        .where(model.id.in_(ids), model.status.in_(sources))
+        .values(status=status)
+        .returning(model.id)
+    )
+    if guard is not None:
+        stmt = stmt.where(guard)
+    updated = (await session.execute(stmt)).scalars().all()
+    others = set(ids) - set(updated)
+    current = {}
+    if others:
+        stmt = sql.select(model.id, model.status).where(model.id.in_(others))
+        current = {row.id: row.status for row in await session.execute(stmt)}
+    await ChangeRepo.record(
+        session,
+        [
+            {
+                "entity": model.__tablename__,
+                "entity_id": id,
+                "action": "update",
+                "status": status,
+            }
+            for id in updated
+        ],
+    )
+    return {
+        "updated": sorted(updated),
+        "unchanged": [id for id in ids if current.get(id) == status],
+        "invalid": [
+            {"id": id, "status": current[id]}
+            for id in ids
+            if id in current and current[id] != status
+        ],
+        "missing": [id for id in ids if id in others and id not in current],
+    }
+
+
+@tracedMethods
 class PetRepo:
+    #
+    #   fields are the schema's public field names, used to SELECT only the
+    #   requested columns (the primary key is always loaded)
+    #
+    @staticmethod
+    def loadOnly(fields: Tuple[str, ...]):
+        return load_only(
+            Pet.id, *[getattr(Pet, field) for field in fields if field != "id"]
+        )
+
+    columns = ("id", "name", "description", "status")
+
+    # status -> the statuses a pet in it may be moved to by transition(), which
+    #   leaves pets of undelivered orders pending
+    transitions = {
+        "available": ("pending", "sold"),
+        "pending": ("available", "sold"),
+        "sold": (),
+    }
+
     @staticmethod
     async def create(session: AsyncSession, data: Dict) -> "Pet":
         pet = dictToModel(data, Pet())
@@ -21,27 +133,145 @@ class PetRepo:
         return pet
 
     @staticmethod
-    async def fetchById(session: AsyncSession, id: int) -> "Pet":
+    async def fetchById(
+        session: AsyncSession, id: int, fields: Optional[Tuple[str, ...]] = None
+    ) -> "Pet":
         stmt = sql.select(Pet).where(Pet.id == id)
+        if fields:
+            stmt = stmt.options(PetRepo.loadOnly(fields))
         # if includeOrders:
         #     stmt = stmt.options(joinedload(Pet.order_ids))
         result = await session.execute(stmt)
         return result.unique().scalar_one_or_none()
 
+    @staticmethod
+    async def fetchByIds(session: AsyncSession, ids: List[int]) -> List["Pet"]:
+        # One IN query for the whole list; pets are returned in the order the ids
+        #   were requested, ids with no pet are left out
+        ids = list(dict.fromkeys(ids))
+        stmt = sql.select(Pet).where(Pet.id.in_(ids))
+        result = await session.execute(stmt)
+        pets = {pet.id: pet for pet in result.scalars()}
+        return [pets[id] for id in ids if id in pets]
+
     @staticmethod
     async def fetchAll(
         session: AsyncSession,
         conditions: Optional[Dict] = None,
         limit=10,
         offset=0,
+        fields: Optional[Tuple[str, ...]] = None,
     ) -> Sequence["Pet"]:
         stmt = sql.select(Pet).order_by(Pet.name).limit(limit).offset(offset)
+        if fields:
+            stmt = stmt.options(PetRepo.loadOnly(fields))
         if conditions:
             # add simple filter conditions if requsted
             stmt = stmt.filter_by(**conditions)
         result = await session.execute(stmt)
         return result.unique().scalars().all()
 
+    @staticmethod
+    async def fetchAllRows(
+        session: AsyncSession,
+        conditions: Optional[Dict] = None,
+        limit=10,
+        offset=0,
+        fields: Optional[Tuple[str, ...]] = None,
+    ) -> Sequence[Row]:
+        # Same page as fetchAll, as Core rows of just the requested columns.  Rows
+        #   skip the identity map and attribute instrumentation, for pages that are
+        #   only dumped
+        names = [field for field in fields or PetRepo.columns if field != "id"]
+        stmt = sql.select(Pet.id, *[getattr(Pet, name) for name in names])
+        if conditions:
+            stmt = stmt.where(
+                *[getattr(Pet, key) == value for key, value in conditions.items()]
+            )
+        stmt = stmt.order_by(Pet.name).limit(limit).offset(offset)
+        result = await session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    async def reserve(
+        session: AsyncSession, ids: List[int], status: str = "pending"
+    ) -> List[int]:
+        # One conditional UPDATE moves every pet that is still available to status;
+        #   pets that are missing or were taken first are not touched.  Returns the
+        #   ids that were reserved, the caller compares them with ids
+        stmt = (
+            sql.update(Pet)
+            .where(Pet.id.in_(ids), Pet.status == "available")
+            .values(status=status)
+            .returning(Pet.id)
+        )
+        result = await session.execute(stmt)
+        reserved = result.scalars().all()
+        await ChangeRepo.record(
+            session,
+            [
+                {"entity": "pet", "entity_id": id, "action": "update", "status": status}
+                for id in reserved
+            ],
+        )
+        return reserved
+
+    @staticmethod
+    async def release(
+        session: AsyncSession, ids: List[int], status: str = "pending"
+    ) -> None:
+        # Undoes reserve(), for orders that could not be stored after their pets were
+        #   reserved in another database
+        stmt = (
+            sql.update(Pet)
+            .where(Pet.id.in_(ids), Pet.status == status)
+            .values(status="available")
+            .returning(Pet.id)
+        )
+        result = await session.execute(stmt)
+        await ChangeRepo.record(
+            session,
+            [
+                {
+                    "entity": "pet",
+                    "entity_id": id,
+                    "action": "update",
+                    "status": "available",
+                }
+                for id in result.scalars()
+            ],
+        )
+
+    @staticmethod
+    async def fetchIds(
+        session: AsyncSession, conditions: Optional[Dict] = None, after=0, limit=500
+    ) -> List[int]:
+        # Ids of the pets matching conditions, in id order from after on
+        stmt = sql.select(Pet.id).where(Pet.id > after)
+        if conditions:
+            stmt = stmt.filter_by(**conditions)
+        result = await session.execute(stmt.order_by(Pet.id).limit(limit))
+        return list(result.scalars())
+
+    @staticmethod
+    async def transition(
+        session: AsyncSession,
+        ids: List[int],
+        status: str,
+        held: Optional[List[int]] = None,
+    ) -> Dict[str, List]:
+        # Pets reserved by an order that is not delivered yet are not made available
+        #   again, they are reported invalid.  held lists them when the orders are
+        #   in other databases, otherwise they are found by the UPDATE itself
+        guard = None
+        if status == "available":
+            if held is None:
+                held = OrderRepo.heldPetIds(ids)
+            guard = Pet.id.not_in(held)
+        return await transitionStatus(
+            session, Pet, ids, status, PetRepo.transitions, guard
+        )
+
     @staticmethod
     async def update(
         session: AsyncSession, updated_data: Dict, pet: Optional[Pet] = None
@@ -71,15 +301,84 @@ class PetRepo:
         return stmt
 
 
+@tracedMethods
 class OrderRepo:
     #
     #   By default we'll get petIda, but not pets
     #
+    fieldColumns = {
+        "shipDate": Order.ship_date,
+        "status": Order.status,
+        "complete": Order.complete,
+    }
+
+    @staticmethod
+    def loadOnly(fields: Tuple[str, ...]):
+        columns = [
+            OrderRepo.fieldColumns[f] for f in fields if f in OrderRepo.fieldColumns
+        ]
+        return load_only(Order.id, *columns)
+
+    #
+    #   Loader for the pet lines, chosen by query shape.  One order joins in its
+    #   lines; lists use selectinload so LIMIT/OFFSET count orders rather than
+    #   joined rows.  Pets always come from their own query, so lines x pets rows
+    #   are never multiplied together
+    #
+    loaders = {"one": joinedload, "many": selectinload}
+    rowBatchSize = 500  # ids per IN list, as selectinload uses
+
+    # status -> the statuses an order in it may be moved to by transition()
+    transitions = {
+        "placed": ("approved", "delivered"),
+        "approved": ("delivered",),
+        "delivered": (),
+    }
+
+    @staticmethod
+    def heldPetIds(petIds: List[int]) -> Select:
+        # Those of petIds in orders that are not delivered, which hold them pending
+        return (
+            sql.select(OrderPet.pet_id)
+            .join(Order, Order.id == OrderPet.order_id)
+            .where(OrderPet.pet_id.in_(petIds), Order.status != "delivered")
+        )
+
+    @staticmethod
+    def loadRelations(
+        stmt: Select,
+        loader,
+        includePets: Optional[bool] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+    ) -> Select:
+        if fields:
+            stmt = stmt.options(OrderRepo.loadOnly(fields))
+        if not fields or "petIds" in fields:
+            stmt = stmt.options(loader(Order.pet_ids))
+        if includePets:
+            stmt = stmt.options(selectinload(Order.pets))
+        return stmt
+
     @staticmethod
     async def create(
-        session: AsyncSession, data: Dict, petIds: List[PetInOrderDict]
+        session: AsyncSession,
+        data: Dict,
+        petIds: List[PetInOrderDict],
+        shard: Optional[Tuple[int, int]] = None,
     ) -> "Order":
         order = dictToModel(data, Order())
+        if shard:
+            # (index, count) of a sharded store: the id is the next one of the
+            #   shard's residue, after its live and archived orders alike, worked
+            #   out by the INSERT itself under the write lock
+            index, count = shard
+            lastIds = [
+                sql.select(
+                    sql.func.coalesce(sql.func.max(model.id), index + 1 - count)
+                ).scalar_subquery()
+                for model in (Order, ArchivedOrder)
+            ]
+            order.id = sql.func.max(*lastIds) + count
         session.add(order)
         for petId in petIds:
             orderPet = dictToModel(petId, OrderPet())
@@ -88,15 +387,32 @@ class OrderRepo:
 
     @staticmethod
     async def fetchById(
-        session: AsyncSession, id: int, includePets: Optional[bool] = None
+        session: AsyncSession,
+        id: int,
+        includePets: Optional[bool] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+        loader=None,
     ) -> "Order":
         stmt = sql.select(Order).where(Order.id == id)
-        stmt = stmt.options(joinedload(Order.pet_ids))
-        if includePets:
-            stmt = stmt.options(joinedload(Order.pets))
+        stmt = OrderRepo.loadRelations(
+            stmt, loader or OrderRepo.loaders["one"], includePets, fields
+        )
         result = await session.execute(stmt)
         return result.unique().scalar_one_or_none()
 
+    @staticmethod
+    async def fetchByIds(
+        session: AsyncSession, ids: List[int], includePets: Optional[bool] = None
+    ) -> List["Order"]:
+        # One IN query for the orders, then one more each for their pet lines and,
+        #   if requested, their pets (selectinload batches these over all orders)
+        ids = list(dict.fromkeys(ids))
+        stmt = sql.select(Order).where(Order.id.in_(ids))
+        stmt = OrderRepo.loadRelations(stmt, OrderRepo.loaders["many"], includePets)
+        result = await session.execute(stmt)
+        orders = {order.id: order for order in result.scalars()}
+        return [orders[id] for id in ids if id in orders]
+
     @staticmethod
     async def fetchAll(
         session: AsyncSession,
@@ -105,43 +421,246 @@ class OrderRepo:
         includePets: Optional[bool] = None,
         limit=10,
         offset=0,
+        fields: Optional[Tuple[str, ...]] = None,
+        loader=None,
+        shipDateFrom: Optional[datetime.date] = None,
+        shipDateTo: Optional[datetime.date] = None,
     ) -> Sequence["Order"]:
-        stmt = sql.select(Order).order_by(Order.id).limit(limit).offset(offset)
-        stmt = stmt.options(joinedload(Order.pet_ids))
+        stmt = (
+            sql.select(Order)
+            .order_by(*shipDateOrder(Order, shipDateFrom, shipDateTo))
+            .limit(limit)
+            .offset(offset)
+        )
+        stmt = OrderRepo.loadRelations(
+            stmt, loader or OrderRepo.loaders["many"], includePets, fields
+        )
         if conditions:
             stmt = stmt.filter_by(**conditions)
+        stmt = stmt.where(*shipDateClauses(Order.ship_date, shipDateFrom, shipDateTo))
         if petId:
             stmt = stmt.join(OrderPet, Order.id == OrderPet.order_id).filter(
                 OrderPet.pet_id == petId
             )
-        if includePets:
-            stmt = stmt.options(joinedload(Order.pets))
         result = await session.execute(stmt)
         return result.unique().scalars().all()
 
+    @staticmethod
+    async def fetchAllRows(
+        session: AsyncSession,
+        conditions: Optional[Dict] = None,
+        petId: Optional[int] = None,
+        includePets: Optional[bool] = None,
+        limit=10,
+        offset=0,
+        fields: Optional[Tuple[str, ...]] = None,
+        shipDateFrom: Optional[datetime.date] = None,
+        shipDateTo: Optional[datetime.date] = None,
+    ) -> List[OrderRow]:
+        # Same page as fetchAll, as OrderRows filled from Core rows: one query for
+        #   the orders, then one per batch of orders for the lines and for the pets
+        columns = [
+            column
+            for name, column in OrderRepo.fieldColumns.items()
+            if not fields or name in fields
+        ]
+        stmt = sql.select(Order.id, *columns)
+        if conditions:
+            stmt = stmt.where(
+                *[getattr(Order, key) == value for key, value in conditions.items()]
+            )
+        stmt = stmt.where(*shipDateClauses(Order.ship_date, shipDateFrom, shipDateTo))
+        if petId:
+            stmt = stmt.join(OrderPet, Order.id == OrderPet.order_id).where(
+                OrderPet.pet_id == petId
+            )
+        stmt = stmt.order_by(*shipDateOrder(Order, shipDateFrom, shipDateTo))
+        result = await session.execute(stmt.limit(limit).offset(offset))
+        orders = {row.id: OrderRow(**row._mapping) for row in result}
+
+        ids = list(orders)
+        for start in range(0, len(ids), OrderRepo.rowBatchSize):
+            batch = ids[start : start + OrderRepo.rowBatchSize]
+            if not fields or "petIds" in fields:
+                stmt = (
+                    sql.select(OrderPet.order_id, OrderPet.pet_id, OrderPet.quantity)
+                    .where(OrderPet.order_id.in_(batch))
+                    .order_by(OrderPet.order_id, OrderPet.pet_id)
+                )
+                for line in await session.execute(stmt):
+                    orders[line.order_id].pet_ids.append(line)
+            if includePets:
+                stmt = (
+                    sql.select(OrderPet.order_id, *Pet.__table__.columns)
+                    .join(Pet, Pet.id == OrderPet.pet_id)
+                    .where(OrderPet.order_id.in_(batch))
+                    .order_by(OrderPet.order_id, OrderPet.pet_id)
+                )
+                for pet in await session.execute(stmt):
+                    orders[pet.order_id].pets.append(pet)
+        return list(orders.values())
+
+    @staticmethod
+    async def count(
+        session: AsyncSession,
+        conditions: Optional[Dict] = None,
+        petId: Optional[int] = None,
+        shipDateFrom: Optional[datetime.date] = None,
+        shipDateTo: Optional[datetime.date] = None,
+    ) -> int:
+        stmt = sql.select(sql.func.count(Order.id))
+        if conditions:
+            stmt = stmt.filter_by(**conditions)
+        stmt = stmt.where(*shipDateClauses(Order.ship_date, shipDateFrom, shipDateTo))
+        if petId:
+            stmt = stmt.join(OrderPet, Order.id == OrderPet.order_id).filter(
+                OrderPet.pet_id == petId
+            )
+        result = await session.execute(stmt)
+        return result.scalar()
+
+    @staticmethod
+    async def fetchIds(
+        session: AsyncSession,
+        conditions: Optional[Dict] = None,
+        after=0,
+        limit=500,
+        shipDateFrom: Optional[datetime.date] = None,
+        shipDateTo: Optional[datetime.date] = None,
+    ) -> List[int]:
+        # Ids of the orders matching conditions, after order `after` in id order, or
+        #   in (ship_date, id) order within a ship date range
+        order = shipDateOrder(Order, shipDateFrom, shipDateTo)
+        stmt = sql.select(Order.id)
+        if conditions:
+            stmt = stmt.filter_by(**conditions)
+        if len(order) > 1 and after:
+            #  order `after` is within the range, so it is the lower bound the index
+            #    seeks to
+            shipDate = sql.select(Order.ship_date).where(Order.id == after)
+            stmt = stmt.where(
+                sql.tuple_(*order) > sql.tuple_(shipDate.scalar_subquery(), after)
+            )
+            shipDateFrom = None
+        elif after:
+            stmt = stmt.where(Order.id > after)
+        stmt = stmt.where(*shipDateClauses(Order.ship_date, shipDateFrom, shipDateTo))
+        result = await session.execute(stmt.order_by(*order).limit(limit))
+        return list(result.scalars())
+
+    @staticmethod
+    async def transition(
+        session: AsyncSession, ids: List[int], status: str
+    ) -> Dict[str, List]:
+        return await transitionStatus(
+            session, Order, ids, status, OrderRepo.transitions
+        )
+
     @staticmethod
     async def update(
         session: AsyncSession,
         updated_data: Dict,
         order: Optional[Order] = None,
         petIds: Optional[List[PetInOrderDict]] = None,
+        removePetIds: Optional[List[int]] = None,
+        replacePets: bool = True,
     ) -> "Order":
         if not order:
-            order = fetchById(session, updated_data.pop("id", 0))
+            order = await OrderRepo.fetchById(session, updated_data.pop("id", 0))
             if order is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
                 )
         dictToModel(updated_data, order)
 
-        # if we have petIds, delete existing ones, and create new
-        if petIds:
-            order.pet_ids.clear()
-            for petId in petIds:
-                orderPet = dictToModel(petId, OrderPet())
-                order.pet_ids.append(orderPet)
+        # if we have petIds, apply only the changed lines to the existing ones
+        if petIds or (removePetIds and not replacePets):
+            await OrderRepo.updatePetIds(
+                session,
+                order,
+                petIds or [],
+                removePetIds=removePetIds,
+                replacePets=replacePets,
+            )
         return order
 
+    @staticmethod
+    def changedPetIds(
+        order: Order,
+        petIds: List[PetInOrderDict],
+        removePetIds: Optional[List[int]] = None,
+        replacePets: bool = True,
+    ) -> Tuple[List[int], List[int]]:
+        #  (added, removed) pet ids of the lines updatePetIds writes, for the callers
+        #    that reserve and release those pets.  Without petIds a replace keeps the
+        #    lines as they are
+        existing = {line.pet_id for line in order.pet_ids}
+        wanted = [petId["pet_id"] for petId in petIds]
+        if replacePets:
+            removed = existing - set(wanted) if petIds else set()
+        else:
+            removed = (set(removePetIds or []) & existing) - set(wanted)
+        added = [id for id in dict.fromkeys(wanted) if id not in existing]
+        return added, sorted(removed)
+
+    @staticmethod
+    async def updatePetIds(
+        session: AsyncSession,
+        order: Order,
+        petIds: List[PetInOrderDict],
+        removePetIds: Optional[List[int]] = None,
+        replacePets: bool = True,
+    ) -> None:
+        #  order.pet_ids must be loaded (fetchById does this).  With replacePets the
+        #    lines become exactly petIds; otherwise petIds are added or have their
+        #    quantity changed, lines in removePetIds are dropped and the rest are kept
+        existing = {line.pet_id: line for line in order.pet_ids}
+        wanted = {petId["pet_id"]: petId["quantity"] for petId in petIds}
+        _, removed = OrderRepo.changedPetIds(order, petIds, removePetIds, replacePets)
+
+        deletes = [existing[pet_id].id for pet_id in removed]
+        updates = [
+            {"id": existing[pet_id].id, "quantity": quantity}
+            for pet_id, quantity in wanted.items()
+            if pet_id in existing and existing[pet_id].quantity != quantity
+        ]
+        inserts = [
+            {"order_id": order.id, "pet_id": pet_id, "quantity": quantity}
+            for pet_id, quantity in wanted.items()
+            if pet_id not in existing
+        ]
+        if not (deletes or updates or inserts):
+            return
+
+        # deletes first, so a line can never collide with idx_order_pet_unique
+        if deletes:
+            await session.execute(sql.delete(OrderPet).where(OrderPet.id.in_(deletes)))
+        if updates:
+            await session.execute(sql.update(OrderPet), updates)
+        if inserts:
+            await session.execute(sql.insert(OrderPet), inserts)
+
+        # reload just the lines, so callers do not have to re-fetch the whole order
+        stmt = (
+            sql.select(OrderPet)
+            .where(OrderPet.order_id == order.id)
+            .order_by(OrderPet.pet_id)
+            .execution_options(populate_existing=True)
+        )
+        result = await session.execute(stmt)
+        set_committed_value(order, "pet_ids", list(result.scalars()))
+        await ChangeRepo.record(
+            session,
+            [
+                {
+                    "entity": "order",
+                    "entity_id": order.id,
+                    "action": "update",
+                    "status": order.status,
+                }
+            ],
+        )
+
     @staticmethod
     async def delete(
         session: AsyncSession, id: int, order: Optional[Order] = None
@@ -156,3 +675,361 @@ class OrderRepo:
     async def getSelect(session: AsyncSession) -> Select:
         stmt = sql.select(Order)
         return stmt
+
+
+class ArchiveRepo:
+    #
+    #   Completed orders are moved here in batches, keeping their ids, so reads can
+    #   fall back to the archive for orders missing from the live tables.  Archived
+    #   orders are read only
+    #
+    fieldColumns = {
+        "shipDate": ArchivedOrder.ship_date,
+        "status": ArchivedOrder.status,
+        "complete": ArchivedOrder.complete,
+    }
+
+    @staticmethod
+    def loadRelations(
+        stmt: Select,
+        includePets: Optional[bool] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+    ) -> Select:
+        if fields:
+            columns = [
+                ArchiveRepo.fieldColumns[f]
+                for f in fields
+                if f in ArchiveRepo.fieldColumns
+            ]
+            stmt = stmt.options(load_only(ArchivedOrder.id, *columns))
+        if not fields or "petIds" in fields:
+            stmt = stmt.options(selectinload(ArchivedOrder.pet_ids))
+        if includePets:
+            stmt = stmt.options(selectinload(ArchivedOrder.pets))
+        return stmt
+
+    @staticmethod
+    async def archiveOrders(
+        session: AsyncSession, before: datetime.datetime, batchSize: int = 500
+    ) -> int:
+        #  Moves up to batchSize complete or delivered orders shipped before `before`
+        now = datetime.datetime.now(datetime.timezone.utc)
+        stmt = (
+            sql.select(Order.id)
+            .where(
+                sql.or_(Order.complete.is_(True), Order.status == "delivered"),
+                Order.ship_date < before,
+            )
+            .order_by(Order.id)
+            .limit(batchSize)
+        )
+        ids = (await session.execute(stmt)).scalars().all()
+        if not ids:
+            return 0
+        await session.execute(
+            sql.insert(ArchivedOrder).from_select(
+                ["id", "ship_date", "status", "complete", "archived_at"],
+                sql.select(
+                    Order.id,
+                    Order.ship_date,
+                    Order.status,
+                    Order.complete,
+                    sql.literal(now, ArchivedOrder.archived_at.type),
+                ).where(Order.id.in_(ids)),
+            )
+        )
+        await session.execute(
+            sql.insert(ArchivedOrderPet).from_select(
+                ["id", "order_id", "pet_id", "quantity"],
+                sql.select(
+                    OrderPet.id, OrderPet.order_id, OrderPet.pet_id, OrderPet.quantity
+                ).where(OrderPet.order_id.in_(ids)),
+            )
+        )
+        await session.execute(sql.delete(OrderPet).where(OrderPet.order_id.in_(ids)))
+        await session.execute(sql.delete(Order).where(Order.id.in_(ids)))
+        return len(ids)
+
+    @staticmethod
+    async def fetchById(
+        session: AsyncSession,
+        id: int,
+        includePets: Optional[bool] = None,
+        fields: Optional[Tuple[str, ...]] = None,
+    ) -> "ArchivedOrder":
+        stmt = sql.select(ArchivedOrder).where(ArchivedOrder.id == id)
+        stmt = ArchiveRepo.loadRelations(stmt, includePets, fields)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def fetchByIds(
+        session: AsyncSession, ids: List[int], includePets: Optional[bool] = None
+    ) -> List["ArchivedOrder"]:
+        stmt = sql.select(ArchivedOrder).where(ArchivedOrder.id.in_(ids))
+        stmt = ArchiveRepo.loadRelations(stmt, includePets)
+        result = await session.execute(stmt)
+        orders = {order.id: order for order in result.scalars()}
+        return [orders[id] for id in dict.fromkeys(ids) if id in orders]
+
+    @staticmethod
+    async def fetchAll(
+        session: AsyncSession,
+        conditions: Optional[Dict] = None,
+        petId: Optional[int] = None,
+        includePets: Optional[bool] = None,
+        limit=10,
+        offset=0,
+        fields: Optional[Tuple[str, ...]] = None,
+        shipDateFrom: Optional[datetime.date] = None,
+        shipDateTo: Optional[datetime.date] = None,
+    ) -> Sequence["ArchivedOrder"]:
+        stmt = (
+            sql.select(ArchivedOrder)
+            .order_by(*shipDateOrder(ArchivedOrder, shipDateFrom, shipDateTo))
+            .limit(limit)
+            .offset(offset)
+        )
+        stmt = ArchiveRepo.loadRelations(stmt, includePets, fields)
+        if conditions:
+            stmt = stmt.filter_by(**conditions)
+        stmt = stmt.where(
+            *shipDateClauses(ArchivedOrder.ship_date, shipDateFrom, shipDateTo)
+        )
+        if petId:
+            stmt = stmt.join(
+                ArchivedOrderPet, ArchivedOrder.id == ArchivedOrderPet.order_id
+            ).filter(ArchivedOrderPet.pet_id == petId)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+class AnalyticsRepo:
+    #
+    #   Reads only touch the rollup tables.  rebuild() recomputes them from the live
+    #   and archived orders for ship dates from `start` on (all of them without one).
+    #   Buckets use SQLite date functions, day -> Monday of its week / 1st of month
+    #
+    buckets = {
+        "day": lambda day: day,
+        "week": lambda day: sql.func.date(day, "weekday 0", "-6 days"),
+        "month": lambda day: sql.func.date(day, "start of month"),
+    }
+
+    @staticmethod
+    async def rebuild(
+        session: AsyncSession, start: Optional[datetime.date] = None
+    ) -> None:
+        def orders(order, line):
+            stmt = sql.select(
+                sql.func.date(order.ship_date).label("day"),
+                line.pet_id,
+                line.quantity,
+            ).join(line, line.order_id == order.id)
+            return stmt.where(*since(order))
+
+        def statuses(order):
+            stmt = sql.select(sql.func.date(order.ship_date).label("day"), order.status)
+            return stmt.where(*since(order))
+
+        def since(order):
+            if not start:
+                return [order.ship_date.is_not(None)]
+            return [
+                order.ship_date >= datetime.datetime.combine(start, datetime.time())
+            ]
+
+        for rollup in (PetSalesDaily, OrderStatusDaily):
+            stmt = sql.delete(rollup)
+            if start:
+                stmt = stmt.where(rollup.day >= start)
+            await session.execute(stmt)
+
+        lines = sql.union_all(
+            orders(Order, OrderPet), orders(ArchivedOrder, ArchivedOrderPet)
+        ).subquery()
+        await session.execute(
+            sql.insert(PetSalesDaily).from_select(
+                ["day", "pet_id", "quantity"],
+                sql.select(
+                    lines.c.day, lines.c.pet_id, sql.func.sum(lines.c.quantity)
+                ).group_by(lines.c.day, lines.c.pet_id),
+            )
+        )
+        shipped = sql.union_all(statuses(Order), statuses(ArchivedOrder)).subquery()
+        await session.execute(
+            sql.insert(OrderStatusDaily).from_select(
+                ["day", "status", "orders"],
+                sql.select(shipped.c.day, shipped.c.status, sql.func.count()).group_by(
+                    shipped.c.day, shipped.c.status
+                ),
+            )
+        )
+
+    @staticmethod
+    async def petSales(
+        session: AsyncSession,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        bucket: str = "day",
+        petId: Optional[int] = None,
+        limit=100,
+        offset=0,
+    ) -> List[Dict]:
+        period = AnalyticsRepo.buckets[bucket](PetSalesDaily.day).label("period")
+        quantity = sql.func.sum(PetSalesDaily.quantity).label("quantity")
+        stmt = sql.select(period, PetSalesDaily.pet_id, quantity)
+        stmt = AnalyticsRepo.between(stmt, PetSalesDaily.day, start, end)
+        if petId:
+            stmt = stmt.where(PetSalesDaily.pet_id == petId)
+        stmt = (
+            stmt.group_by(period, PetSalesDaily.pet_id)
+            .order_by(period, quantity.desc(), PetSalesDaily.pet_id)
+            .limit(limit)
+            .offset(offset)
+        )
+        result = await session.execute(stmt)
+        return [
+            {"period": str(row.period), "petId": row.pet_id, "quantity": row.quantity}
+            for row in result
+        ]
+
+    @staticmethod
+    async def orderCounts(
+        session: AsyncSession,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        bucket: str = "day",
+        status: Optional[str] = None,
+    ) -> List[Dict]:
+        period = AnalyticsRepo.buckets[bucket](OrderStatusDaily.day).label("period")
+        orders = sql.func.sum(OrderStatusDaily.orders).label("orders")
+        stmt = sql.select(period, OrderStatusDaily.status, orders)
+        stmt = AnalyticsRepo.between(stmt, OrderStatusDaily.day, start, end)
+        if status:
+            stmt = stmt.where(OrderStatusDaily.status == status)
+        stmt = stmt.group_by(period, OrderStatusDaily.status).order_by(
+            period, OrderStatusDaily.status
+        )
+        result = await session.execute(stmt)
+        return [
+            {"period": str(row.period), "status": row.status, "orders": row.orders}
+            for row in result
+        ]
+
+    @staticmethod
+    def between(stmt: Select, day, start, end) -> Select:
+        if start:
+            stmt = stmt.where(day >= start)
+        if end:
+            stmt = stmt.where(day <= end)
+        return stmt
+
+
+class IdempotencyRepo:
+    @staticmethod
+    async def create(session: AsyncSession, data: Dict) -> "IdempotencyKey":
+        record = dictToModel(data, IdempotencyKey())
+        session.add(record)
+        return record
+
+    @staticmethod
+    async def fetchByKey(session: AsyncSession, key: str) -> "IdempotencyKey":
+        stmt = sql.select(IdempotencyKey).where(IdempotencyKey.key == key)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def deleteIfExpired(
+        session: AsyncSession, key: str, now: datetime.datetime
+    ) -> None:
+        # Conditional, so of two workers taking over an expired lease the one
+        #   blocked on the write lock leaves the other's fresh claim alone
+        stmt = sql.delete(IdempotencyKey).where(
+            IdempotencyKey.key == key, IdempotencyKey.expires_at <= now
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def complete(
+        session: AsyncSession,
+        key: str,
+        lease: datetime.datetime,
+        statusCode: int,
+        response: str,
+        expiresAt: datetime.datetime,
+    ) -> bool:
+        # False when the in-flight claim expiring at lease was taken over meanwhile
+        stmt = (
+            sql.update(IdempotencyKey)
+            .where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.status_code.is_(None),
+                IdempotencyKey.expires_at == lease,
+            )
+            .values(status_code=statusCode, response=response, expires_at=expiresAt)
+        )
+        result = await session.execute(stmt)
+        return result.rowcount == 1
+
+    @staticmethod
+    async def release(
+        session: AsyncSession, key: str, lease: datetime.datetime
+    ) -> None:
+        stmt = sql.delete(IdempotencyKey).where(
+            IdempotencyKey.key == key,
+            IdempotencyKey.status_code.is_(None),
+            IdempotencyKey.expires_at == lease,
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    async def deleteExpired(session: AsyncSession, now: datetime.datetime) -> int:
+        stmt = sql.delete(IdempotencyKey).where(IdempotencyKey.expires_at < now)
+        result = await session.execute(stmt)
+        return result.rowcount
+
+
+class ChangeRepo:
+    #
+    #   Rows for the change feed.  ORM writes are recorded by lib.changefeed on flush,
+    #   bulk statements that bypass the unit of work call record() themselves.
+    #   Nothing is recorded unless the session was made with info={"changeLog": True}
+    #
+    @staticmethod
+    async def record(session: AsyncSession, changes: List[Dict]) -> None:
+        if not changes or not session.info.get("changeLog"):
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        await session.execute(
+            sql.insert(ChangeLog), [{**change, "created_at": now} for change in changes]
+        )
+        session.info["changed"] = True
+
+    @staticmethod
+    async def fetchSince(
+        session: AsyncSession,
+        lastId: int,
+        entity: Optional[str] = None,
+        status: Optional[str] = None,
+        limit: int = 500,
+    ) -> Sequence["ChangeLog"]:
+        stmt = sql.select(ChangeLog).where(ChangeLog.id > lastId)
+        if entity:
+            stmt = stmt.where(ChangeLog.entity == entity)
+        if status:
+            stmt = stmt.where(ChangeLog.status == status)
+        stmt = stmt.order_by(ChangeLog.id).limit(limit)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @staticmethod
+    async def lastId(session: AsyncSession) -> int:
+        result = await session.execute(sql.select(sql.func.max(ChangeLog.id)))
+        return result.scalar() or 0
+
+    @staticmethod
+    async def deleteBefore(session: AsyncSession, before: datetime.datetime) -> int:
+        stmt = sql.delete(ChangeLog).where(ChangeLog.created_at < before)
+        result = await session.execute(stmt)
+        return result.rowcount
@@ -1,6 +1,23 @@
-from typing import TypedDict
+import datetime
+from dataclasses import dataclass, field
+from typing import List, Optional, TypedDict
+
+from sqlalchemy import Row
 
 
 class PetInOrderDict(TypedDict):
     pet_id: int
     quantity: int
+
+
+@dataclass(slots=True)
+class OrderRow:
+    #  Read-model order for list endpoints, built from Core rows without the session
+    #    identity map.  Its pet lines and pets are plain Rows, which the schemas dump
+    #    the same way as entities
+    id: int
+    ship_date: Optional[datetime.datetime] = None
+    status: Optional[str] = None
+    complete: Optional[bool] = None
+    pet_ids: List[Row] = field(default_factory=list)
+    pets: List[Row] = field(default_factory=list)
@@ -1,8 +1,11 @@
 import datetime
+from typing import Dict, Optional, Tuple
+
 import pytz
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema, auto_field
 from marshmallow import INCLUDE, fields, post_dump, pre_load, ValidationError, Schema
 
+from lib.tracing import span
 from models.entities import Pet, Order
 
 
@@ -16,20 +19,76 @@ class PetIds(Schema):
     quantity = fields.Integer()
 
 
-class PetSchema(SQLAlchemyAutoSchema):
+class SparseFields:
+    """Lets a schema dump only some of its keys, as asked for by a `fields` query
+    parameter, e.g. `fields=id,name,status`"""
+
+    #  public key -> declared field that dumps it, or None when a post_dump hook adds it
+    publicFields: Dict[str, Optional[str]] = {}
+
+    def __init__(self, *args, fields: Optional[Tuple[str, ...]] = None, **kwargs):
+        self.dumpKeys = None if fields is None else set(fields)
+        if fields is not None:
+            kwargs["only"] = tuple(
+                self.publicFields[key] for key in fields if self.publicFields[key]
+            )
+        super().__init__(*args, **kwargs)
+
+    def dump(self, obj, *args, **kwargs):
+        with span(f"{type(self).__name__}.dump"):
+            return super().dump(obj, *args, **kwargs)
+
+    def load(self, data, *args, **kwargs):
+        with span(f"{type(self).__name__}.load"):
+            return super().load(data, *args, **kwargs)
+
+    def wants(self, key: str) -> bool:
+        return self.dumpKeys is None or key in self.dumpKeys
+
+    @classmethod
+    def parseFields(cls, fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+        if not fields:
+            return None
+        keys = tuple(dict.fromkeys(key.strip() for key in fields.split(",")))
+        unknown = [key for key in keys if key not in cls.publicFields]
+        if unknown:
+            raise ValidationError(
+                {"fields": [f"Unknown field: {key}" for key in unknown]}
+            )
+        return keys
+
+
+class PetSchema(SparseFields, SQLAlchemyAutoSchema):
     id = auto_field(dump_only=True)
 
+    publicFields = {
+        "id": "id",
+        "name": "name",
+        "description": "description",
+        "status": "status",
+    }
+
     class Meta:
         model = Pet
         unknown = INCLUDE
         load_instance = False
 
 
-class OrderSchema(SQLAlchemyAutoSchema):
+class OrderSchema(SparseFields, SQLAlchemyAutoSchema):
     id = auto_field(dump_only=True)
 
+    publicFields = {
+        "id": "id",
+        "petIds": None,
+        "shipDate": "ship_date",
+        "status": "status",
+        "complete": "complete",
+    }
+
     @post_dump(pass_original=True)
     def retPetIds(self, data, original_data, **kwargs):
+        if not self.wants("petIds"):
+            return data
         data["petIds"] = PetIds(many=True).dump(original_data.pet_ids)
         return data
 
@@ -42,6 +101,8 @@ class OrderSchema(SQLAlchemyAutoSchema):
 
     @post_dump(pass_original=True)
     def retDate(self, data, original_data, **kwargs):
+        if not self.wants("shipDate"):
+            return data
         data.pop("ship_date")
         data["shipDate"] = original_data.ship_date.strftime("%Y-%m-%d")
         return data
@@ -71,7 +132,11 @@ class OrderSchema(SQLAlchemyAutoSchema):
 
 
 class OrderPetSchema(OrderSchema):
+    publicFields = {**OrderSchema.publicFields, "pets": None}
+
     @post_dump(pass_original=True)
     def pets(self, data, original_data, **kwargs):
+        if not self.wants("pets"):
+            return data
         data["pets"] = PetSchema(many=True).dump(original_data.pets)
         return data
@@ -4,12 +4,147 @@
 APP_NAME = "ConnexionPetStore"
 JWT_ALGORITHM = "HS256"
 
+# Identical concurrent GET requests for pets and orders share one query and response
+COALESCE_READS = True
+
+# Seconds the response of a POST sent with an Idempotency-Key is kept for retries,
+#   and that a request still in flight holds its key before a retry may take it over
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LEASE = 30
+IDEMPOTENCY_PURGE_INTERVAL = 10 * 60
+
+# Pets or orders moved per transaction by POST /pets:transition and
+#   POST /orders:transition
+BULK_TRANSITION_CHUNK_SIZE = 500
+
+# Queue order creations to a single writer task that commits them in groups of up to
+#   WRITE_BATCH_SIZE, waiting at most WRITE_BATCH_MAX_WAIT seconds to fill a group
+WRITE_BATCHING = False
+WRITE_BATCH_SIZE = 50
+WRITE_BATCH_MAX_WAIT = 0.005
+
+# How statements reach SQLite: "aiosqlite", a thread per connection, or "threadpool",
+#   stdlib sqlite3 connections run on a pool of DATABASE_POOL_SIZE threads, which
+#   saves a thread hop or more per statement (see lib/drivers.py)
+DATABASE_DRIVER = "aiosqlite"
+DATABASE_POOL_SIZE = 8
+
+# Database URLs of the order shards, e.g. ["sqlite+aiosqlite:///orders-0.db", ...].
+#   Orders are partitioned over them by id while pets stay in DATABASE_URL; analytics
+#   rollups and the change feed do not cover sharded orders.  None keeps orders in
+#   DATABASE_URL
+SHARD_URLS = None
+
+# Before reporting ready, open the pool connections, run every repository statement
+#   shape once so SQLAlchemy caches its compiled form, and build the schemas (see
+#   lib/warmup.py).  WARMUP_PREREAD_TABLES names tables whose index pages are read
+#   into the OS file cache, e.g. ("pet", "order", "order_pet")
+WARMUP = True
+WARMUP_PREREAD_TABLES = ()
+
+# Background job scheduler started by the app lifespan (see lib/jobs.py).  Blocking
+#   jobs run in a pool of SCHEDULER_MAX_WORKERS threads or processes
+SCHEDULER_ENABLED = True
+SCHEDULER_MAX_CONCURRENCY = 4
+SCHEDULER_MAX_WORKERS = 2
+
+# Record pet and order writes in change_log and stream them from GET /changes.  Each
+#   subscriber may fall CHANGE_FEED_QUEUE_SIZE events behind before it is disconnected.
+#   Rows older than CHANGE_LOG_RETENTION seconds are purged every
+#   CHANGE_LOG_PURGE_INTERVAL seconds
+CHANGE_FEED_ENABLED = True
+CHANGE_FEED_QUEUE_SIZE = 100
+CHANGE_FEED_POLL_INTERVAL = 1.0
+CHANGE_LOG_RETENTION = 24 * 60 * 60
+CHANGE_LOG_PURGE_INTERVAL = 10 * 60
+
+# Move complete or delivered orders shipped more than ARCHIVE_AFTER_DAYS ago to the
+#   order_archive tables, ARCHIVE_BATCH_SIZE orders per transaction.  None disables
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL = 60 * 60
+
+# Seconds between refreshes of the analytics rollups, which recompute ship dates from
+#   ROLLUP_WINDOW_DAYS ago on.  All of them are rebuilt at startup.  None disables
+ROLLUP_INTERVAL = 5 * 60
+ROLLUP_WINDOW_DAYS = 30
+
+# Requests in flight per class, and how many more may queue for a slot.  Requests are
+#   answered 503 with Retry-After when the queue is full or they would wait more than
+#   ADMISSION_DEADLINE seconds.  Long-lived streams are exempt
+ADMISSION_CONTROL = True
+ADMISSION_LIMITS = {
+    "read": {"maxInFlight": 32, "maxQueue": 64},
+    "write": {"maxInFlight": 8, "maxQueue": 32},
+}
+ADMISSION_DEADLINE = 1.0
+ADMISSION_EXEMPT_PATHS = (
+    "/api/v3/changes",
+    "/api/v3/metrics",
+    "/api/v3/traces",
+    "/api/v3/diagnostics",
+)
+
+# Write a TRAFFIC_CAPTURE_SAMPLE_RATE share of requests to TRAFFIC_CAPTURE_PATH, with
+#   credentials redacted, for replay by python -m lib.replay.  The file is rotated at
+#   TRAFFIC_CAPTURE_MAX_BYTES keeping TRAFFIC_CAPTURE_BACKUPS old files, and bodies are
+#   cut at TRAFFIC_CAPTURE_MAX_BODY bytes
+TRAFFIC_CAPTURE = False
+TRAFFIC_CAPTURE_PATH = "logs/traffic.jsonl"
+TRAFFIC_CAPTURE_SAMPLE_RATE = 0.01
+TRAFFIC_CAPTURE_MAX_BYTES = 64 * 2**20
+TRAFFIC_CAPTURE_BACKUPS = 5
+TRAFFIC_CAPTURE_MAX_BODY = 64 * 2**10
+TRAFFIC_CAPTURE_EXEMPT_PATHS = (
+    "/api/v3/ready",
+    "/api/v3/changes",
+    "/api/v3/metrics",
+    "/api/v3/traces",
+    "/api/v3/diagnostics",
+)
+
+# Profile requests sent with an X-Profile header equal to PROFILE_TOKEN, and a
+#   PROFILE_SAMPLE_RATE share of the others, with cProfile ("cprofile") or a stack
+#   sampler ("sampling", every PROFILE_STACK_INTERVAL seconds).  Profiles go to
+#   PROFILE_DIR, keeping the PROFILE_MAX_FILES newest, and are named by the response's
+#   X-Profile-Id header
+PROFILING = False
+PROFILE_TOKEN = None
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_MODE = "cprofile"
+PROFILE_STACK_INTERVAL = 0.001
+PROFILE_DIR = "logs/profiles"
+PROFILE_MAX_FILES = 100
+
+# Give every request an id, from its X-Request-ID header or made up, logged with each
+#   record and returned in the response.  A TRACE_SAMPLE_RATE share of requests is
+#   traced, spans of session, repository, schema and auth calls, and the
+#   TRACE_BUFFER_SIZE latest traces are served by GET /traces.  TRACE_FILE also
+#   appends them to a JSONL file
+TRACING = True
+TRACE_SAMPLE_RATE = 0.0
+TRACE_BUFFER_SIZE = 200
+TRACE_FILE = None
+
+# Serve the admin /diagnostics/memory endpoints, which start and stop tracemalloc
+#   (MEMORY_TRACE_FRAMES frames per allocation), take snapshots keeping the
+#   MEMORY_SNAPSHOTS newest, and count live entity and schema objects.  Off, the
+#   endpoints answer 404 and tracemalloc is never started
+MEMORY_DIAGNOSTICS = False
+MEMORY_TRACE_FRAMES = 10
+MEMORY_SNAPSHOTS = 5
+
+# Bytes of encoded GET /pets and GET /orders responses kept per worker, 0 disables.
+#   Entries are dropped when their tables are written, or after MAX_AGE seconds
+RESPONSE_CACHE_BYTES = 32 * 2**20
+RESPONSE_CACHE_MAX_AGE = 30
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
         "standard": {
-            "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            "format": "%(asctime)s [%(levelname)s] [%(requestId)s] %(name)s: %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
     },
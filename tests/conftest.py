@@ -75,6 +75,11 @@ TEST_CONFIG = {
     "DATABASE_URL": "sqlite+aiosqlite:///:memory:",
     "SECRET_KEY": "test-secret-key",
     "LOGGING_CONFIG": TEST_LOGGING_CONFIG,
+    # background jobs would use the shared in-memory connection outside test sessions
+    "SCHEDULER_ENABLED": False,
+    # nor may the warm-up, which rolls back module fixtures' rows on it
+    "WARMUP": False,
+    "CHANGE_FEED_ENABLED": False,
 }
 
 test_sessions = {}
@@ -169,6 +174,13 @@ async def client(app, db_session):
         yield client
 
 
+@pytest.fixture(scope="function")
+async def admin_client(client):
+    # a token with the admin:diagnostics scope, see auth.utils.testTokens
+    client.headers.update({"Authorization": "Bearer TestAdminJWTtoken"})
+    yield client
+
+
 @pytest.fixture(scope="function")
 async def bad_session(app, db_session):
     # invalidate this session
@@ -0,0 +1,83 @@
+import asyncio
+
+import httpx
+import pytest
+
+from lib.admission import AdmissionLimiter, AdmissionMiddleware, Overloaded
+from lib.metrics import metrics
+
+
+@pytest.mark.anyio
+async def test_limiter_queues_then_sheds():
+    limiter = AdmissionLimiter("test", maxInFlight=1, maxQueue=1, deadline=0.1)
+    await limiter.acquire()
+    queued = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert len(limiter.waiters) == 1
+
+    rejected = metrics.counters["admission.test.rejected"]
+    with pytest.raises(Overloaded):
+        await limiter.acquire()  # queue full
+    limiter.release(0.01)
+    await queued  # was handed the slot
+    assert limiter.inFlight == 1 and not limiter.waiters
+
+    # a queued request is shed at the deadline
+    with pytest.raises(Overloaded) as err:
+        await limiter.acquire()
+    assert err.value.retryAfter > 0
+    assert metrics.counters["admission.test.rejected"] == rejected + 2
+    limiter.release()
+    assert limiter.inFlight == 0
+    assert metrics.gauges["admission.test.queued"] == 0
+
+
+@pytest.mark.anyio
+async def test_estimated_wait_sheds_without_queueing():
+    limiter = AdmissionLimiter("slow", maxInFlight=1, maxQueue=10, deadline=0.5)
+    limiter.serviceTime = 1.0
+    await limiter.acquire()
+    with pytest.raises(Overloaded) as err:
+        await limiter.acquire()
+    assert not limiter.waiters
+    assert err.value.retryAfter == 1.0
+
+
+@pytest.mark.anyio
+async def test_middleware_limits_reads_and_writes_separately():
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["path"] != "/fast":
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    limits = {"read": {"maxInFlight": 1, "maxQueue": 0}, "write": {"maxInFlight": 1}}
+    middleware = AdmissionMiddleware(
+        app, limits=limits, deadline=0.5, exemptPaths=("/stream",)
+    )
+    transport = httpx.ASGITransport(app=middleware)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        held = asyncio.ensure_future(client.get("/slow"))
+        await asyncio.sleep(0.01)
+        shed = await client.get("/fast")
+        assert shed.status_code == 503
+        assert shed.headers["Retry-After"] == "1"
+        assert shed.json()["title"] == "Service Unavailable"
+
+        # writes and exempt paths have their own room
+        assert (await client.post("/fast")).status_code == 200
+        stream = asyncio.ensure_future(client.get("/stream"))
+        release.set()
+        assert (await held).status_code == 200
+        assert (await stream).status_code == 200
+        assert (await client.get("/fast")).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_admission_metrics_exposed(client):
+    get_res = client.get("/api/v3/pets")
+    assert get_res.status_code == 200
+    get_res = client.get("/api/v3/metrics")
+    assert get_res.json()["gauges"]["admission.read.inFlight"] == 0
@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+from models.entities import Order, OrderPet
+from models.repositories import AnalyticsRepo, ArchiveRepo
+
+
+def shipped(day):
+    return datetime.datetime.combine(day, datetime.time(12), datetime.timezone.utc)
+
+
+@pytest.mark.anyio
+async def test_rollups(client, db_session, make_pets, make_orders):
+    monday = datetime.date(2026, 3, 2)
+    for day, status, quantity in (
+        (monday, "delivered", 3),
+        (monday + datetime.timedelta(days=6), "delivered", 4),
+        (monday + datetime.timedelta(days=7), "approved", 5),
+    ):
+        order = Order(status=status, ship_date=shipped(day))
+        order.pet_ids = [OrderPet(pet_id=make_pets[2].id, quantity=quantity)]
+        db_session.add(order)
+    await db_session.flush()
+    # archived orders still count
+    archiveBefore = shipped(monday + datetime.timedelta(days=1))
+    assert await ArchiveRepo.archiveOrders(db_session, archiveBefore) == 1
+    await AnalyticsRepo.rebuild(db_session)
+
+    params = {"start": "2026-03-01", "end": "2026-03-31", "bucket": "week"}
+    get_res = client.get("/api/v3/analytics/petSales", params=params)
+    assert get_res.status_code == 200
+    assert get_res.json() == [
+        {"period": "2026-03-02", "petId": make_pets[2].id, "quantity": 7},
+        {"period": "2026-03-09", "petId": make_pets[2].id, "quantity": 5},
+    ]
+    params["bucket"] = "month"
+    get_res = client.get("/api/v3/analytics/orderCounts", params=params)
+    assert get_res.json() == [
+        {"period": "2026-03-01", "status": "approved", "orders": 1},
+        {"period": "2026-03-01", "status": "delivered", "orders": 2},
+    ]
+
+    #  the fixture orders, shipped in a week's time
+    get_res = client.get(
+        "/api/v3/analytics/petSales", params={"start": "2026-04-01", "limit": 1}
+    )
+    assert get_res.json()[0]["petId"] == make_pets[1].id
+    assert get_res.json()[0]["quantity"] == 2
+    get_res = client.get(
+        "/api/v3/analytics/orderCounts",
+        params={"start": "2026-04-01", "status": "placed"},
+    )
+    assert [count["orders"] for count in get_res.json()] == [1]
+
+    #  a partial rebuild only replaces the days from its start on
+    await db_session.delete(await db_session.get(Order, make_orders[0].id))
+    await AnalyticsRepo.rebuild(db_session, start=datetime.date(2026, 4, 1))
+    get_res = client.get("/api/v3/analytics/orderCounts", params={"end": "2026-03-31"})
+    assert sum(count["orders"] for count in get_res.json()) == 3
+    get_res = client.get(
+        "/api/v3/analytics/orderCounts",
+        params={"start": "2026-04-01", "status": "placed"},
+    )
+    assert get_res.json() == []
+
+
+@pytest.mark.anyio
+async def test_rollup_validations(client):
+    params = {"start": "2026-03-31", "end": "2026-03-01"}
+    get_res = client.get("/api/v3/analytics/petSales", params=params)
+    assert get_res.status_code == 400
+    get_res = client.get("/api/v3/analytics/orderCounts", params={"start": "March"})
+    assert get_res.status_code == 400
+    assert "YYYY-MM-DD" in get_res.json()["detail"]
+    get_res = client.get("/api/v3/analytics/orderCounts", params={"bucket": "hour"})
+    assert get_res.status_code == 400
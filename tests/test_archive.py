@@ -0,0 +1,103 @@
+import datetime
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from lib.jobs import archiveOrders
+from models.entities import ArchivedOrder, ArchivedOrderPet, Base, Order, OrderPet
+from models.repositories import ArchiveRepo
+
+
+def later(days=30):
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=days)
+
+
+@pytest.mark.anyio
+async def test_archived_orders_are_still_read(
+    client, db_session, make_pets, make_orders
+):
+    delivered = make_orders[1]
+    assert await ArchiveRepo.archiveOrders(db_session, later()) == 1
+    assert await db_session.get(Order, delivered.id, populate_existing=True) is None
+
+    get_res = client.get(
+        f"/api/v3/orders/{delivered.id}", params={"includePets": "yes"}
+    )
+    assert get_res.status_code == 200
+    assert get_res.json()["status"] == "delivered"
+    assert get_res.json()["petIds"] == [{"petId": make_pets[1].id, "quantity": 2}]
+    assert get_res.json()["pets"][0]["name"] == make_pets[1].name
+
+    #  archived orders follow the live ones, across pages
+    get_res = client.get("/api/v3/orders/")
+    assert [order["id"] for order in get_res.json()] == [
+        make_orders[0].id,
+        delivered.id,
+    ]
+    get_res = client.get("/api/v3/orders/", params={"offset": 1})
+    assert [order["id"] for order in get_res.json()] == [delivered.id]
+    get_res = client.get("/api/v3/orders/", params={"status": "delivered"})
+    assert [order["id"] for order in get_res.json()] == [delivered.id]
+    get_res = client.get("/api/v3/orders/", params={"petId": make_pets[1].id})
+    assert [order["id"] for order in get_res.json()] == [delivered.id]
+
+    post_res = client.post(
+        "/api/v3/orders:batchGet", json={"ids": [delivered.id, make_orders[0].id]}
+    )
+    assert [order["id"] for order in post_res.json()["orders"]] == [
+        delivered.id,
+        make_orders[0].id,
+    ]
+
+
+@pytest.mark.anyio
+async def test_only_old_completed_orders_are_archived(db_session, make_orders):
+    assert await ArchiveRepo.archiveOrders(db_session, later(-30)) == 0
+    await db_session.execute(
+        update(Order).where(Order.id == make_orders[0].id).values(complete=True)
+    )
+    assert await ArchiveRepo.archiveOrders(db_session, later(), batchSize=1) == 1
+    assert await ArchiveRepo.archiveOrders(db_session, later(), batchSize=1) == 1
+    assert await ArchiveRepo.archiveOrders(db_session, later()) == 0
+
+
+@pytest.mark.anyio
+async def test_archive_job_moves_batches(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/archive.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession)
+    shipped = later(-100)
+    async with SessionLocal() as session:
+        async with session.begin():
+            for i in range(7):
+                order = Order(status="delivered", ship_date=shipped)
+                order.pet_ids = [OrderPet(pet_id=i + 1, quantity=1)]
+                session.add(order)
+            session.add(Order(status="placed", ship_date=shipped))
+
+    assert await archiveOrders(SessionLocal, afterDays=90, batchSize=3) == 7
+    async with SessionLocal() as session:
+        count = lambda entity: session.scalar(select(func.count()).select_from(entity))
+        assert await count(Order) == 1
+        assert await count(OrderPet) == 0
+        assert await count(ArchivedOrder) == 7
+        assert await count(ArchivedOrderPet) == 7
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_archived_order_ids_are_not_reused(
+    client, db_session, make_pets, make_orders
+):
+    newest = make_orders[-1]
+    assert await ArchiveRepo.archiveOrders(db_session, later()) == 1
+
+    petIds = [{"quantity": 1, "petId": make_pets[2].id}]
+    post_res = client.post("/api/v3/orders", json={"petIds": petIds})
+    assert post_res.status_code == 201
+    assert post_res.json()["id"] > newest.id
+
+    get_res = client.get(f"/api/v3/orders/{newest.id}")
+    assert get_res.json()["status"] == "delivered"
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from lib.cache import ResponseCache
+from lib.metrics import metrics
+
+
+@pytest.mark.anyio
+async def test_cache_is_bounded_by_bytes():
+    cache = ResponseCache(maxBytes=100, maxAge=60)
+    cache.put("a", (1,), b"x" * 40)
+    cache.put("b", (1,), b"x" * 40)
+    assert cache.get("a", (1,)) == b"x" * 40  # a is now the most recent
+    cache.put("c", (1,), b"x" * 40)
+    assert cache.get("b", (1,)) is None
+    assert cache.get("a", (1,)) and cache.get("c", (1,))
+    assert cache.size == 82
+    cache.put("big", (1,), b"x" * 101)
+    assert cache.get("big", (1,)) is None
+
+
+@pytest.mark.anyio
+async def test_cache_entries_expire_with_generation_or_age():
+    cache = ResponseCache(maxAge=60)
+    cache.put("a", (1, 5), b"[]")
+    assert cache.get("a", (1, 6)) is None
+    assert cache.size == 0
+    cache.maxAge = 0
+    cache.put("a", (1, 5), b"[]")
+    time.sleep(0.001)
+    assert cache.get("a", (1, 5)) is None
+
+
+def counts():
+    return (
+        metrics.counters["responsecache.views.pet.find.hits"],
+        metrics.counters["responsecache.views.pet.find.misses"],
+    )
+
+
+@pytest.mark.anyio
+async def test_find_is_cached_until_written(client, make_pets):
+    params = {"status": "available", "limit": 50}
+    hits, misses = counts()
+    first = client.get("/api/v3/pets", params=params)
+    second = client.get("/api/v3/pets", params=params)
+    assert first.status_code == second.status_code == 200
+    assert second.content == first.content
+    assert counts() == (hits + 1, misses + 1)
+
+    post_res = client.post(
+        "/api/v3/pets", json={"name": "fresh", "photoUrls": [], "status": "available"}
+    )
+    assert post_res.status_code == 201
+    third = client.get("/api/v3/pets", params=params)
+    assert "fresh" in [pet["name"] for pet in third.json()]
+    assert counts() == (hits + 1, misses + 2)
+
+    # a bulk UPDATE, reserving a pet for an order, also invalidates
+    order = {"petIds": [{"petId": make_pets[1].id, "quantity": 1}]}
+    assert client.post("/api/v3/orders", json=order).status_code == 201
+    fourth = client.get("/api/v3/pets", params=params)
+    assert make_pets[1].id not in [pet["id"] for pet in fourth.json()]
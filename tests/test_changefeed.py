@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import sql
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from lib.changefeed import ChangeFeed
+from lib.jobs import purgeChangeLog
+from lib.metrics import metrics
+from models.entities import Base, ChangeLog, Pet
+from models.repositories import OrderRepo, PetRepo
+
+
+@pytest.fixture
+async def SessionLocal(tmp_path):
+    #  The feed reads from its own sessions, so changes must really be committed
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/changes.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        info={"changeLog": True},
+    )
+    await engine.dispose()
+
+
+async def addPet(SessionLocal, name, status="available"):
+    async with SessionLocal() as session:
+        async with session.begin():
+            pet = Pet(name=name, status=status)
+            session.add(pet)
+        return pet
+
+
+def parse(event):
+    fields = dict(line.split(": ", 1) for line in event.strip().split("\n"))
+    return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+@pytest.mark.anyio
+async def test_writes_are_logged_only_when_committed(SessionLocal):
+    pet = await addPet(SessionLocal, "rex")
+    async with SessionLocal() as session:
+        async with session.begin():
+            await PetRepo.reserve(session, [pet.id])
+            order = await OrderRepo.create(
+                session,
+                {"status": "placed"},
+                petIds=[{"pet_id": pet.id, "quantity": 1}],
+            )
+    async with SessionLocal() as session:
+        await session.begin()
+        session.add(Pet(name="ghost", status="available"))
+        await session.flush()
+        await session.rollback()
+    async with SessionLocal() as session:
+        async with session.begin():
+            order = await OrderRepo.fetchById(session, order.id)
+            await OrderRepo.update(
+                session, {"status": "approved"}, order=order, petIds=[]
+            )
+
+    async with SessionLocal() as session:
+        rows = (await session.execute(sql.select(ChangeLog))).scalars().all()
+    assert [(row.entity, row.entity_id, row.action, row.status) for row in rows] == [
+        ("pet", pet.id, "create", "available"),
+        ("pet", pet.id, "update", "pending"),
+        ("order", order.id, "create", "placed"),
+        ("order", order.id, "update", "approved"),
+    ]
+
+
+@pytest.mark.anyio
+async def test_stream_filters_and_resumes(SessionLocal):
+    first = await addPet(SessionLocal, "first")
+    feed = ChangeFeed(SessionLocal, pollInterval=0.05)
+    await feed.start()
+    try:
+        live = feed.stream(entity="pet", status="sold")
+        assert (await anext(live)).startswith("retry:")
+        nextEvent = asyncio.ensure_future(anext(live))
+        await addPet(SessionLocal, "second")
+        sold = await addPet(SessionLocal, "third", status="sold")
+        id, name, data = parse(await asyncio.wait_for(nextEvent, 1))
+        assert name == "pet.create"
+        assert (data["entityId"], data["status"]) == (sold.id, "sold")
+        await live.aclose()
+
+        #  a client reconnecting after the first event is replayed the others
+        resumed = feed.stream(lastEventId=1)
+        replayed = [parse(await anext(resumed)) for i in range(2)]
+        assert [data["entityId"] for id, name, data in replayed] == [
+            first.id + 1,
+            sold.id,
+        ]
+        assert (await anext(resumed)).startswith("retry:")
+        await resumed.aclose()
+        assert not feed.subscribers
+    finally:
+        await feed.stop()
+
+
+@pytest.mark.anyio
+async def test_event_ids_are_not_reused_after_a_purge(SessionLocal):
+    for name in ("first", "second"):
+        await addPet(SessionLocal, name)
+    feed = ChangeFeed(SessionLocal, pollInterval=0.05)
+    await feed.start()
+    try:
+        live = feed.stream()
+        await anext(live)
+        assert await purgeChangeLog(SessionLocal, retention=-60) == 2
+
+        nextEvent = asyncio.ensure_future(anext(live))
+        third = await addPet(SessionLocal, "third")
+        id, name, data = parse(await asyncio.wait_for(nextEvent, 1))
+        assert id == 3 and data["entityId"] == third.id
+        await live.aclose()
+    finally:
+        await feed.stop()
+
+
+@pytest.mark.anyio
+async def test_slow_subscriber_is_disconnected(SessionLocal):
+    feed = ChangeFeed(SessionLocal, queueSize=2, pollInterval=0.05)
+    await feed.start()
+    try:
+        slow = feed.stream()
+        await anext(slow)
+        dropped = metrics.counters.get("changefeed.dropped", 0)
+        for i in range(3):
+            await addPet(SessionLocal, f"pet{i}")
+        await asyncio.sleep(0.2)
+        assert metrics.counters["changefeed.dropped"] == dropped + 1
+        assert not feed.subscribers
+        with pytest.raises(StopAsyncIteration):
+            await anext(slow)
+    finally:
+        await feed.stop()
+
+
+@pytest.mark.anyio
+async def test_stream_disabled(client):
+    response = client.get("/api/v3/changes")
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Change feed is disabled"
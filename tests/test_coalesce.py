@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from lib.coalesce import SingleFlight
+from lib.metrics import metrics
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test.share")
+    calls = []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1}, 200
+
+    results = await asyncio.gather(*[flight.do("k", query) for _ in range(10)])
+    assert len(calls) == 1
+    assert all(result == ({"id": 1}, 200) for result in results)
+    assert metrics.counters["coalesce.test.share.shared"] == 9
+    assert metrics.gauges["coalesce.test.share.ratio"] == 0.9
+
+    # a later call runs again
+    await flight.do("k", query)
+    assert len(calls) == 2
+
+
+@pytest.mark.anyio
+async def test_errors_are_shared():
+    flight = SingleFlight("test.error")
+
+    async def query():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        *[flight.do("k", query) for _ in range(3)], return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.flights == {}
+
+
+@pytest.mark.anyio
+async def test_cancelled_when_all_waiters_leave():
+    flight = SingleFlight("test.cancel")
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def query():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiters = [asyncio.ensure_future(flight.do("k", query)) for _ in range(2)]
+    await started.wait()
+
+    waiters[0].cancel()
+    await asyncio.sleep(0)
+    assert not cancelled.is_set()
+
+    waiters[1].cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert flight.flights == {}
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint(client, make_pets):
+    client.get(f"/api/v3/pets/{make_pets[0].id}")
+    get_res = client.get("/api/v3/metrics")
+    assert get_res.status_code == 200
+    assert get_res.json()["counters"]["coalesce.views.pet.get.calls"] >= 1
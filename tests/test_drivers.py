@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from lib.drivers import createEngine
+from models.entities import Base, Pet
+from models.repositories import PetRepo
+
+
+async def makeSessionLocal(url):
+    engine = createEngine(url, "threadpool", poolSize=4)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+@pytest.mark.anyio
+async def test_threadpool_driver_commits_and_rolls_back(tmp_path):
+    engine, SessionLocal = await makeSessionLocal(
+        f"sqlite+aiosqlite:///{tmp_path}/pets.db"
+    )
+    async with SessionLocal() as session:
+        pets = [Pet(name=f"pet{i}") for i in range(3)]
+        session.add_all(pets)
+        await session.commit()
+    ids = [pet.id for pet in pets]
+
+    #  RETURNING rows come back with the UPDATE
+    async with SessionLocal() as session:
+        assert await PetRepo.reserve(session, ids[:2]) == ids[:2]
+        await session.rollback()
+    async with SessionLocal() as session:
+        assert [pet.status for pet in await PetRepo.fetchByIds(session, ids)] == [
+            "available"
+        ] * 3
+
+    async with SessionLocal() as session:
+        session.add(Pet(id=ids[0], name="duplicate"))
+        with pytest.raises(IntegrityError):
+            await session.commit()
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_threadpool_driver_runs_sessions_concurrently(tmp_path):
+    engine, SessionLocal = await makeSessionLocal(
+        f"sqlite+aiosqlite:///{tmp_path}/pets.db"
+    )
+
+    async def add(i):
+        async with SessionLocal() as session:
+            await PetRepo.create(session, {"name": f"pet{i}"})
+            await session.commit()
+
+    async def count():
+        async with SessionLocal() as session:
+            return len(await PetRepo.fetchAllRows(session, limit=100))
+
+    await asyncio.gather(*[add(i) for i in range(20)])
+    counts = await asyncio.gather(*[count() for _ in range(10)])
+    assert counts == [20] * 10
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_threadpool_driver_fetches_and_shuts_down(tmp_path):
+    engine, SessionLocal = await makeSessionLocal(
+        f"sqlite+aiosqlite:///{tmp_path}/pets.db"
+    )
+    async with engine.connect() as conn:
+        cursor = (await conn.get_raw_connection()).driver_connection.cursor()
+        await cursor.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL "
+            "SELECT i + 1 FROM n WHERE i < 5) SELECT i FROM n"
+        )
+        assert await cursor.fetchone() == (1,)
+        assert await cursor.fetchmany(2) == [(2,), (3,)]
+        assert await cursor.fetchall() == [(4,), (5,)]
+        assert await cursor.fetchone() is None
+        await cursor.close()
+
+    executor = engine.threads.executor
+    await engine.dispose()
+    assert executor._shutdown
+    #  an engine used again after dispose() gets new threads
+    async with SessionLocal() as session:
+        assert await PetRepo.fetchAllRows(session) == []
+    assert engine.threads.executor is not executor
+    await engine.dispose()
@@ -0,0 +1,89 @@
+import datetime
+
+import pytest
+
+from auth.utils import testToken
+from models.repositories import IdempotencyRepo
+
+
+@pytest.mark.anyio
+async def test_add_order_retry_returns_stored_response(client, make_pets):
+    data = {"petIds": [{"quantity": 2, "petId": make_pets[1].id}]}
+    headers = {"Idempotency-Key": "order-retry-1"}
+    post_res = client.post("/api/v3/orders", json=data, headers=headers)
+    assert post_res.status_code == 201
+    assert "Idempotent-Replayed" not in post_res.headers
+    count = len(client.get("/api/v3/orders/", params={"limit": 100}).json())
+
+    retry_res = client.post("/api/v3/orders", json=data, headers=headers)
+    assert retry_res.status_code == 201
+    assert retry_res.headers["Idempotent-Replayed"] == "true"
+    assert retry_res.json() == post_res.json()
+    assert len(client.get("/api/v3/orders/", params={"limit": 100}).json()) == count
+
+
+@pytest.mark.anyio
+async def test_add_pet_key_reused_with_other_body(client):
+    headers = {"Idempotency-Key": "pet-reuse-1"}
+    post_res = client.post("/api/v3/pets", json={"name": "doggie"}, headers=headers)
+    assert post_res.status_code == 201
+
+    post_res = client.post("/api/v3/pets", json={"name": "kitty"}, headers=headers)
+    assert post_res.status_code == 422
+    assert "different request body" in post_res.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_add_without_key_is_not_stored(client):
+    data = {"name": "doggie"}
+    first = client.post("/api/v3/pets", json=data)
+    second = client.post("/api/v3/pets", json=data)
+    assert first.status_code == second.status_code == 201
+    assert first.json()["id"] != second.json()["id"]
+
+
+@pytest.mark.anyio
+async def test_add_pet_keys_are_per_caller(client, monkeypatch):
+    headers = {"Idempotency-Key": "pet-caller-1"}
+    first = client.post("/api/v3/pets", json={"name": "doggie"}, headers=headers)
+    assert first.status_code == 201
+
+    monkeypatch.setattr("auth.utils.testToken", {"sub": "other", "scopes": []})
+    second = client.post("/api/v3/pets", json={"name": "kitty"}, headers=headers)
+    assert second.status_code == 201
+    assert "Idempotent-Replayed" not in second.headers
+    assert second.json()["id"] != first.json()["id"]
+
+
+@pytest.mark.anyio
+async def test_add_pet_key_claimed_by_another_worker(client, db_session):
+    #  a claim still in flight elsewhere: the row of a stored response, reset
+    key = f"{testToken['sub']}:pet-claim-1"
+    headers = {"Idempotency-Key": "pet-claim-1"}
+    data = {"name": "doggie"}
+    first = client.post("/api/v3/pets", json=data, headers=headers)
+    assert first.status_code == 201
+    now = datetime.datetime.now(datetime.timezone.utc)
+    record = await IdempotencyRepo.fetchByKey(db_session, key)
+    record.status_code = record.response = None
+    record.expires_at = now + datetime.timedelta(seconds=30)
+    await db_session.flush()
+    post_res = client.post("/api/v3/pets", json=data, headers=headers)
+    assert post_res.status_code == 409
+    assert post_res.headers["Retry-After"] == "1"
+
+    #  once its lease runs out a retry takes the key over and runs the view
+    lease = now - datetime.timedelta(seconds=1)
+    record.expires_at = lease
+    await db_session.flush()
+    post_res = client.post("/api/v3/pets", json=data, headers=headers)
+    assert post_res.status_code == 201
+    assert post_res.json()["id"] != first.json()["id"]
+
+    #  and the worker that lost its lease, finishing late, leaves the response alone
+    assert not await IdempotencyRepo.complete(
+        db_session, key, lease, 500, "{}", now + datetime.timedelta(days=1)
+    )
+    retry_res = client.post("/api/v3/pets", json=data, headers=headers)
+    assert retry_res.headers["Idempotent-Replayed"] == "true"
+    assert retry_res.json() == post_res.json()
@@ -0,0 +1,82 @@
+import tracemalloc
+
+import pytest
+
+from app import create_app
+
+from .conftest import TEST_CONFIG, init_db
+
+
+@pytest.fixture(scope="module")
+async def app():
+    app = create_app({**TEST_CONFIG, "MEMORY_DIAGNOSTICS": True})
+    async with app.middleware.options.SessionLocal() as session:
+        await init_db(session.bind)
+        await session.close()
+    yield app
+
+
+@pytest.mark.anyio
+async def test_snapshots_and_diffs(admin_client):
+    assert admin_client.post("/api/v3/diagnostics/memory/snapshots").status_code == 409
+    res = admin_client.put("/api/v3/diagnostics/memory/tracing", json={"enabled": True})
+    assert res.json()["tracing"]
+    try:
+        first = admin_client.post("/api/v3/diagnostics/memory/snapshots").json()["id"]
+        for index in range(20):
+            admin_client.post("/api/v3/pets", json={"name": f"pet{index}"})
+        second = admin_client.post("/api/v3/diagnostics/memory/snapshots").json()["id"]
+
+        res = admin_client.get(f"/api/v3/diagnostics/memory/snapshots/{second}")
+        assert res.status_code == 200
+        top = res.json()
+        assert top and top[0]["sizeBytes"] >= top[-1]["sizeBytes"]
+        res = admin_client.get(
+            f"/api/v3/diagnostics/memory/snapshots/{second}",
+            params={"base": first, "limit": 5},
+        )
+        assert len(res.json()) == 5
+        assert "sizeDiffBytes" in res.json()[0]
+        res = admin_client.get("/api/v3/diagnostics/memory/snapshots/999")
+        assert res.status_code == 404
+    finally:
+        res = admin_client.put(
+            "/api/v3/diagnostics/memory/tracing", json={"enabled": False}
+        )
+    assert not res.json()["tracing"] and not tracemalloc.is_tracing()
+    assert [snapshot["id"] for snapshot in res.json()["snapshots"]] == [first, second]
+
+
+@pytest.mark.anyio
+async def test_gc_stats_and_object_counts(admin_client, make_pets):
+    res = admin_client.get("/api/v3/diagnostics/memory")
+    assert res.status_code == 200
+    assert len(res.json()["gc"]["generations"]) == 3
+    assert res.json()["objects"]["Pet"] >= len(make_pets)
+
+
+@pytest.mark.anyio
+async def test_disabled_by_default():
+    with create_app(TEST_CONFIG).test_client() as client:
+        res = client.get(
+            "/api/v3/diagnostics/memory",
+            headers={"Authorization": "Bearer TestAdminJWTtoken"},
+        )
+    assert res.status_code == 404
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.anyio
+async def test_admin_scope_is_required(client):
+    assert client.get("/api/v3/diagnostics/memory").status_code == 403
+    res = client.put("/api/v3/diagnostics/memory/tracing", json={"enabled": True})
+    assert res.status_code == 403
+    assert res.json()["detail"] == "The admin:diagnostics scope is required"
+    assert not tracemalloc.is_tracing()
+    assert client.post("/api/v3/diagnostics/memory/snapshots").status_code == 403
+    assert client.get("/api/v3/diagnostics/memory/snapshots/1").status_code == 403
+
+    #  nor do API keys reach them
+    del client.headers["Authorization"]
+    res = client.get("/api/v3/diagnostics/memory", headers={"x-apiKey": "key"})
+    assert res.status_code == 401
@@ -1,16 +1,40 @@
 import datetime
 import pytest
+from sqlalchemy import event
+
+from models.entities import Order
+from models.repositories import ArchiveRepo, OrderRepo
+from schemas.schemas import OrderPetSchema
 
 
 @pytest.mark.anyio
 async def test_add_order(client, make_pets):
-    petIds = [{"quantity": 4, "petId": make_pets[0].id}]
+    petIds = [{"quantity": 4, "petId": make_pets[1].id}]
     data = {"petIds": petIds}
     post_res = client.post("/api/v3/orders", json=data)
     assert post_res.status_code == 201
     assert post_res.json()["status"] == "placed"
     assert post_res.json()["petIds"][0]["quantity"] == 4
-    assert post_res.json()["petIds"][0]["petId"] == make_pets[0].id
+    assert post_res.json()["petIds"][0]["petId"] == make_pets[1].id
+
+
+@pytest.mark.anyio
+async def test_add_order_reserves_pets(client, make_pets):
+    data = {"petIds": [{"quantity": 1, "petId": make_pets[1].id}]}
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 201
+    get_res = client.get(f"/api/v3/pets/{make_pets[1].id}")
+    assert get_res.json()["status"] == "pending"
+
+    # already reserved by the first order
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 409
+    assert str(make_pets[1].id) in post_res.json()["detail"]
+
+    # sold pets cannot be ordered either
+    data = {"petIds": [{"quantity": 1, "petId": make_pets[0].id}]}
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 409
 
 
 @pytest.mark.anyio
@@ -85,6 +109,105 @@ async def test_update_order_pets(client, make_pets, make_orders):
     assert get_res.json()["petIds"][0]["quantity"] == data["petIds"][0]["quantity"]
 
 
+@pytest.mark.anyio
+async def test_update_order_pets_keeps_unchanged_lines(client, make_pets, make_orders):
+    order_id = make_orders[0].id
+    petIds = [
+        {"petId": make_pets[0].id, "quantity": 1},
+        {"petId": make_pets[1].id, "quantity": 2},
+    ]
+    put_res = client.put(f"/api/v3/orders/{order_id}", json={"petIds": petIds})
+    assert put_res.status_code == 200
+    before = client.get(f"/api/v3/orders/{order_id}").json()["petIds"]
+
+    petIds[1]["quantity"] = 7
+    put_res = client.put(f"/api/v3/orders/{order_id}", json={"petIds": petIds})
+    assert put_res.status_code == 200
+    assert put_res.json()["petIds"] == [
+        {"petId": make_pets[0].id, "quantity": 1},
+        {"petId": make_pets[1].id, "quantity": 7},
+    ]
+    assert client.get(f"/api/v3/orders/{order_id}").json()["petIds"] == put_res.json()[
+        "petIds"
+    ]
+    assert before[0] == put_res.json()["petIds"][0]
+
+
+@pytest.mark.anyio
+async def test_patch_order_pets(client, make_pets, make_orders):
+    order_id = make_orders[0].id
+    data = {"petIds": [{"petId": make_pets[2].id, "quantity": 3}]}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert patch_res.status_code == 200
+    assert patch_res.json()["petIds"] == [
+        {"petId": make_pets[0].id, "quantity": 1},
+        {"petId": make_pets[2].id, "quantity": 3},
+    ]
+
+    data = {"removePetIds": [make_pets[0].id], "status": "approved"}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert patch_res.status_code == 200
+    assert patch_res.json()["status"] == "approved"
+    assert patch_res.json()["petIds"] == [{"petId": make_pets[2].id, "quantity": 3}]
+
+    # Confirm
+    get_res = client.get(f"/api/v3/orders/{order_id}")
+    assert get_res.json()["petIds"] == [{"petId": make_pets[2].id, "quantity": 3}]
+
+    data = {"petIds": [{"petId": 0, "quantity": 1}]}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert patch_res.status_code == 400
+    assert "Invalid petId" in patch_res.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_update_order_reserves_and_releases_pets(client, make_pets, make_orders):
+    order_id = make_orders[1].id
+    petStatus = lambda pet: client.get(f"/api/v3/pets/{pet.id}").json()["status"]
+    data = {"petIds": [{"petId": make_pets[2].id, "quantity": 1}]}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert patch_res.status_code == 200
+    assert petStatus(make_pets[2]) == "pending"
+
+    #  a pet another order holds cannot be added, and nothing else is changed
+    data = {"petIds": [{"petId": make_pets[2].id, "quantity": 1}], "status": "approved"}
+    patch_res = client.patch(f"/api/v3/orders/{make_orders[0].id}", json=data)
+    assert patch_res.status_code == 409
+    assert str(make_pets[2].id) in patch_res.json()["detail"]
+    get_res = client.get(f"/api/v3/orders/{make_orders[0].id}")
+    assert get_res.json()["status"] == "placed"
+    assert get_res.json()["petIds"] == [{"petId": make_pets[0].id, "quantity": 1}]
+
+    #  pets dropped by PUT or removed by PATCH are given back
+    data = {"petIds": [{"petId": make_pets[1].id, "quantity": 2}]}
+    put_res = client.put(f"/api/v3/orders/{order_id}", json=data)
+    assert put_res.status_code == 200
+    assert petStatus(make_pets[2]) == "available"
+
+    data = {"petIds": [{"petId": make_pets[2].id, "quantity": 1}]}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert petStatus(make_pets[2]) == "pending"
+    data = {"removePetIds": [make_pets[2].id]}
+    patch_res = client.patch(f"/api/v3/orders/{order_id}", json=data)
+    assert patch_res.status_code == 200
+    assert petStatus(make_pets[2]) == "available"
+
+
+@pytest.mark.anyio
+async def test_update_order_without_pet_ids_keeps_lines(client, make_pets, make_orders):
+    order_id = make_orders[0].id
+    lines = [{"petId": make_pets[0].id, "quantity": 1}]
+    data = {"removePetIds": [make_pets[0].id]}
+    put_res = client.put(f"/api/v3/orders/{order_id}", json=data)
+    assert put_res.status_code == 400
+    assert "removePetIds" in put_res.json()["detail"]
+    assert client.get(f"/api/v3/orders/{order_id}").json()["petIds"] == lines
+
+    put_res = client.put(f"/api/v3/orders/{order_id}", json={"status": "approved"})
+    assert put_res.status_code == 200
+    assert put_res.json()["petIds"] == lines
+
+
 @pytest.mark.anyio
 async def test_update_order_validations(client, make_orders):
     order_id = make_orders[0].id
@@ -117,6 +240,21 @@ async def test_get_orders(client, make_orders):
     assert "is greater than the maximum of" in get_res.json()["detail"]
 
 
+@pytest.mark.anyio
+async def test_get_orders_limit_counts_orders(client, make_pets, make_orders):
+    order_id = make_orders[0].id
+    petIds = [{"petId": pet.id, "quantity": 1} for pet in make_pets]
+    put_res = client.put(f"/api/v3/orders/{order_id}", json={"petIds": petIds})
+    assert put_res.status_code == 200
+
+    params = {"limit": 2, "includePets": "yes"}
+    get_res = client.get("/api/v3/orders/", params=params)
+    assert get_res.status_code == 200
+    assert len(get_res.json()) == 2
+    assert len(get_res.json()[0]["petIds"]) == len(make_pets)
+    assert len(get_res.json()[0]["pets"]) == len(make_pets)
+
+
 @pytest.mark.anyio
 async def test_get_orders_by_petid(client, make_pets, make_orders):
     params = {"petId": make_pets[0].id}
@@ -144,6 +282,62 @@ async def test_get_orders_with_pets(client, make_pets, make_orders):
     assert get_res.json()[0]["pets"][0]["name"] == make_pets[0].name
 
 
+@pytest.mark.anyio
+async def test_batch_get_orders(client, make_pets, make_orders):
+    ids = [make_orders[1].id, 0, make_orders[0].id]
+    post_res = client.post("/api/v3/orders:batchGet", json={"ids": ids})
+    assert post_res.status_code == 200
+    orders = post_res.json()["orders"]
+    assert [order["id"] for order in orders] == [make_orders[1].id, make_orders[0].id]
+    assert orders[1]["petIds"][0]["petId"] == make_pets[0].id
+    assert "pets" not in orders[0]
+    assert post_res.json()["missing"] == [0]
+
+    params = {"includePets": "yes"}
+    post_res = client.post(
+        "/api/v3/orders:batchGet", json={"ids": ids}, params=params
+    )
+    assert post_res.status_code == 200
+    orders = post_res.json()["orders"]
+    assert orders[0]["pets"][0]["id"] == make_pets[1].id
+    assert orders[1]["pets"][0]["id"] == make_pets[0].id
+
+
+@pytest.mark.anyio
+async def test_get_orders_fields(client, make_pets, make_orders):
+    params = {"fields": "id,status"}
+    get_res = client.get("/api/v3/orders/", params=params)
+    assert get_res.status_code == 200
+    assert set(get_res.json()[0]) == {"id", "status"}
+
+    order_id = make_orders[0].id
+    params = {"fields": "shipDate,petIds"}
+    get_res = client.get(f"/api/v3/orders/{order_id}", params=params)
+    assert get_res.status_code == 200
+    assert set(get_res.json()) == {"shipDate", "petIds"}
+    assert get_res.json()["petIds"][0]["petId"] == make_pets[0].id
+
+    params = {"fields": "id,pets", "includePets": "yes"}
+    get_res = client.get("/api/v3/orders/", params=params)
+    assert get_res.status_code == 200
+    assert set(get_res.json()[0]) == {"id", "pets"}
+    assert get_res.json()[0]["pets"][0]["id"] == make_pets[0].id
+
+    params = {"fields": "id,pets"}
+    get_res = client.get("/api/v3/orders/", params=params)
+    assert get_res.status_code == 400
+    assert "Unknown field: pets" in str(get_res.json()["detail"])
+
+
+@pytest.mark.anyio
+async def test_order_rows_dump_like_entities(db_session, make_pets, make_orders):
+    for fields in (None, ("id", "petIds"), ("status", "pets")):
+        schema = OrderPetSchema(many=True, fields=fields)
+        rows = await OrderRepo.fetchAllRows(db_session, includePets=True, fields=fields)
+        orders = await OrderRepo.fetchAll(db_session, includePets=True, fields=fields)
+        assert schema.dump(rows) == schema.dump(orders)
+
+
 @pytest.mark.anyio
 async def test_get_orders_by_status(client, make_orders):
     params = {"status": make_orders[0].status}
@@ -158,6 +352,148 @@ async def test_get_orders_by_status(client, make_orders):
     assert "'approvedxx' is not one of" in str(get_res.json()["detail"])
 
 
+@pytest.mark.anyio
+async def test_get_orders_by_ship_date(client, db_session):
+    for day, status in (
+        (1, "placed"),
+        (10, "placed"),
+        (10, "approved"),
+        (20, "placed"),
+        (5, "placed"),
+    ):
+        shipDate = datetime.datetime(2030, 1, day, 18, tzinfo=datetime.timezone.utc)
+        db_session.add(Order(status=status, ship_date=shipDate))
+    await db_session.flush()
+
+    params = {
+        "status": "placed",
+        "shipDateFrom": "2030-01-01",
+        "shipDateTo": "2030-01-10",
+    }
+    get_res = client.get("/api/v3/orders", params=params)
+    assert get_res.status_code == 200
+    #  in ship date order, not id order
+    assert [order["shipDate"] for order in get_res.json()] == [
+        "2030-01-01",
+        "2030-01-05",
+        "2030-01-10",
+    ]
+    get_res = client.get("/api/v3/orders", params={"shipDateFrom": "2030-01-10"})
+    assert len(get_res.json()) == 3
+
+    params = {"shipDateFrom": "2030-01-10", "shipDateTo": "2030-01-01"}
+    assert client.get("/api/v3/orders", params=params).status_code == 400
+
+    #  and walked in that order, a page after another, by bulk transitions
+    walked, after = [], 0
+    while ids := await OrderRepo.fetchIds(
+        db_session,
+        {"status": "placed"},
+        after=after,
+        limit=1,
+        shipDateFrom=datetime.date(2030, 1, 1),
+    ):
+        walked.append(ids[0])
+        after = ids[0]
+    assert [(await db_session.get(Order, id)).ship_date.day for id in walked] == [
+        1,
+        5,
+        10,
+        20,
+    ]
+
+
+@pytest.mark.anyio
+async def test_ship_date_ranges_seek_the_index(db_session):
+    #  the plans of the statements the repositories run, with their parameters
+    shipDates = {
+        "conditions": {"status": "placed"},
+        "shipDateFrom": datetime.date(2030, 1, 1),
+        "shipDateTo": datetime.date(2030, 1, 31),
+    }
+    for fetch, index in (
+        (
+            lambda: OrderRepo.fetchAllRows(
+                db_session, fields=("status", "shipDate"), **shipDates
+            ),
+            "idx_order_status_ship_date",
+        ),
+        (
+            lambda: OrderRepo.fetchIds(db_session, after=1, **shipDates),
+            "idx_order_status_ship_date",
+        ),
+        (
+            lambda: ArchiveRepo.fetchAll(db_session, fields=("status",), **shipDates),
+            "idx_order_archive_status_ship_date",
+        ),
+    ):
+        details = await _queryPlan(db_session, fetch)
+        assert not any("TEMP B-TREE" in detail for detail in details), details
+        assert any(
+            f"INDEX {index} (status=? AND ship_date>? AND ship_date<?)" in detail
+            for detail in details
+        ), details
+
+
+async def _queryPlan(db_session, fetch):
+    #  EXPLAIN QUERY PLAN of the first SELECT fetch() runs
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        await fetch()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    statement, parameters = next(
+        (statement, parameters)
+        for statement, parameters in statements
+        if statement.startswith("SELECT")
+    )
+    connection = await db_session.connection()
+    plan = await connection.exec_driver_sql(
+        f"EXPLAIN QUERY PLAN {statement}", parameters
+    )
+    return [row[-1] for row in plan]
+
+
+@pytest.mark.anyio
+async def test_transition_orders(client, db_session):
+    shipDate = datetime.datetime(2031, 5, 1, 12, tzinfo=datetime.timezone.utc)
+    orders = [
+        Order(status=status, ship_date=shipDate)
+        for status in ("placed", "approved", "delivered", "placed")
+    ]
+    db_session.add_all(orders)
+    await db_session.flush()
+    placed, approved, delivered, other = [order.id for order in orders]
+
+    body = {"status": "approved", "ids": [placed, approved, delivered]}
+    post_res = client.post("/api/v3/orders:transition", json=body)
+    assert post_res.status_code == 200
+    assert post_res.json() == {
+        "updated": [placed],
+        "unchanged": [approved],
+        "invalid": [{"id": delivered, "status": "delivered"}],
+        "missing": [],
+    }
+
+    body = {
+        "status": "delivered",
+        "filter": {"status": "approved", "shipDateFrom": "2031-05-01"},
+    }
+    post_res = client.post("/api/v3/orders:transition", json=body)
+    assert post_res.json()["updated"] == [placed, approved]
+    get_res = client.get(f"/api/v3/orders/{other}")
+    assert get_res.json()["status"] == "placed"
+
+    body = {"status": "delivered", "filter": {"shipDateFrom": "May 1st"}}
+    assert client.post("/api/v3/orders:transition", json=body).status_code == 400
+
+
 @pytest.mark.anyio
 async def test_delete_order(client, make_orders):
     order_id = make_orders[0].id
@@ -1,4 +1,10 @@
+from contextlib import asynccontextmanager
+
 import pytest
+from sqlalchemy import inspect
+
+from lib.transitions import transition
+from models.repositories import PetRepo
 
 
 @pytest.mark.anyio
@@ -105,3 +111,92 @@ async def test_delete_pet(client, make_pets):
     # verify deleted
     check = client.get(f"/api/v3/pets/{pet_id}")
     assert check.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_batch_get_pets(client, make_pets):
+    ids = [make_pets[2].id, 0, make_pets[0].id]
+    post_res = client.post("/api/v3/pets:batchGet", json={"ids": ids})
+    assert post_res.status_code == 200
+    assert [pet["id"] for pet in post_res.json()["pets"]] == [
+        make_pets[2].id,
+        make_pets[0].id,
+    ]
+    assert post_res.json()["missing"] == [0]
+
+    post_res = client.post("/api/v3/pets:batchGet", json={"ids": []})
+    assert post_res.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_transition_pets(client, db_session, make_pets):
+    whiskers, zebra, bark = make_pets[1].id, make_pets[2].id, make_pets[0].id
+    body = {"status": "pending", "ids": [whiskers, bark, zebra, 0, whiskers]}
+    post_res = client.post("/api/v3/pets:transition", json=body)
+    assert post_res.status_code == 200
+    assert post_res.json() == {
+        "updated": sorted([whiskers, zebra]),
+        "unchanged": [],
+        "invalid": [{"id": bark, "status": "sold"}],
+        "missing": [0],
+    }
+    assert client.get(f"/api/v3/pets/{zebra}").json()["status"] == "pending"
+
+    #  a filter is walked in chunks, each its own transaction
+    sessions = []
+
+    @asynccontextmanager
+    async def openSession():
+        sessions.append(db_session)
+        yield db_session
+
+    summary = await transition(
+        PetRepo, openSession, "available", conditions={"status": "pending"}, chunkSize=1
+    )
+    assert {whiskers, zebra} <= set(summary["updated"])
+    assert len(sessions) == len(summary["updated"]) + 1
+
+    body = {"status": "sold", "ids": [zebra], "filter": {"status": "available"}}
+    assert client.post("/api/v3/pets:transition", json=body).status_code == 400
+
+
+@pytest.mark.anyio
+async def test_transition_keeps_ordered_pets_pending(client, make_pets):
+    zebra = make_pets[2].id
+    data = {"petIds": [{"petId": zebra, "quantity": 1}]}
+    order_id = client.post("/api/v3/orders", json=data).json()["id"]
+
+    body = {"status": "available", "ids": [zebra]}
+    post_res = client.post("/api/v3/pets:transition", json=body)
+    assert post_res.json()["invalid"] == [{"id": zebra, "status": "pending"}]
+    body = {"status": "available", "filter": {"status": "pending"}}
+    post_res = client.post("/api/v3/pets:transition", json=body)
+    assert zebra not in post_res.json()["updated"]
+    assert client.get(f"/api/v3/pets/{zebra}").json()["status"] == "pending"
+
+    #  once the order is delivered its pets are no longer held
+    body = {"status": "delivered", "ids": [order_id]}
+    client.post("/api/v3/orders:transition", json=body)
+    body = {"status": "available", "ids": [zebra]}
+    post_res = client.post("/api/v3/pets:transition", json=body)
+    assert post_res.json()["updated"] == [zebra]
+
+
+@pytest.mark.anyio
+async def test_get_pets_fields(client, db_session, make_pets):
+    params = {"fields": "id,name,status"}
+    get_res = client.get("/api/v3/pets/", params=params)
+    assert get_res.status_code == 200
+    assert set(get_res.json()[0]) == {"id", "name", "status"}
+
+    get_res = client.get(f"/api/v3/pets/{make_pets[0].id}", params={"fields": "name"})
+    assert get_res.status_code == 200
+    assert get_res.json() == {"name": make_pets[0].name}
+
+    # description is never selected from the database
+    pets = await PetRepo.fetchAll(db_session, fields=("id", "name"))
+    assert "description" in inspect(pets[0]).unloaded
+
+    get_res = client.get("/api/v3/pets/", params={"fields": "id,owner"})
+    assert get_res.status_code == 400
+    assert "Unknown field: owner" in str(get_res.json()["detail"])
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import pstats
+
+import pytest
+
+from lib.profiling import ProfilingMiddleware
+
+
+def busy():
+    return sum(i * i for i in range(300_000))
+
+
+async def handler(scope, receive, send):
+    for _ in range(5):
+        busy()
+        await asyncio.sleep(0.002)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def call(middleware, headers=()):
+    scope = {"type": "http", "method": "GET", "path": "/api/v3/orders", "headers": []}
+    scope["headers"] = list(headers)
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return dict(sent[0]["headers"])
+
+
+@pytest.mark.anyio
+async def test_profiles_requests_with_the_token(tmp_path):
+    profiling = ProfilingMiddleware(handler, str(tmp_path), token="secret")
+    assert b"x-profile-id" not in await call(profiling)
+    assert b"x-profile-id" not in await call(profiling, [(b"x-profile", b"wrong")])
+
+    headers = await call(profiling, [(b"x-profile", b"secret")])
+    profileId = headers[b"x-profile-id"].decode()
+    stats = pstats.Stats(str(tmp_path / f"{profileId}.pstats"))
+    assert any(function == "busy" for _, _, function in stats.stats)
+
+
+@pytest.mark.anyio
+async def test_sampled_profiles_are_collapsed_stacks(tmp_path):
+    profiling = ProfilingMiddleware(
+        handler, str(tmp_path), sampleRate=1.0, mode="sampling", maxFiles=2
+    )
+    for _ in range(3):
+        headers = await call(profiling)
+    assert len(os.listdir(tmp_path)) == 2
+    profileId = headers[b"x-profile-id"].decode()
+    lines = (tmp_path / f"{profileId}.collapsed").read_text().splitlines()
+    assert any("tests.test_profiling:busy" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
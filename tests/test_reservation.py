@@ -0,0 +1,104 @@
+import asyncio
+import random
+
+import pytest
+from sqlalchemy import sql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from lib.batching import WriteBatcher
+from models.entities import Base, OrderPet, Pet
+from schemas.schemas import OrderSchema
+from tests.conftest import mock_get_db_session
+
+PETS = 5
+ORDERS = 40
+
+
+@pytest.fixture(scope="function")
+async def SessionLocal(tmp_path):
+    #  A database file of its own, so concurrent orders use separate connections
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'reserve.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    async with SessionLocal() as session:
+        session.add_all([Pet(name=f"pet{i}") for i in range(PETS)])
+        await session.commit()
+    yield SessionLocal
+    await engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def orderViews(monkeypatch):
+    #  views bind app.get_session when first imported, so import them while it is
+    #    mocked, as the client tests do
+    monkeypatch.setattr("app.get_session", mock_get_db_session)
+    import views.order
+
+    return views.order
+
+
+def orders():
+    random.seed(7)
+    for _ in range(ORDERS):
+        ids = random.sample(range(1, PETS + 1), 2)
+        yield OrderSchema().load(
+            {"petIds": [{"petId": id, "quantity": 1} for id in ids]}
+        )
+
+
+async def check(SessionLocal, placed):
+    async with SessionLocal() as session:
+        result = await session.execute(sql.select(OrderPet.pet_id))
+        ordered = result.scalars().all()
+        result = await session.execute(
+            sql.select(Pet.id).where(Pet.status == "pending")
+        )
+        pending = set(result.scalars().all())
+    # no pet is in two orders, and exactly the ordered pets are reserved
+    assert len(ordered) == len(set(ordered)) == 2 * placed
+    assert pending == set(ordered)
+
+
+@pytest.mark.anyio
+async def test_parallel_orders_never_share_a_pet(SessionLocal, orderViews):
+    async def place(data):
+        try:
+            async with SessionLocal() as session:
+                async with session.begin():
+                    await orderViews._create(session, OrderSchema(), data)
+            return True
+        except (orderViews.OrderRejected, OperationalError):
+            return False
+
+    results = await asyncio.gather(*[place(data) for data in orders()])
+    assert 1 <= sum(results) <= PETS // 2
+    await check(SessionLocal, sum(results))
+
+
+@pytest.mark.anyio
+async def test_batched_orders_never_share_a_pet(SessionLocal, orderViews):
+    batcher = WriteBatcher(SessionLocal, batchSize=10, maxWait=0.01)
+    await batcher.start()
+    results = await asyncio.gather(
+        *[
+            batcher.submit(
+                lambda session, data=data: orderViews._create(
+                    session, OrderSchema(), data
+                )
+            )
+            for data in orders()
+        ],
+        return_exceptions=True,
+    )
+    await batcher.stop()
+    placed = [result for result in results if not isinstance(result, Exception)]
+    rejected = [
+        result for result in results if isinstance(result, orderViews.OrderRejected)
+    ]
+    assert len(placed) + len(rejected) == ORDERS
+    assert all(err.response[1] == 409 for err in rejected)
+    await check(SessionLocal, len(placed))
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+from sqlalchemy import sql
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from lib.jobs import purgeIdempotencyKeys, scheduleJobs
+from lib.metrics import metrics
+from lib.scheduler import Scheduler
+from models.entities import Base, IdempotencyKey
+
+
+@pytest.mark.anyio
+async def test_periodic_and_one_off_jobs():
+    scheduler = Scheduler()
+    runs = []
+
+    async def tick():
+        runs.append("tick")
+
+    def blocking():
+        runs.append(threading.current_thread().name)
+
+    scheduler.every("tick", 0.01, tick)
+    scheduler.once("blocking", blocking, delay=0.01)
+    await scheduler.start()
+    await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    assert runs.count("tick") >= 3
+    threads = [run for run in runs if run != "tick"]
+    assert len(threads) == 1 and threads[0].startswith("scheduler")
+    assert "blocking" not in scheduler.jobs
+    assert metrics.timings["scheduler.tick"]["count"] == runs.count("tick")
+
+
+@pytest.mark.anyio
+async def test_failures_and_concurrency_are_bounded():
+    scheduler = Scheduler(maxConcurrency=2)
+    running = []
+    peak = []
+
+    async def slow():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+
+    async def broken():
+        raise ValueError("boom")
+
+    for i in range(5):
+        scheduler.once(f"slow{i}", slow)
+    scheduler.once("broken", broken)
+    await scheduler.start()
+    await asyncio.sleep(0.15)
+    await scheduler.stop()
+
+    assert len(peak) == 5 and max(peak) <= 2
+    assert metrics.counters["scheduler.broken.failures"] == 1
+
+
+@pytest.mark.anyio
+async def test_purge_idempotency_keys():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with SessionLocal() as session:
+        for key, days in (("old", -1), ("new", 1)):
+            expires = now + datetime.timedelta(days=days)
+            session.add(IdempotencyKey(key=key, fingerprint="x", expires_at=expires))
+        await session.commit()
+
+    assert await purgeIdempotencyKeys(SessionLocal) == 1
+    async with SessionLocal() as session:
+        result = await session.execute(sql.select(IdempotencyKey.key))
+        assert result.scalars().all() == ["new"]
+    await engine.dispose()
+
+
+def test_purge_intervals_are_configured_separately():
+    scheduler = Scheduler()
+    config = {
+        "IDEMPOTENCY_PURGE_INTERVAL": 60,
+        "CHANGE_FEED_ENABLED": True,
+        "CHANGE_LOG_PURGE_INTERVAL": 300,
+    }
+    scheduleJobs(scheduler, None, config)
+    assert scheduler.jobs["purge_idempotency_keys"].interval == 60
+    assert scheduler.jobs["purge_change_log"].interval == 300
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from lib.seed import seed
+from models.entities import Base, Order, OrderPet, Pet
+
+
+async def seeded(**kwargs):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    counts = await seed(engine, pets=500, orders=200, batchSize=64, **kwargs)
+    async with engine.connect() as conn:
+        rows = {
+            entity: (await conn.execute(select(entity).order_by(entity.id))).all()
+            for entity in (Pet, Order, OrderPet)
+        }
+    return engine, counts, rows
+
+
+@pytest.mark.anyio
+async def test_seed_is_deterministic():
+    engine, counts, rows = await seeded(seed=7)
+    await engine.dispose()
+    engine, again, same = await seeded(seed=7)
+    await engine.dispose()
+    engine, other, different = await seeded(seed=8)
+    await engine.dispose()
+    assert counts == again and rows == same
+    assert rows[Pet] != different[Pet]
+
+
+@pytest.mark.anyio
+async def test_seed_distributions():
+    engine, counts, rows = await seeded(seed=1, nameCardinality=50)
+    try:
+        assert len(rows[Pet]) == 500 and len(rows[Order]) == 200
+        assert len(rows[OrderPet]) == counts["order_pet"] > 200
+
+        #  every ordered pet is reserved, sold once its order is delivered
+        orderStatus = {order.id: order.status for order in rows[Order]}
+        petStatus = {pet.id: pet.status for pet in rows[Pet]}
+        for line in rows[OrderPet]:
+            expected = (
+                "sold" if orderStatus[line.order_id] == "delivered" else "pending"
+            )
+            assert petStatus[line.pet_id] == expected
+        ordered = {line.pet_id for line in rows[OrderPet]}
+        assert all(
+            status == "available"
+            for id, status in petStatus.items()
+            if id not in ordered
+        )
+
+        statuses = [order.status for order in rows[Order]]
+        assert statuses.count("delivered") > statuses.count("placed")
+        names = [pet.name for pet in rows[Pet]]
+        assert len(set(names)) <= 50
+        assert max(names.count(name) for name in names) > 500 / 50
+
+        with pytest.raises(ValueError, match="not empty"):
+            await seed(engine, pets=10, orders=1)
+    finally:
+        await engine.dispose()
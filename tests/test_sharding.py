@@ -0,0 +1,174 @@
+import datetime
+
+import pytest
+from sqlalchemy import update
+
+from app import create_app
+from lib.sharding import Shards
+from models.entities import Order
+from models.repositories import ArchiveRepo, OrderRepo
+
+from .conftest import TEST_CONFIG, init_db
+from .test_archive import later
+
+
+@pytest.fixture(scope="module")
+async def app(tmp_path_factory):
+    #  orders go to two shard files, pets stay in the in-memory main database
+    shardDir = tmp_path_factory.mktemp("shards")
+    app = create_app(
+        {
+            **TEST_CONFIG,
+            "SHARD_URLS": [
+                f"sqlite+aiosqlite:///{shardDir}/orders-{index}.db"
+                for index in range(2)
+            ],
+        }
+    )
+    async with app.middleware.options.SessionLocal() as session:
+        await init_db(session.bind)
+        await session.close()
+    await app.middleware.options.Shards.start()
+    yield app
+
+
+def shards(app) -> Shards:
+    return app.middleware.options.Shards
+
+
+@pytest.mark.anyio
+async def test_order_ids_route_to_their_shard(app):
+    ids = []
+    for index in (0, 1, 1, 0, 1):
+        async with shards(app).session(index) as session:
+            order = await OrderRepo.create(
+                session, {"status": "placed"}, petIds=[], shard=(index, 2)
+            )
+            await session.flush()
+            assert shards(app).index(order.id) == index
+            ids.append(order.id)
+    assert ids == [1, 2, 4, 3, 6]
+
+    #  nor are the ids of archived orders handed out again
+    async with shards(app).session(1) as session:
+        await session.execute(
+            update(Order).where(Order.id == 6).values(status="delivered")
+        )
+        assert await ArchiveRepo.archiveOrders(session, later()) == 1
+        order = await OrderRepo.create(
+            session, {"status": "placed"}, petIds=[], shard=(1, 2)
+        )
+        await session.flush()
+        assert order.id == 8
+    ids[-1] = order.id
+
+    #  pages merge the shards in id order, whatever the limit and offset
+    for limit, offset in ((10, 0), (2, 0), (2, 1), (3, 3), (2, 5)):
+        page = await shards(app).scatter(
+            lambda session, n: OrderRepo.fetchAllRows(session, limit=n),
+            limit,
+            offset,
+        )
+        assert [order.id for order in page] == sorted(ids)[offset : offset + limit]
+
+
+@pytest.mark.anyio
+async def test_sharded_orders_through_the_api(app, client, make_pets):
+    listed = {order["id"] for order in client.get("/api/v3/orders/").json()}
+
+    data = {"petIds": [{"quantity": 2, "petId": make_pets[1].id}]}
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 201
+    first = post_res.json()["id"]
+    data = {"petIds": [{"quantity": 1, "petId": make_pets[2].id}]}
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 201
+    second = post_res.json()["id"]
+    assert shards(app).index(first) != shards(app).index(second)
+
+    #  reserved in the main database, so a second order for the pet is refused
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 409
+    assert client.get(f"/api/v3/pets/{make_pets[2].id}").json()["status"] == "pending"
+
+    get_res = client.get(f"/api/v3/orders/{first}", params={"includePets": "yes"})
+    assert get_res.status_code == 200
+    assert get_res.json()["pets"][0]["name"] == make_pets[1].name
+
+    get_res = client.get(
+        "/api/v3/orders/",
+        params={"includePets": "yes", "fields": "id,pets", "limit": 100},
+    )
+    orders = [order for order in get_res.json() if order["id"] not in listed]
+    assert [order["id"] for order in orders] == sorted([first, second])
+    assert [order["pets"][0]["id"] for order in orders] == [
+        make_pets[1].id,
+        make_pets[2].id,
+    ]
+
+    post_res = client.post("/api/v3/orders:batchGet", json={"ids": [second, first, 0]})
+    assert [order["id"] for order in post_res.json()["orders"]] == [second, first]
+    assert post_res.json()["missing"] == [0]
+
+    assert client.delete(f"/api/v3/orders/{second}").status_code == 204
+    assert client.get(f"/api/v3/orders/{second}").status_code == 404
+
+
+@pytest.mark.anyio
+async def test_sharded_transition(app, client):
+    ids = []
+    for _ in range(4):
+        post_res = client.post("/api/v3/orders", json={"petIds": []})
+        ids.append(post_res.json()["id"])
+    body = {"status": "approved", "ids": [ids[3], ids[0], ids[1], 0]}
+    post_res = client.post("/api/v3/orders:transition", json=body)
+    assert post_res.json()["updated"] == sorted([ids[0], ids[1], ids[3]])
+    assert post_res.json()["missing"] == [0]
+
+    body = {"status": "delivered", "filter": {"status": "approved"}}
+    post_res = client.post("/api/v3/orders:transition", json=body)
+    assert set(post_res.json()["updated"]) >= {ids[0], ids[1], ids[3]}
+    assert client.get(f"/api/v3/orders/{ids[2]}").json()["status"] == "placed"
+
+
+@pytest.mark.anyio
+async def test_sharded_ship_date_range(app, client):
+    #  each shard's page is in ship date order, and so is the merged page
+    for index, day in ((0, 9), (1, 3), (0, 5), (1, 7)):
+        shipDate = datetime.datetime(2031, 3, day, tzinfo=datetime.timezone.utc)
+        async with shards(app).session(index) as session:
+            await OrderRepo.create(
+                session,
+                {"status": "approved", "ship_date": shipDate},
+                petIds=[],
+                shard=(index, 2),
+            )
+    params = {
+        "status": "approved",
+        "shipDateFrom": "2031-03-01",
+        "shipDateTo": "2031-03-31",
+    }
+    get_res = client.get("/api/v3/orders", params=params)
+    assert [order["shipDate"] for order in get_res.json()] == [
+        "2031-03-03",
+        "2031-03-05",
+        "2031-03-07",
+        "2031-03-09",
+    ]
+    ids = [order["id"] for order in get_res.json()]
+    params = {**params, "offset": 1, "limit": 2, "fields": "id"}
+    get_res = client.get("/api/v3/orders", params=params)
+    assert get_res.json() == [{"id": id} for id in ids[1:3]]
+
+
+@pytest.mark.anyio
+async def test_sharded_pet_transition_keeps_ordered_pets_pending(app, client):
+    #  the orders holding the pet are in a shard, the pet in the main database
+    rex = client.post("/api/v3/pets", json={"name": "rex"}).json()["id"]
+    data = {"petIds": [{"petId": rex, "quantity": 1}]}
+    post_res = client.post("/api/v3/orders", json=data)
+    assert post_res.status_code == 201
+
+    body = {"status": "available", "ids": [rex]}
+    post_res = client.post("/api/v3/pets:transition", json=body)
+    assert post_res.json()["invalid"] == [{"id": rex, "status": "pending"}]
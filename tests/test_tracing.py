@@ -0,0 +1,73 @@
+import logging
+
+import pytest
+
+from app import create_app
+from lib.tracing import currentTrace, requestId, span, traceBuffer, Trace
+
+from .conftest import TEST_CONFIG, init_db
+
+
+@pytest.fixture(scope="module")
+async def app():
+    app = create_app({**TEST_CONFIG, "TRACE_SAMPLE_RATE": 1.0})
+    async with app.middleware.options.SessionLocal() as session:
+        await init_db(session.bind)
+        await session.close()
+    yield app
+
+
+@pytest.mark.anyio
+async def test_requests_are_traced(client):
+    res = client.post(
+        "/api/v3/pets", json={"name": "rex"}, headers={"X-Request-ID": "r-1"}
+    )
+    assert res.status_code == 201
+    assert res.headers["x-request-id"] == "r-1"
+    res = client.get(f"/api/v3/pets/{res.json()['id']}")
+    assert len(res.headers["x-request-id"]) == 32
+
+    res = client.get("/api/v3/traces", params={"limit": 2})
+    assert res.status_code == 403
+    admin = {"Authorization": "Bearer TestAdminJWTtoken"}
+    res = client.get("/api/v3/traces", params={"limit": 3}, headers=admin)
+    assert res.status_code == 200
+    forbidden, get, post = res.json()
+    assert forbidden["status"] == 403
+    assert (post["requestId"], post["method"], post["status"]) == ("r-1", "POST", 201)
+    names = [span["name"] for span in post["spans"]]
+    assert "auth.decode_token" in names
+    assert {"PetSchema.load", "PetRepo.create", "PetSchema.dump"} <= set(names)
+    assert get["path"].startswith("/api/v3/pets/")
+    assert "PetRepo.fetchById" in [span["name"] for span in get["spans"]]
+
+
+@pytest.mark.anyio
+async def test_spans_nest_and_record_errors():
+    trace = Trace("r-2", "GET", "/")
+    token = currentTrace.set(trace)
+    try:
+        with span("outer"):
+            with pytest.raises(KeyError):
+                with span("inner", key="x"):
+                    raise KeyError("x")
+    finally:
+        currentTrace.reset(token)
+    inner, outer = trace.spans
+    assert inner.parent == outer.id and outer.parent is None
+    assert inner.attrs == {"key": "x", "error": "KeyError"}
+    #  without a trace, spans are no-ops
+    with span("untraced") as untraced:
+        assert untraced is None
+
+
+@pytest.mark.anyio
+async def test_log_records_carry_the_request_id(caplog):
+    token = requestId.set("r-3")
+    try:
+        with caplog.at_level(logging.INFO, logger="app.test"):
+            logging.getLogger("app.test").info("hello")
+    finally:
+        requestId.reset(token)
+    assert caplog.records[-1].requestId == "r-3"
+    assert traceBuffer.latest(1, minDurationMs=1e9) == []
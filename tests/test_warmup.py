@@ -0,0 +1,54 @@
+import logging
+
+import pytest
+from sqlalchemy import sql
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import create_app
+from lib.drivers import createEngine
+from lib.warmup import openPool, warmUp
+
+from .conftest import TEST_CONFIG, init_db
+
+
+@pytest.fixture(scope="module")
+async def app():
+    app = create_app({**TEST_CONFIG, "WARMUP": True})
+    async with app.middleware.options.SessionLocal() as session:
+        await init_db(session.bind)
+        await session.close()
+    yield app
+
+
+@pytest.mark.anyio
+async def test_warm_up_compiles_statements(app, caplog):
+    SessionLocal = app.middleware.options.SessionLocal
+    engine = SessionLocal.kw["bind"].sync_engine
+    engine.clear_compiled_cache()
+    with caplog.at_level(logging.INFO, logger="app.warmup"):
+        ms = await warmUp(SessionLocal, prereadTables=("pet", "order_pet", "nothing"))
+    assert ms > 0
+    assert not [record for record in caplog.records if record.levelno >= logging.WARN]
+    assert "Warmed up in" in caplog.records[-1].getMessage()
+    assert len(engine._compiled_cache) >= 10
+    #  nothing written is kept
+    async with SessionLocal() as session:
+        count = await session.execute(sql.text("SELECT count(*) FROM pet WHERE id = 0"))
+        assert count.scalar() == 0
+
+
+@pytest.mark.anyio
+async def test_open_pool_fills_the_pool(tmp_path):
+    engine = createEngine(f"sqlite+aiosqlite:///{tmp_path}/pool.db")
+    try:
+        assert await openPool(async_sessionmaker(bind=engine)) == engine.pool.size()
+        assert engine.pool.checkedin() == engine.pool.size()
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_ready_reports_the_warm_up(client):
+    res = client.get("/api/v3/ready", headers={"Authorization": ""})
+    assert res.status_code == 200
+    assert res.json()["ready"] and res.json()["warmupMs"] > 0
@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import logging
+
+from connexion import request
+
+from lib.memory import memoryDiagnostics
+from lib.metrics import metrics as appMetrics
+from lib.tracing import traceBuffer
+from lib.utils import format_errors_return
+
+logger = logging.getLogger("app.admin")
+
+ADMIN_SCOPE = "admin:diagnostics"
+
+
+def adminOnly(view):
+    """Answer 403 unless the request's token has ADMIN_SCOPE.  validate_scope lets
+    every token through, so the admin views check the scope themselves"""
+
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        tokenInfo = request.context.get("token_info") or {}
+        scopes = tokenInfo.get("scope", tokenInfo.get("scopes", []))
+        if isinstance(scopes, str):
+            scopes = scopes.split()
+        if ADMIN_SCOPE not in scopes:
+            logger.warning(f"Admin request without the {ADMIN_SCOPE} scope")
+            return format_errors_return(
+                f"The {ADMIN_SCOPE} scope is required",
+                status=403,
+                title="Forbidden",
+                type="Authorization Errors",
+            )
+        return await view(*args, **kwargs)
+
+    return wrapper
+
+
+async def metrics():
+    logger.debug("Fetching metrics")
+    return appMetrics.snapshot(), 200
+
+
+async def ready():
+    #  the server only takes requests once the lifespan warm-up is done
+    return {"ready": True, "warmupMs": request.state.warmupMs}, 200
+
+
+@adminOnly
+async def traces(limit: int = 50, minDurationMs: float = 0.0):
+    logger.debug("Fetching traces")
+    return traceBuffer.latest(limit, minDurationMs), 200
+
+
+@adminOnly
+async def memory():
+    logger.debug("Fetching memory diagnostics")
+    if not _memoryEnabled():
+        return _memoryDisabled()
+    status = await _offLoop(memoryDiagnostics.status)
+    status["gc"] = memoryDiagnostics.gcStats()
+    status["objects"] = await _offLoop(memoryDiagnostics.objectCounts)
+    return status, 200
+
+
+@adminOnly
+async def memoryTracing(body):
+    if not _memoryEnabled():
+        return _memoryDisabled()
+    logger.info(f"Memory tracing {'started' if body['enabled'] else 'stopped'}")
+    if body["enabled"]:
+        frames = body.get("frames") or request.state.config.get(
+            "MEMORY_TRACE_FRAMES", 10
+        )
+        return memoryDiagnostics.start(frames), 200
+    return memoryDiagnostics.stop(), 200
+
+
+@adminOnly
+async def memorySnapshot():
+    if not _memoryEnabled():
+        return _memoryDisabled()
+    logger.info("Taking a memory snapshot")
+    memoryDiagnostics.keep = request.state.config.get("MEMORY_SNAPSHOTS", 5)
+    try:
+        return await _offLoop(memoryDiagnostics.snapshot), 201
+    except ValueError as err:
+        return format_errors_return(str(err), 409)
+
+
+@adminOnly
+async def memoryTop(id, limit=20, groupBy="lineno", base=None):
+    logger.debug(f"Fetching memory snapshot {id} against {base}")
+    if not _memoryEnabled():
+        return _memoryDisabled()
+    try:
+        if base is None:
+            stats = await _offLoop(memoryDiagnostics.top, id, limit, groupBy)
+        else:
+            stats = await _offLoop(memoryDiagnostics.diff, id, base, limit, groupBy)
+        return stats, 200
+    except KeyError as err:
+        return format_errors_return(f"Snapshot {err} not found", status=404)
+
+
+def _memoryEnabled() -> bool:
+    return bool(request.state.config.get("MEMORY_DIAGNOSTICS"))
+
+
+def _memoryDisabled():
+    return format_errors_return("Memory diagnostics are disabled", status=404)
+
+
+async def _offLoop(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(fn, *args)
+    )
@@ -0,0 +1,58 @@
+import datetime
+import traceback
+import logging
+
+from connexion.exceptions import ServerError
+
+from app import get_session
+from lib.utils import format_errors_return
+from models.repositories import AnalyticsRepo
+
+logger = logging.getLogger("app.analytics")
+
+
+async def petSales(start=None, end=None, bucket="day", petId=None, offset=0, limit=100):
+    logger.debug(f"Fetching pet sales from {start} to {end} by {bucket}")
+    try:
+        start, end = _parseRange(start, end)
+        async with get_session() as session:
+            sales = await AnalyticsRepo.petSales(
+                session, start, end, bucket, petId=petId, limit=limit, offset=offset
+            )
+            return sales, 200
+    except ValueError as err:
+        return format_errors_return(str(err), 400)
+    except Exception as err:
+        logger.error(
+            f"Server error occurred Fetching pet sales from {start} to {end}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+async def orderCounts(start=None, end=None, bucket="day", status=None):
+    logger.debug(f"Fetching order counts from {start} to {end} by {bucket}")
+    try:
+        start, end = _parseRange(start, end)
+        async with get_session() as session:
+            counts = await AnalyticsRepo.orderCounts(
+                session, start, end, bucket, status=status
+            )
+            return counts, 200
+    except ValueError as err:
+        return format_errors_return(str(err), 400)
+    except Exception as err:
+        logger.error(
+            f"Server error occurred Fetching order counts from {start} to {end}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+def _parseRange(start, end):
+    try:
+        start = datetime.date.fromisoformat(start) if start else None
+        end = datetime.date.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+    if start and end and start > end:
+        raise ValueError("start must not be after end")
+    return start, end
@@ -0,0 +1,34 @@
+import logging
+
+from connexion import request
+from starlette.responses import StreamingResponse
+
+from lib.utils import format_errors_return
+
+logger = logging.getLogger("app.changes")
+
+
+async def stream(entity=None, status=None):
+    #  Server-sent events for committed pet and order writes, from Last-Event-ID on
+    changeFeed = getattr(request.state, "changeFeed", None)
+    if not changeFeed:
+        return _error("Change feed is disabled", 503, title="Unavailable")
+    lastEventId = request.headers.get("last-event-id")
+    try:
+        lastEventId = int(lastEventId) if lastEventId else None
+    except ValueError:
+        return _error(f"Invalid Last-Event-ID: {lastEventId}", 400)
+    logger.debug(
+        f"Streaming changes for entity: {entity}, status: {status} from {lastEventId}"
+    )
+    return StreamingResponse(
+        changeFeed.stream(entity, status, lastEventId),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _error(detail, status, **kwargs):
+    #  the operation has two content types, so errors must name theirs
+    body, status = format_errors_return(detail, status, **kwargs)
+    return body, status, {"Content-Type": "application/json"}
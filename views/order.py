@@ -1,64 +1,190 @@
+import asyncio
+import datetime
 import traceback
 
-from connexion import NoContent
+from connexion import NoContent, request
 import logging
 
 from connexion.exceptions import ServerError
 from marshmallow import ValidationError
 
 from app import get_session
+from lib.cache import cached
+from lib.coalesce import coalesce
+from lib.idempotency import idempotent
+from lib.sharding import attachPets
+from lib.transitions import emptySummary, mergeSummary
+from lib.transitions import transition as bulkTransition
 from lib.utils import format_errors_return
 from models.entities import Order
-from models.repositories import OrderRepo, PetRepo
+from models.repositories import ArchiveRepo, OrderRepo, PetRepo
 from schemas.schemas import OrderSchema, OrderPetSchema
 
 logger = logging.getLogger("app.order")
 
 
-async def get(_id, includePets=None):
+@coalesce("views.order.get")
+async def get(_id, includePets=None, fields=None):
     logger.debug(f"Fetching order with id {_id}")
     try:
-        async with get_session() as session:
-            includePets = "yes" == includePets
-            order = await OrderRepo.fetchById(session, _id, includePets=includePets)
+        includePets = "yes" == includePets
+        schemaClass = OrderPetSchema if includePets else OrderSchema
+        fields = schemaClass.parseFields(fields)
+        loadPets = includePets and (not fields or "pets" in fields)
+        shardPets = loadPets and bool(_shards())
+        async with _orderSession(_id) as session:
+            order = await OrderRepo.fetchById(
+                session,
+                _id,
+                includePets=loadPets and not shardPets,
+                fields=_loadFields(fields, shardPets),
+            )
             if not order:
-                return format_errors_return("Order not found", status=404)
-            schema = OrderPetSchema() if includePets else OrderSchema()
-            return schema.dump(order), 200
-    except Exception as err:
+                # completed orders may have been moved to the archive
+                order = await ArchiveRepo.fetchById(
+                    session,
+                    _id,
+                    includePets=loadPets and not shardPets,
+                    fields=_loadFields(fields, shardPets),
+                )
+        if not order:
+            return format_errors_return("Order not found", status=404)
+        if shardPets:
+            await _attachPets([order])
+        schema = schemaClass(fields=fields)
+        return schema.dump(order), 200
+    except (ValidationError, Exception) as err:
+        if isinstance(err, ValidationError):
+            return format_errors_return(err.messages, 400)
         logger.error(
             f"Server error occurred Fetching order with id {_id}\n {str(err)}\n{traceback.format_exc()}"
         )
         raise ServerError
 
 
+async def batchGet(body, includePets=None):
+    ids = body["ids"]
+    logger.debug(f"Fetching orders with ids {ids}")
+    try:
+        includePets = "yes" == includePets
+        shards = _shards()
+        if shards:
+            byShard = {}
+            for id in dict.fromkeys(ids):
+                byShard.setdefault(shards.index(id), []).append(id)
+
+            async def fetch(index):
+                async with shards.session(index) as session:
+                    return await _fetchByIds(session, byShard[index], includePets=False)
+
+            pages = await asyncio.gather(*[fetch(index) for index in byShard])
+            orders = [order for page in pages for order in page]
+            if includePets:
+                await _attachPets(orders)
+        else:
+            async with get_session() as session:
+                orders = await _fetchByIds(session, ids, includePets=includePets)
+        byId = {order.id: order for order in orders}
+        orders = [byId[id] for id in dict.fromkeys(ids) if id in byId]
+        missing = [id for id in dict.fromkeys(ids) if id not in byId]
+        schema = OrderPetSchema(many=True) if includePets else OrderSchema(many=True)
+        return {"orders": schema.dump(orders), "missing": missing}, 200
+    except Exception as err:
+        logger.error(
+            f"Server error occurred Fetching orders with ids {ids}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+async def _fetchByIds(session, ids, includePets):
+    orders = await OrderRepo.fetchByIds(session, ids, includePets=includePets)
+    found = {order.id for order in orders}
+    if len(found) < len(set(ids)):
+        orders += await ArchiveRepo.fetchByIds(
+            session, [id for id in ids if id not in found], includePets
+        )
+    return orders
+
+
+async def transition(body):
+    status = body["status"]
+    logger.debug(f"Moving orders to status {status}")
+    if ("ids" in body) == ("filter" in body):
+        return format_errors_return("Send either ids or filter", 400)
+    try:
+        conditions = dict(body.get("filter") or {})
+        shipDates = _parseShipDates(
+            conditions.pop("shipDateFrom", None), conditions.pop("shipDateTo", None)
+        )
+        options = {
+            "ids": body.get("ids"),
+            "conditions": conditions,
+            "chunkSize": request.state.config.get("BULK_TRANSITION_CHUNK_SIZE", 500),
+            **({} if "ids" in body else shipDates),
+        }
+        shards = _shards()
+        if shards:
+            summary = await _transitionSharded(shards, status, options)
+        else:
+            summary = await bulkTransition(OrderRepo, get_session, status, **options)
+        logger.info(f"Moved {len(summary['updated'])} orders to status {status}")
+        return summary, 200
+    except (ValidationError, Exception) as err:
+        if isinstance(err, ValidationError):
+            return format_errors_return(err.messages, 400)
+        logger.error(
+            f"Server error occurred Moving orders to status {status}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+async def _transitionSharded(shards, status, options):
+    #  every shard moves its own orders, all at once
+    byShard = {index: options for index in range(shards.count)}
+    if options["ids"] is not None:
+        byShard = {}
+        for id in dict.fromkeys(options["ids"]):
+            byShard.setdefault(shards.index(id), {**options, "ids": []})["ids"].append(
+                id
+            )
+
+    async def run(index):
+        return await bulkTransition(
+            OrderRepo, lambda: shards.session(index), status, **byShard[index]
+        )
+
+    summary = emptySummary()
+    for shardSummary in await asyncio.gather(*[run(index) for index in byShard]):
+        mergeSummary(summary, shardSummary)
+    for key, rows in summary.items():
+        rows.sort(key=lambda row: row["id"] if key == "invalid" else row)
+    return summary
+
+
+@idempotent("views.order.add")
 async def add(body):
     logger.debug(f"Adding order with data: {body}")
     try:
+        schema = (
+            OrderSchema()
+        )  # This is where you could add 'context' to schema if needed
+        data = schema.load(body)
+        shards = _shards()
+        if shards:
+            return await _createSharded(shards, schema, data)
+        writeBatcher = getattr(request.state, "writeBatcher", None)
+        if writeBatcher:
+            # committed together with other orders by the single writer task
+            return await writeBatcher.submit(
+                lambda session: _create(session, schema, data)
+            )
         async with get_session() as session:
-            schema = (
-                OrderSchema()
-            )  # This is where you could add 'context' to schema if needed
-            data = schema.load(body)
-            petIds = data.get(
-                "petIds", []
-            )  # The route spec requires at least one petId
-
-            #  We perform all database validations in the view, after the schema has formatted the data
-            for petId in petIds:
-                pet = await PetRepo.fetchById(session, petId["pet_id"])
-                if not pet:
-                    return format_errors_return(
-                        f"Invalid petId: Pet {petId['pet_id']} does not exist",
-                        status=400,
-                    )
-
-            order = await OrderRepo.create(session, data, petIds=petIds)
+            response = await _create(session, schema, data)
             await session.commit()
-            order = await OrderRepo.fetchById(
-                session, order.id
-            )  # get updated order from db
-            return schema.dump(order), 201
+            return response
+    except OrderRejected as err:
+        logger.warning(f"Order not created with data: {body}: {str(err)}")
+        return err.response
     except (ValidationError, Exception) as err:
         if isinstance(err, ValidationError):
             logger.warning(f"Order not created with data: {body}")
@@ -69,10 +195,85 @@ async def add(body):
         raise ServerError
 
 
-async def update(_id, body):
-    logger.debug(f"Updating pet with id: {_id}, body: {body}")
+class OrderRejected(Exception):
+    #  Raised with an error response to roll back the order's transaction (or its
+    #    savepoint in a write batch), e.g. after a partial pet reservation
+    def __init__(self, response):
+        super().__init__(response[0]["detail"])
+        self.response = response
+
+
+async def _create(session, schema, data):
+    await _reserve(session, data.get("petIds", []))
+    return await _store(session, schema, data)
+
+
+async def _createSharded(shards, schema, data):
+    #  The pets are reserved in the main database and the order stored in a shard, in
+    #    two transactions; if storing fails the reservation is given back
+    petIds = data.get("petIds", [])
+    async with get_session() as session:
+        await _reserve(session, petIds)
     try:
+        index = shards.pick()
+        async with shards.session(index) as session:
+            return await _store(session, schema, data, shard=(index, shards.count))
+    except Exception:
         async with get_session() as session:
+            await PetRepo.release(session, [petId["pet_id"] for petId in petIds])
+        raise
+
+
+async def _reserve(session, petIds):
+    #  The route spec requires at least one petId.  Reserve all the pets with one
+    #    conditional UPDATE in the order's transaction, so two orders can never both
+    #    claim the same pet
+    ids = list(dict.fromkeys(petId["pet_id"] for petId in petIds))
+    reserved = await PetRepo.reserve(session, ids, status="pending")
+    if len(reserved) != len(ids):
+        pets = {pet.id for pet in await PetRepo.fetchByIds(session, ids)}
+        for id in ids:
+            if id not in pets:
+                raise OrderRejected(
+                    format_errors_return(
+                        f"Invalid petId: Pet {id} does not exist", status=400
+                    )
+                )
+        unavailable = [id for id in ids if id not in reserved]
+        raise OrderRejected(
+            format_errors_return(
+                f"Pets not available: {unavailable}",
+                status=409,
+                title="Conflict",
+                type="Reservation Errors",
+            )
+        )
+
+
+async def _store(session, schema, data, shard=None):
+    order = await OrderRepo.create(
+        session, data, petIds=data.get("petIds", []), shard=shard
+    )
+    await session.flush()
+    order = await OrderRepo.fetchById(session, order.id)  # get updated order from db
+    return schema.dump(order), 201
+
+
+async def update(_id, body):
+    logger.debug(f"Updating order with id: {_id}, body: {body}")
+    return await _update(_id, body, replacePets=True)
+
+
+async def patch(_id, body):
+    logger.debug(f"Patching order with id: {_id}, body: {body}")
+    return await _update(_id, body, replacePets=False)
+
+
+async def _update(_id, body, replacePets):
+    #  PUT replaces the order's pet lines with petIds, PATCH only adds or changes the
+    #    lines in petIds and drops those in removePetIds
+    try:
+        async with _orderSession(_id) as session:
             order = await OrderRepo.fetchById(session, _id)
             if not order:
                 return format_errors_return("Order not found", status=404)
@@ -80,24 +281,51 @@ async def update(_id, body):
             # Pass instance in case validations need current attributes
             data = schema.load(body, instance=order, partial=True)
 
-            #  validate pet_ids if passed and changed
-            orderPetIds = [petId.pet_id for petId in order.pet_ids]
             petIds = data.pop("petIds", [])
-            for petId in petIds:
-                if petId["pet_id"] not in orderPetIds:
-                    pet = await PetRepo.fetchById(session, petId["pet_id"])
-                    if not pet:
-                        return format_errors_return(
-                            f"Invalid petId: Pet {petId['pet_id']} does not exist",
-                            status=400,
-                        )
-
-            order = await OrderRepo.update(session, data, order=order, petIds=petIds)
-            await session.commit()
-            order = await OrderRepo.fetchById(
-                session, order.id
-            )  # get updated order from db
+            removePetIds = data.pop("removePetIds", [])
+            if replacePets and removePetIds:
+                return format_errors_return(
+                    {"removePetIds": ["Only PATCH removes lines, PUT replaces them"]},
+                    400,
+                )
+            added, removed = OrderRepo.changedPetIds(
+                order, petIds, removePetIds, replacePets
+            )
+            shards = _shards()
+            if not shards:
+                #  reserved and given back in the order's transaction
+                if added:
+                    await _reserve(session, [{"pet_id": id} for id in added])
+                if removed:
+                    await PetRepo.release(session, removed)
+            elif added:
+                async with get_session() as petSession:
+                    await _reserve(petSession, [{"pet_id": id} for id in added])
+
+            try:
+                #  the order's lines are kept current by the update, so no re-fetch
+                #    is needed
+                order = await OrderRepo.update(
+                    session,
+                    data,
+                    order=order,
+                    petIds=petIds,
+                    removePetIds=removePetIds,
+                    replacePets=replacePets,
+                )
+                await session.commit()
+            except Exception:
+                if shards and added:
+                    async with get_session() as petSession:
+                        await PetRepo.release(petSession, added)
+                raise
+            if shards and removed:
+                async with get_session() as petSession:
+                    await PetRepo.release(petSession, removed)
             return schema.dump(order), 200
+    except OrderRejected as err:
+        logger.warning(f"Order not updated with id: {_id}: {str(err)}")
+        return err.response
     except (ValidationError, Exception) as err:
         if isinstance(err, ValidationError):
             logger.warning(f"Order not updated with id: {_id}")
@@ -111,7 +339,7 @@ async def update(_id, body):
 async def delete(_id):
     logger.debug(f"Deleting pet with id {_id}")
     try:
-        async with get_session() as session:
+        async with _orderSession(_id) as session:
             order = await OrderRepo.fetchById(session, _id)
             if not order:
                 return format_errors_return("Order not found", status=404)
@@ -125,29 +353,165 @@ async def delete(_id):
         raise ServerError
 
 
-async def find(petId=None, status=None, includePets=None, offset=0, limit=10):
-    logger.debug(f"Finding orders with status: {status}, petId: {petId}")
+@cached(
+    "views.order.find",
+    tables=("order", "order_pet", "pet", "order_archive", "order_pet_archive"),
+)
+@coalesce("views.order.find")
+async def find(
+    petId=None,
+    status=None,
+    includePets=None,
+    fields=None,
+    offset=0,
+    limit=10,
+    shipDateFrom=None,
+    shipDateTo=None,
+):
+    logger.debug(
+        f"Finding orders with status: {status}, petId: {petId}, shipped from {shipDateFrom} to {shipDateTo}"
+    )
     try:
-        async with get_session() as session:
-            includePets = "yes" == includePets
-            # No need to validate limit, offset as C3 does that
-            schema = (
-                OrderPetSchema(many=True) if includePets else OrderSchema(many=True)
+        includePets = "yes" == includePets
+        schemaClass = OrderPetSchema if includePets else OrderSchema
+        fields = schemaClass.parseFields(fields)
+        # No need to validate limit, offset as C3 does that
+        schema = schemaClass(many=True, fields=fields)
+        conditions = {}
+        if status:
+            conditions["status"] = status
+        shipDates = _parseShipDates(shipDateFrom, shipDateTo)
+        includePets = includePets and (not fields or "pets" in fields)
+        shards = _shards()
+        if shards:
+            orders = await _findSharded(
+                shards, conditions, petId, includePets, limit, offset, fields, shipDates
             )
-            conditions = {}
-            if status:
-                conditions["status"] = status
-            orders = await OrderRepo.fetchAll(
+            return schema.dump(orders), 200
+        async with get_session() as session:
+            orders = await OrderRepo.fetchAllRows(
                 session,
                 petId=petId,
                 conditions=conditions,
                 includePets=includePets,
                 limit=limit,
                 offset=offset,
+                fields=fields,
+                **shipDates,
             )
+            if len(orders) < limit:
+                #  archived orders are listed after the live ones, so the archive only
+                #    fills what is left of the page past the last live order
+                if orders or not offset:
+                    live = offset + len(orders)
+                else:
+                    live = await OrderRepo.count(
+                        session, conditions, petId, **shipDates
+                    )
+                orders += await ArchiveRepo.fetchAll(
+                    session,
+                    petId=petId,
+                    conditions=conditions,
+                    includePets=includePets,
+                    limit=limit - len(orders),
+                    offset=max(0, offset - live),
+                    fields=fields,
+                    **shipDates,
+                )
             return schema.dump(orders), 200
-    except Exception as err:
+    except (ValidationError, Exception) as err:
+        if isinstance(err, ValidationError):
+            return format_errors_return(err.messages, 400)
         logger.error(
             f"Server error occurred Finding orders with status: {status}, petId: {petId}\n {str(err)}\n{traceback.format_exc()}"
         )
         raise ServerError
+
+
+async def _findSharded(
+    shards, conditions, petId, includePets, limit, offset, fields, shipDates
+):
+    loadFields = _loadFields(fields, includePets)
+    key = None
+    if any(shipDates.values()):
+        #  shards' pages of a ship date range are merged in the order they come in
+        loadFields = loadFields and tuple(dict.fromkeys(loadFields + ("shipDate",)))
+        key = lambda order: (order.ship_date, order.id)
+    orders = await shards.scatter(
+        lambda session, n: OrderRepo.fetchAllRows(
+            session,
+            conditions=conditions,
+            petId=petId,
+            limit=n,
+            fields=loadFields,
+            **shipDates,
+        ),
+        limit,
+        offset,
+        key,
+    )
+    if len(orders) < limit:
+        #  as on one database, archived orders follow the live ones of all shards
+        if orders or not offset:
+            live = offset + len(orders)
+        else:
+            counts = await shards.gather(
+                lambda session: OrderRepo.count(session, conditions, petId, **shipDates)
+            )
+            live = sum(counts)
+        orders += await shards.scatter(
+            lambda session, n: ArchiveRepo.fetchAll(
+                session,
+                conditions=conditions,
+                petId=petId,
+                limit=n,
+                fields=loadFields,
+                **shipDates,
+            ),
+            limit - len(orders),
+            max(0, offset - live),
+            key,
+        )
+    if includePets:
+        await _attachPets(orders)
+    return orders
+
+
+def _parseShipDates(shipDateFrom, shipDateTo):
+    shipDates = {}
+    for name, value in (("shipDateFrom", shipDateFrom), ("shipDateTo", shipDateTo)):
+        try:
+            shipDates[name] = datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValidationError({name: ["Invalid date format. Use YYYY-MM-DD"]})
+    if (
+        shipDateFrom
+        and shipDateTo
+        and shipDates["shipDateFrom"] > shipDates["shipDateTo"]
+    ):
+        raise ValidationError({"shipDateTo": ["Must not be before shipDateFrom"]})
+    return shipDates
+
+
+def _shards():
+    return getattr(request.state, "shards", None)
+
+
+def _orderSession(_id):
+    #  The session holding order _id: the main database's, or that of its shard
+    shards = _shards()
+    return shards.session(shards.index(_id)) if shards else get_session()
+
+
+def _loadFields(fields, shardPets):
+    #  sharded orders need their lines to look up their pets in the main database
+    if fields and shardPets and "petIds" not in fields:
+        return fields + ("petIds",)
+    return fields
+
+
+async def _attachPets(orders):
+    ids = list(dict.fromkeys(line.pet_id for order in orders for line in order.pet_ids))
+    async with get_session() as session:
+        pets = await PetRepo.fetchByIds(session, ids)
+    attachPets(orders, pets)
@@ -1,37 +1,110 @@
 import traceback
 
-from connexion import NoContent
+from connexion import NoContent, request
 import logging
 from connexion.exceptions import ServerError
 from marshmallow import ValidationError
 
 
+from lib.cache import cached
+from lib.coalesce import coalesce
+from lib.idempotency import idempotent
+from lib.transitions import transition as bulkTransition
 from lib.utils import format_errors_return
 from models.entities import Pet, Order
-from models.repositories import PetRepo
+from models.repositories import OrderRepo, PetRepo
 from schemas.schemas import PetSchema
 from app import get_session
 
 logger = logging.getLogger("app.pet")
 
 
-async def get(_id):
+@coalesce("views.pet.get")
+async def get(_id, fields=None):
     logger.debug(f"Fetching pet with id {_id}")
     try:
+        fields = PetSchema.parseFields(fields)
         async with get_session() as session:
-            pet = await PetRepo.fetchById(session, _id)
+            pet = await PetRepo.fetchById(session, _id, fields=fields)
             if not pet:
                 logger.warning(f"Pet not found: id {_id}")
                 return format_errors_return("Pet not found", status=404)
-            schema = PetSchema()
+            schema = PetSchema(fields=fields)
             return schema.dump(pet), 200
-    except Exception as err:
+    except (ValidationError, Exception) as err:
+        if isinstance(err, ValidationError):
+            return format_errors_return(err.messages, 400)
         logger.error(
             f"Server error occurred Fetching pet with id {_id}\n {str(err)}\n{traceback.format_exc()}"
         )
         raise ServerError
 
 
+async def batchGet(body):
+    ids = body["ids"]
+    logger.debug(f"Fetching pets with ids {ids}")
+    try:
+        async with get_session() as session:
+            pets = await PetRepo.fetchByIds(session, ids)
+            found = {pet.id for pet in pets}
+            missing = [id for id in dict.fromkeys(ids) if id not in found]
+            if missing:
+                logger.warning(f"Pets not found: ids {missing}")
+            schema = PetSchema(many=True)
+            return {"pets": schema.dump(pets), "missing": missing}, 200
+    except Exception as err:
+        logger.error(
+            f"Server error occurred Fetching pets with ids {ids}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+async def transition(body):
+    status = body["status"]
+    logger.debug(f"Moving pets to status {status}")
+    if ("ids" in body) == ("filter" in body):
+        return format_errors_return("Send either ids or filter", 400)
+    try:
+        repo = PetRepo
+        shards = getattr(request.state, "shards", None)
+        if shards and status == "available":
+            repo = _ShardedPetTransitions(shards)
+        summary = await bulkTransition(
+            repo,
+            get_session,
+            status,
+            ids=body.get("ids"),
+            conditions=body.get("filter"),
+            chunkSize=request.state.config.get("BULK_TRANSITION_CHUNK_SIZE", 500),
+        )
+        logger.info(f"Moved {len(summary['updated'])} pets to status {status}")
+        return summary, 200
+    except Exception as err:
+        logger.error(
+            f"Server error occurred Moving pets to status {status}\n {str(err)}\n{traceback.format_exc()}"
+        )
+        raise ServerError
+
+
+class _ShardedPetTransitions:
+    #  PetRepo for bulkTransition when orders are sharded: the pets the shards'
+    #    undelivered orders hold are looked up first, as the pet table's database
+    #    has no orders
+    fetchIds = staticmethod(PetRepo.fetchIds)
+
+    def __init__(self, shards):
+        self.shards = shards
+
+    async def transition(self, session, ids, status):
+        async def heldIds(shardSession):
+            return (await shardSession.scalars(OrderRepo.heldPetIds(ids))).all()
+
+        held = await self.shards.gather(heldIds)
+        held = [id for shardHeld in held for id in shardHeld]
+        return await PetRepo.transition(session, ids, status, held=held)
+
+
+@idempotent("views.pet.add")
 async def add(body):
     logger.debug(f"Adding pet with data: {body}")
     try:
@@ -96,9 +169,12 @@ async def delete(_id):
         raise ServerError
 
 
-async def find(status=None, name=None, offset=0, limit=10):
+@cached("views.pet.find", tables=("pet",))
+@coalesce("views.pet.find")
+async def find(status=None, name=None, fields=None, offset=0, limit=10):
     logger.debug(f"Finding pets with status: {status}, name: {name}")
     try:
+        fields = PetSchema.parseFields(fields)
         async with get_session() as session:
             # No need to validate limits as C3 does that
             conditions = {}
@@ -106,15 +182,18 @@ async def find(status=None, name=None, offset=0, limit=10):
                 conditions["status"] = status
             if name:
                 conditions["name"] = name
-            pets = await PetRepo.fetchAll(
+            pets = await PetRepo.fetchAllRows(
                 session,
                 conditions=conditions,
                 limit=limit,
                 offset=offset,
+                fields=fields,
             )
-            schema = PetSchema(many=True)
+            schema = PetSchema(many=True, fields=fields)
             return schema.dump(pets), 200
-    except Exception as err:
+    except (ValidationError, Exception) as err:
+        if isinstance(err, ValidationError):
+            return format_errors_return(err.messages, 400)
         logger.error(
             f"Server error occurred Finding pets with status: {status}, name: {name}\n {str(err)}\n{traceback.format_exc()}"
         )